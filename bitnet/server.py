@@ -1,19 +1,271 @@
+import json
 import os
+import queue
 import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-app = FastAPI()
-
 MODEL_PATH = os.getenv("BITNET_MODEL", "/BitNet/model/ggml-model-i2_s.gguf")
 
+# Warm worker pool: each worker is a long-lived llama-server process that loads
+# the GGUF model once and serves prompts over a local HTTP socket.
+LLAMA_SERVER_BIN = os.getenv("BITNET_SERVER_BIN", "/BitNet/build/bin/llama-server")
+POOL_SIZE = int(os.getenv("BITNET_POOL_SIZE", "1"))
+WORKER_BASE_PORT = int(os.getenv("BITNET_WORKER_BASE_PORT", "8090"))
+WORKER_THREADS = int(os.getenv("BITNET_THREADS", "2"))
+CTX_SIZE = int(os.getenv("BITNET_CTX_SIZE", "2048"))
+ACQUIRE_TIMEOUT = float(os.getenv("BITNET_ACQUIRE_TIMEOUT", "60"))
+HEALTH_INTERVAL = float(os.getenv("BITNET_HEALTH_INTERVAL", "2"))
+MAX_RESTART_BACKOFF = float(os.getenv("BITNET_MAX_RESTART_BACKOFF", "30"))
+
+# Defaults of /BitNet/run_inference.py, kept so replies look the same as before
+DEFAULT_N_PREDICT = 128
+DEFAULT_TEMPERATURE = 0.8
+
+# Keep the evaluated KV state of each worker's slot between requests, so a
+# prompt sharing a prefix with the previous one (the system prompt and the fixed
+# instructions) only evaluates the tokens after the shared part
+CACHE_PROMPT = os.getenv("BITNET_CACHE_PROMPT", "1") == "1"
+
+
+class BitNetWorker:
+    """
+    One warm llama-server process bound to 127.0.0.1:<port>.
+    """
+
+    def __init__(self, worker_id: int, port: int):
+        self.worker_id = worker_id
+        self.port = port
+        self.proc: subprocess.Popen | None = None
+        self.ready = False
+        self.restarts = 0
+        self.busy = False
+        self.last_error = ""
+        self._next_start = 0.0
+        self._backoff = 1.0
+        self.prompt_tokens = 0
+        self.prompt_tokens_cached = 0
+        self.prompt_eval_saved_ms = 0.0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def command(self) -> list[str]:
+        return [
+            LLAMA_SERVER_BIN,
+            "-m",
+            MODEL_PATH,
+            "-c",
+            str(CTX_SIZE),
+            "-t",
+            str(WORKER_THREADS),
+            "-ngl",
+            "0",
+            "-np",
+            "1",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(self.port),
+        ]
+
+    def start(self) -> None:
+        self.ready = False
+        self.proc = subprocess.Popen(
+            self.command(),
+            cwd="/BitNet",
+            stdout=subprocess.DEVNULL,
+        )
+        print(f"[bitnet] worker {self.worker_id} started pid={self.proc.pid} port={self.port}")
+
+    def stop(self) -> None:
+        self.ready = False
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def probe(self) -> bool:
+        """
+        llama-server answers /health with 200 once the model is loaded.
+        """
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/health", timeout=2) as r:
+                return r.status == 200
+        except Exception:
+            return False
+
+    def check(self) -> None:
+        """
+        Called by the supervisor: restart on crash (with backoff) and refresh readiness.
+        """
+        if not self.alive():
+            now = time.monotonic()
+            if self.proc is not None and self.ready:
+                self.last_error = f"exited with code {self.proc.returncode}"
+                print(f"[bitnet] worker {self.worker_id} {self.last_error}")
+            self.ready = False
+            if now < self._next_start:
+                return
+            self.restarts += 1
+            self._next_start = now + self._backoff
+            self._backoff = min(self._backoff * 2, MAX_RESTART_BACKOFF)
+            try:
+                self.start()
+            except OSError as e:
+                self.last_error = f"spawn failed: {e}"
+                print(f"[bitnet] worker {self.worker_id} {self.last_error}")
+            return
+
+        if not self.busy:
+            self.ready = self.probe()
+            if self.ready:
+                self._backoff = 1.0
+
+    def completion(self, payload: dict) -> dict:
+        req = urllib.request.Request(
+            f"{self.base_url}/completion",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(req, timeout=None) as r:
+            return json.loads(r.read().decode("utf-8"))
+
+    def completion_stream(self, payload: dict):
+        """
+        Yield llama-server's streamed chunks ({"content": ..., "stop": ...}) as they arrive.
+        """
+        req = urllib.request.Request(
+            f"{self.base_url}/completion",
+            data=json.dumps({**payload, "stream": True}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(req, timeout=None) as r:
+            for line in r:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                chunk = json.loads(line[5:].strip().decode("utf-8"))
+                yield chunk
+                if chunk.get("stop"):
+                    break
+
+    def record_prompt(self, stats: dict) -> None:
+        self.prompt_tokens += stats["prompt_tokens"]
+        self.prompt_tokens_cached += stats["cached_tokens"]
+        self.prompt_eval_saved_ms += stats["prompt_eval_saved_ms"]
+
+    def status(self) -> dict:
+        return {
+            "id": self.worker_id,
+            "port": self.port,
+            "pid": self.proc.pid if self.proc is not None else None,
+            "alive": self.alive(),
+            "ready": self.ready,
+            "busy": self.busy,
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+            "prompt_tokens": self.prompt_tokens,
+            "prompt_tokens_cached": self.prompt_tokens_cached,
+            "prompt_eval_saved_ms": round(self.prompt_eval_saved_ms, 1),
+        }
+
+
+class WorkerPool:
+    def __init__(self, size: int):
+        self.workers = [BitNetWorker(i, WORKER_BASE_PORT + i) for i in range(size)]
+        self._idle: queue.Queue[BitNetWorker] = queue.Queue()
+        self._stop = threading.Event()
+        self._supervisor: threading.Thread | None = None
+
+    def start(self) -> None:
+        for w in self.workers:
+            w.start()
+            self._idle.put(w)
+        self._supervisor = threading.Thread(target=self._supervise, name="bitnet-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        for w in self.workers:
+            w.stop()
+
+    def _supervise(self) -> None:
+        while not self._stop.is_set():
+            for w in self.workers:
+                w.check()
+            self._stop.wait(HEALTH_INTERVAL)
+
+    def acquire(self, timeout: float) -> BitNetWorker | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                w = self._idle.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if w.ready:
+                w.busy = True
+                return w
+            # still loading or restarting: hand it back and wait a bit
+            self._idle.put(w)
+            time.sleep(min(0.1, max(remaining, 0)))
+
+    def release(self, w: BitNetWorker) -> None:
+        w.busy = False
+        self._idle.put(w)
+
+    def status(self) -> dict:
+        workers = [w.status() for w in self.workers]
+        ready = sum(1 for w in workers if w["ready"])
+        return {
+            "status": "ok" if ready else "starting",
+            "pool_size": len(workers),
+            "ready_workers": ready,
+            "workers": workers,
+        }
+
+
+pool = WorkerPool(POOL_SIZE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pool.start()
+    yield
+    pool.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
 class ChatRequest(BaseModel):
     model: str | None = None
     messages: list[dict]
+    temperature: float | None = None
+    max_tokens: int | None = None
+    stream: bool = False
+
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return pool.status()
+
 
 @app.get("/v1/models")
 def models():
@@ -24,45 +276,145 @@ def models():
         ],
     }
 
+
+def render_prompt(messages: list[dict]) -> str:
+    """
+    The whole conversation in BitNet b1.58's chat format (llama.cpp "bitnet"
+    template), ending with the assistant turn to complete.
+    """
+    parts = []
+    for m in messages:
+        role = m.get("role")
+        content = (m.get("content") or "").strip()
+        if role == "system":
+            parts.append(f"System: {content}<|eot_id|>")
+        elif role == "user":
+            parts.append(f"User: {content}<|eot_id|>")
+        elif role == "assistant":
+            parts.append(f"Assistant: {content}<|eot_id|>")
+    if not any(m.get("role") == "user" for m in messages):
+        parts.append("User: Hello<|eot_id|>")
+    return "".join(parts) + "Assistant: "
+
+
+def prompt_stats(result: dict) -> dict:
+    """
+    Prompt tokens served from the slot's KV cache, and the prompt-eval time
+    they saved at this request's per-token prompt speed.
+    """
+    timings = result.get("timings") or {}
+    total = int(result.get("tokens_evaluated") or 0)
+    evaluated = int(timings.get("prompt_n") or total)
+    cached = max(total - evaluated, 0)
+    per_token_ms = float(timings.get("prompt_per_token_ms") or 0.0)
+    return {
+        "prompt_tokens": total,
+        "cached_tokens": cached,
+        "prompt_ms": round(float(timings.get("prompt_ms") or 0.0), 1),
+        "prompt_eval_saved_ms": round(cached * per_token_ms, 1),
+    }
+
+
+def _usage(stats: dict, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": completion_tokens,
+        "total_tokens": stats["prompt_tokens"] + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": stats["cached_tokens"]},
+        "prompt_ms": stats["prompt_ms"],
+        "prompt_eval_saved_ms": stats["prompt_eval_saved_ms"],
+    }
+
+
 @app.post("/v1/chat/completions")
 def chat(req: ChatRequest):
-    # берём последний user message
-    user_text = ""
-    for m in req.messages:
-        if m.get("role") == "user":
-            user_text = m.get("content", "")
-
-    prompt = user_text.strip() if user_text else "Hello"
-
-    # kth8/bitnet image содержит run_inference.py
-    # запускаем его как subprocess, чтобы получить текст
-    cmd = [
-        "python3",
-        "/BitNet/run_inference.py",
-        "-m",
-        MODEL_PATH,
-        "-p",
-        prompt,
-    ]
-
-    completed = subprocess.run(cmd, capture_output=True, text=True, cwd="/BitNet")
-
-    if completed.returncode != 0:
+    worker = pool.acquire(ACQUIRE_TIMEOUT)
+    if worker is None:
+        # a real error status, so streaming clients fail over instead of
+        # reading a JSON body as an empty event stream
+        return JSONResponse(
+            status_code=503,
+            content={
+                "error": {
+                    "message": f"no BitNet worker became available within {ACQUIRE_TIMEOUT:.0f}s",
+                    "type": "bitnet_pool_busy",
+                }
+            },
+        )
+
+    payload = {
+        "prompt": render_prompt(req.messages),
+        "n_predict": req.max_tokens or DEFAULT_N_PREDICT,
+        "temperature": req.temperature if req.temperature is not None else DEFAULT_TEMPERATURE,
+        "cache_prompt": CACHE_PROMPT,
+    }
+
+    if req.stream:
+        # the worker is released by the generator once the stream ends
+        return StreamingResponse(_stream_chat(worker, payload), media_type="text/event-stream")
+
+    try:
+        result = worker.completion(payload)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        # the supervisor will restart the worker if the process died
+        worker.ready = False
+        worker.last_error = repr(e)[:500]
         return {
             "error": {
-                "message": completed.stderr[-2000:],
+                "message": worker.last_error,
                 "type": "bitnet_runtime_error",
             }
         }
+    finally:
+        pool.release(worker)
 
-    output_text = completed.stdout.strip()
+    output_text = (result.get("content") or "").strip()
+    stats = prompt_stats(result)
+    worker.record_prompt(stats)
 
-    # OpenAI-compatible shape (упрощённо)
+    # OpenAI-compatible shape (simplified)
     return {
         "id": "chatcmpl-local-bitnet",
         "object": "chat.completion",
         "choices": [
             {"index": 0, "message": {"role": "assistant", "content": output_text}, "finish_reason": "stop"}
         ],
+        "usage": _usage(stats, int(result.get("tokens_predicted") or 0)),
     }
 
+
+def _sse_chunk(delta: dict, finish_reason: str | None = None, usage: dict | None = None) -> str:
+    chunk = {
+        "id": "chatcmpl-local-bitnet",
+        "object": "chat.completion.chunk",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def _stream_chat(worker: BitNetWorker, payload: dict):
+    """
+    OpenAI-style SSE: one chat.completion.chunk per generated piece, then the
+    finishing chunk (carrying usage) and [DONE].
+    """
+    try:
+        yield _sse_chunk({"role": "assistant"})
+        usage = None
+        for chunk in worker.completion_stream(payload):
+            text = chunk.get("content") or ""
+            if text:
+                yield _sse_chunk({"content": text})
+            if chunk.get("stop"):
+                stats = prompt_stats(chunk)
+                worker.record_prompt(stats)
+                usage = _usage(stats, int(chunk.get("tokens_predicted") or 0))
+        yield _sse_chunk({}, finish_reason="stop", usage=usage)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        worker.ready = False
+        worker.last_error = repr(e)[:500]
+        yield f"data: {json.dumps({'error': {'message': worker.last_error, 'type': 'bitnet_runtime_error'}})}\n\n"
+    finally:
+        pool.release(worker)
+    yield "data: [DONE]\n\n"
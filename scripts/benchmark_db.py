@@ -0,0 +1,64 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from deepsymbol import db
+
+
+def _run_threads(n_threads: int, fn) -> float:
+    threads = [threading.Thread(target=fn) for _ in range(n_threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0
+
+
+def bench_writes(n_threads: int, per_thread: int, batch: int) -> float:
+    def work():
+        if batch > 1:
+            for _ in range(per_thread // batch):
+                db.save_interpretations([(["person", "dog"], "A dog symbolises loyalty.")] * batch)
+        else:
+            for _ in range(per_thread):
+                db.save_interpretation(["person", "dog"], "A dog symbolises loyalty.")
+        db.close_db()
+
+    elapsed = _run_threads(n_threads, work)
+    return n_threads * per_thread / elapsed
+
+
+def bench_reads(n_threads: int, per_thread: int, limit: int) -> float:
+    def work():
+        for _ in range(per_thread):
+            db.get_history(limit=limit)
+        db.close_db()
+
+    elapsed = _run_threads(n_threads, work)
+    return n_threads * per_thread / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite history benchmark (writes/s and reads/s per thread count)")
+    parser.add_argument("--threads", default="1,2,4,8")
+    parser.add_argument("--writes", type=int, default=500, help="writes per thread")
+    parser.add_argument("--reads", type=int, default=500, help="history reads per thread")
+    parser.add_argument("--limit", type=int, default=20, help="rows per history read")
+    parser.add_argument("--batch", type=int, default=1, help="rows per save_interpretations call")
+    args = parser.parse_args()
+
+    db.DEFAULT_DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db.init_db()
+
+    print(f"{'threads':>7} {'writes/s':>10} {'reads/s':>10}")
+    for n in [int(x) for x in args.threads.split(",")]:
+        w = bench_writes(n, args.writes, args.batch)
+        r = bench_reads(n, args.reads, args.limit)
+        print(f"{n:>7} {w:>10.0f} {r:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
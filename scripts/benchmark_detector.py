@@ -0,0 +1,108 @@
+import argparse
+import itertools
+import statistics
+import time
+from collections import Counter
+
+from deepsymbol import vision, vision_onnx
+
+
+def _load_backend(name: str) -> None:
+    """
+    Point vision._detect_batch at `name` (torch, onnx or onnx-int8) and load it.
+    """
+    if name == "torch":
+        vision.DETECTOR_BACKEND = "torch"
+        vision.get_yolo_model()
+        return
+    vision.DETECTOR_BACKEND = "onnx"
+    path = vision_onnx.export_onnx(vision._MODEL_PATH, int8=name == "onnx-int8")
+    vision._onnx_detector = vision_onnx.OnnxDetector(path)
+
+
+def bench(images: list, batch: int, runs: int, warmup: int, **settings):
+    """
+    Returns (p50 ms, p95 ms, images/s, per-image results, mean stage timings).
+    """
+    work = [images[i % len(images)] for i in range(batch)]
+    for _ in range(warmup):
+        vision._detect_batch(work, **settings)
+
+    latencies = []
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        started = time.perf_counter()
+        vision._detect_batch(work, **settings)
+        latencies.append(time.perf_counter() - started)
+    elapsed = time.perf_counter() - t0
+
+    results = vision._detect_batch(images, **settings)
+    stages = {
+        stage: statistics.mean(r["timings"][f"{stage}_ms"] or 0.0 for r in results)
+        for stage in ("preprocess", "inference", "postprocess")
+    }
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000
+    return p50, p95, runs * batch / elapsed, results, stages
+
+
+def agreement(results: list, reference: list) -> tuple[float, float]:
+    """
+    Object-level precision/recall against the reference configuration's labels.
+    """
+    matched = predicted = expected = 0
+    for got, want in zip(results, reference):
+        got_c, want_c = Counter(got["objects"]), Counter(want["objects"])
+        matched += sum((got_c & want_c).values())
+        predicted += sum(got_c.values())
+        expected += sum(want_c.values())
+    precision = matched / predicted if predicted else 1.0
+    recall = matched / expected if expected else 1.0
+    return precision, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Detector latency/accuracy matrix. Accuracy is agreement with the first "
+        "backend at the largest imgsz and lowest conf (the reference)."
+    )
+    parser.add_argument("--images", nargs="+", default=["data/test.jpg"])
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--imgsz", default="320,480,640")
+    parser.add_argument("--conf", default="0.25,0.4")
+    parser.add_argument("--classes", default="", help="comma-separated class allow-list")
+    parser.add_argument("--batch", type=int, default=1, help="images per call")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    args = parser.parse_args()
+
+    images = [vision._to_source(path) for path in args.images]
+    backends = args.backends.split(",")
+    sizes = sorted((int(x) for x in args.imgsz.split(",")), reverse=True)
+    confs = sorted(float(x) for x in args.conf.split(","))
+    classes = [c.strip() for c in args.classes.split(",") if c.strip()]
+
+    _load_backend(backends[0])
+    reference = vision._detect_batch(images, imgsz=sizes[0], conf=confs[0], classes=classes)
+
+    print(
+        f"{'backend':>10} {'imgsz':>5} {'conf':>5} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>7} "
+        f"{'pre':>6} {'infer':>7} {'post':>6} {'prec':>5} {'recall':>6}"
+    )
+    for name in backends:
+        _load_backend(name)
+        for imgsz, conf in itertools.product(sizes, confs):
+            p50, p95, throughput, results, stages = bench(
+                images, args.batch, args.runs, args.warmup, imgsz=imgsz, conf=conf, classes=classes
+            )
+            precision, recall = agreement(results, reference)
+            print(
+                f"{name:>10} {imgsz:>5} {conf:>5.2f} {p50:>8.1f} {p95:>8.1f} {throughput:>7.1f} "
+                f"{stages['preprocess']:>6.1f} {stages['inference']:>7.1f} {stages['postprocess']:>6.1f} "
+                f"{precision:>5.2f} {recall:>6.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import base64
+import functools
+import multiprocessing as mp
+import queue
+import time
+
+import pika
+
+from deepsymbol import inference_worker
+from deepsymbol.queue import DETECT_QUEUE, LLM_QUEUE, QUEUE_ARGUMENTS, RABBITMQ_HOST, close_publisher, publish_stage_task
+
+
+def synthetic_detect(ms: float, msg: dict) -> dict:
+    # CPU-bound like a YOLO pass: only more processes make this faster
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+    return {"objects": ["owl"]}
+
+
+def synthetic_llm(ms: float, msg: dict) -> dict:
+    # waiting on a remote BitNet worker
+    time.sleep(ms / 1000)
+    return {"interpretation": "An owl suggests wisdom."}
+
+
+def _record(done: mp.Queue, job_id: str, patch: dict) -> None:
+    if patch.get("status") == "done":
+        done.put(job_id)
+
+
+def _worker(stop, done: mp.Queue, detect_ms: float, llm_ms: float) -> None:
+    inference_worker.run(
+        stop,
+        ["detect", "llm"],
+        tasks={
+            "detect": functools.partial(synthetic_detect, detect_ms),
+            "llm": functools.partial(synthetic_llm, llm_ms),
+        },
+        store=functools.partial(_record, done),
+        notify=lambda url, body: None,
+    )
+
+
+def _purge() -> None:
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    channel = connection.channel()
+    for name in (DETECT_QUEUE, LLM_QUEUE):
+        channel.queue_declare(queue=name, durable=True, arguments=QUEUE_ARGUMENTS.get(name))
+        channel.queue_purge(queue=name)
+    connection.close()
+
+
+def bench(n_workers: int, jobs: int, image_b64: str, detect_ms: float, llm_ms: float) -> float:
+    _purge()
+    ctx = mp.get_context("fork")
+    stop = ctx.Event()
+    done = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(stop, done, detect_ms, llm_ms), daemon=True) for _ in range(n_workers)]
+    for p in procs:
+        p.start()
+    time.sleep(2)  # let every worker connect and subscribe
+
+    t0 = time.perf_counter()
+    futures = [
+        publish_stage_task(DETECT_QUEUE, {"job_id": f"bench-{i}", "image_b64": image_b64}, message_id=f"bench-{i}")
+        for i in range(jobs)
+    ]
+    for f in futures:
+        f.result(timeout=30)
+
+    finished = 0
+    try:
+        while finished < jobs:
+            done.get(timeout=120)
+            finished += 1
+    except queue.Empty:
+        print(f"timed out with {finished}/{jobs} jobs done")
+    elapsed = time.perf_counter() - t0
+
+    stop.set()
+    for p in procs:
+        p.join(10)
+        if p.is_alive():
+            p.terminate()
+    return finished / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inference worker scale-out: jobs/s through the detect -> llm queues on a real "
+        "RabbitMQ (RABBITMQ_HOST) with 1..N local worker processes and synthetic stage work"
+    )
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--detect-ms", type=float, default=40, help="CPU time per detect task")
+    parser.add_argument("--llm-ms", type=float, default=150, help="wait time per llm task")
+    parser.add_argument("--image", default="data/test.jpg", help="payload carried by each job")
+    args = parser.parse_args()
+
+    image_b64 = base64.b64encode(open(args.image, "rb").read()).decode("ascii")
+    concurrency = f"detect={inference_worker.DETECT_CONCURRENCY}, llm={inference_worker.LLM_CONCURRENCY}"
+    print(f"per-worker concurrency: {concurrency}")
+    print(f"{'workers':>7} {'jobs/s':>8} {'speedup':>8} {'efficiency':>10}")
+    baseline = None
+    for n in [int(x) for x in args.workers.split(",")]:
+        rate = bench(n, args.jobs, image_b64, args.detect_ms, args.llm_ms)
+        baseline = baseline or rate
+        print(f"{n:>7} {rate:>8.1f} {rate / baseline:>7.2f}x {rate / baseline / n:>9.0%}")
+    close_publisher()
+
+
+if __name__ == "__main__":
+    main()
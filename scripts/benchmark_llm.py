@@ -0,0 +1,90 @@
+import argparse
+import itertools
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from deepsymbol import llm, llm_bitnet
+from deepsymbol.prompts import build_prompt_from_objects
+
+OBJECT_SETS = [["dog"], ["person", "umbrella"], ["cat", "mirror"], ["clock", "book", "cup"], ["tree", "bird"], []]
+
+
+def _prompts(n: int) -> list[str]:
+    return [build_prompt_from_objects(objs) for objs in itertools.islice(itertools.cycle(OBJECT_SETS), n)]
+
+
+def bench_local(dtype: str, batch: int, n: int, max_new_tokens: int) -> tuple[float, float, float]:
+    """
+    Returns (tokens/s, p50 s per batch, load s) for `n` prompts in batches of `batch`.
+    """
+    llm.DTYPE = dtype
+    llm._tokenizer = llm._model = None
+    t0 = time.perf_counter()
+    llm.warm_up()
+    load = time.perf_counter() - t0
+
+    prompts = _prompts(n)
+    latencies = []
+    tokens = 0
+    t0 = time.perf_counter()
+    for i in range(0, n, batch):
+        started = time.perf_counter()
+        results = llm.generate_batch(prompts[i:i + batch], max_new_tokens=max_new_tokens)
+        latencies.append(time.perf_counter() - started)
+        tokens += sum(r["tokens"] for r in results)
+    elapsed = time.perf_counter() - t0
+    return tokens / elapsed, statistics.median(latencies), load
+
+
+def bench_bitnet(concurrency: int, n: int) -> tuple[float, float]:
+    """
+    Returns (tokens/s, p50 s per request) for `n` requests, `concurrency` at a time.
+    """
+    latencies = []
+
+    def one(prompt: str) -> int:
+        started = time.perf_counter()
+        r = httpx.post(llm_bitnet._chat_url(), json=llm_bitnet._build_payload(prompt), timeout=300)
+        r.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        return int((r.json().get("usage") or {}).get("completion_tokens") or 0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        tokens = sum(pool.map(one, _prompts(n)))
+    elapsed = time.perf_counter() - t0
+    return tokens / elapsed, statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generated tokens/s: local backend (per dtype and batch size) vs BitNet "
+        "(BITNET_BASE_URL, per client concurrency), on the same interpretation prompts"
+    )
+    parser.add_argument("--dtypes", default="fp32,bf16,int8")
+    parser.add_argument("--batch", default="1,2,4,8", help="local batch sizes / BitNet concurrency")
+    parser.add_argument("--prompts", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=llm.MAX_TOKENS)
+    parser.add_argument("--skip-bitnet", action="store_true")
+    parser.add_argument("--skip-local", action="store_true")
+    args = parser.parse_args()
+
+    sizes = [int(b) for b in args.batch.split(",")]
+    print(f"model={llm.MODEL_ID} threads={llm.THREADS or llm.default_threads()}")
+    print(f"{'backend':>12} {'batch':>5} {'tok/s':>8} {'p50 s':>7} {'load s':>7}")
+    if not args.skip_local:
+        for dtype in args.dtypes.split(","):
+            for batch in sizes:
+                rate, p50, load = bench_local(dtype, batch, args.prompts, args.max_new_tokens)
+                print(f"{'local-' + dtype:>12} {batch:>5} {rate:>8.1f} {p50:>7.2f} {load:>7.1f}")
+    if not args.skip_bitnet:
+        for concurrency in sizes:
+            rate, p50 = bench_bitnet(concurrency, args.prompts)
+            print(f"{'bitnet':>12} {concurrency:>5} {rate:>8.1f} {p50:>7.2f} {'-':>7}")
+
+
+if __name__ == "__main__":
+    main()
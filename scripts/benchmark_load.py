@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+import cv2
+import httpx
+import numpy as np
+
+# keep the benchmark's history and caches out of data/ and the real cache db
+os.environ["DEEPSYMBOL_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="deepsymbol-bench-"), "deepsymbol.db")
+os.environ["DEEPSYMBOL_CACHE_DB"] = ""
+
+from prometheus_client import REGISTRY  # noqa: E402
+
+from deepsymbol import api, llm_bitnet, outbox, vision  # noqa: E402
+from deepsymbol.cache import detection_cache, interpretation_cache  # noqa: E402
+
+ENDPOINTS = ("/interpret-image", "/interpret-image/stream", "/interpret-images", "/jobs")
+VOCABULARY = ["person", "dog", "cat", "bird", "car", "bicycle", "tree", "clock", "book", "umbrella", "cup", "chair"]
+STAGE_METRICS = {
+    "deepsymbol_stage_seconds": "stage",
+    "deepsymbol_admission_wait_seconds": "stage",
+    "deepsymbol_detect_queue_wait_seconds": None,
+}
+
+
+# --- local stand-ins ----------------------------------------------------------
+
+
+class FakeBitNet:
+    """
+    Mock transport for llm_bitnet's shared AsyncClient: answers /health, and
+    chat completions after `latency_ms` (spread over `tokens` chunks when streaming).
+    """
+
+    def __init__(self, latency_ms: float, tokens: int, jitter: float = 0.2):
+        self.latency = latency_ms / 1000
+        self.tokens = max(1, tokens)
+        self.jitter = jitter
+
+    def _delay(self) -> float:
+        return self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/health":
+            return httpx.Response(200, json={"status": "ok"})
+        payload = json.loads(request.content)
+        words = ["This"] + ["symbol"] * (self.tokens - 2) + ["endures."]
+        if payload.get("stream"):
+            return httpx.Response(200, content=self._stream(words), headers={"Content-Type": "text/event-stream"})
+        await asyncio.sleep(self._delay())
+        return httpx.Response(
+            200,
+            json={
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": {"prompt_tokens": 60, "completion_tokens": self.tokens, "total_tokens": 60 + self.tokens},
+            },
+        )
+
+    async def _stream(self, words: list):
+        per_token = self._delay() / len(words)
+        for word in words:
+            await asyncio.sleep(per_token)
+            chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+
+def _completed_after(seconds: float) -> Future:
+    fut: Future = Future()
+    threading.Timer(seconds, fut.set_result, (None,)).start()
+    return fut
+
+
+def fake_detect_batch(ms: float):
+    """
+    Replacement for vision._detect_batch: `ms` of CPU per image and a stable
+    object set derived from the pixels (so distinct images map to distinct prompts).
+    """
+
+    def detect(sources, **settings):
+        results = []
+        for src in sources:
+            end = time.perf_counter() + ms / 1000
+            while time.perf_counter() < end:
+                pass
+            rng = random.Random(int(np.asarray(src[:8, :8]).sum()))
+            objects = rng.sample(VOCABULARY, rng.randint(1, 3))
+            results.append({"objects": objects, "confidences": [0.9] * len(objects), "num_objects": len(objects)})
+        return results
+
+    return detect
+
+
+def install_fakes(args) -> None:
+    bitnet = FakeBitNet(args.llm_ms, args.llm_tokens)
+    llm_bitnet._async_client = httpx.AsyncClient(transport=httpx.MockTransport(bitnet.handler))
+
+    if args.detect_ms is not None:
+        vision._detect_batch = fake_detect_batch(args.detect_ms)
+
+    # Firestore and RabbitMQ: the outbox dispatcher's delivery hooks and the job API
+    outbox.stop_dispatcher()
+    outbox._dispatcher = outbox.OutboxDispatcher(
+        save_batch=lambda items: time.sleep(args.firestore_ms / 1000),
+        publish=lambda payload, message_id=None: _completed_after(args.rabbitmq_ms / 1000),
+    )
+    outbox._dispatcher.start()
+    api.create_job = lambda job_id, doc: time.sleep(args.firestore_ms / 1000)
+    api.publish_stage_task = lambda *a, **kw: _completed_after(args.rabbitmq_ms / 1000)
+
+    api.app.dependency_overrides[api.require_firebase_user] = lambda: {"uid": "bench"}
+
+
+# --- traffic ------------------------------------------------------------------
+
+
+def synthetic_images(count: int, width: int, height: int) -> list[bytes]:
+    """
+    `count` distinct JPEGs (distinct content keys, so the detection cache only
+    hits when the same image comes round again).
+    """
+    base = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    images = []
+    for i in range(count):
+        img = base.copy()
+        img[:8, :8] = i % 251
+        img[8:16, :8] = i // 251 % 251
+        ok, buf = cv2.imencode(".jpg", img)
+        images.append(buf.tobytes())
+    return images
+
+
+def load_trace(path: str, default_image: bytes) -> list[tuple[str, bytes]]:
+    """
+    JSONL, one request per line: {"endpoint": "/interpret-image", "image": "data/test.jpg"}.
+    Both keys are optional (defaults: /interpret-image and a synthetic image).
+    """
+    trace = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            endpoint = item.get("endpoint", "/interpret-image")
+            if endpoint not in ENDPOINTS:
+                raise SystemExit(f"unsupported endpoint in trace: {endpoint}")
+            image = open(item["image"], "rb").read() if item.get("image") else default_image
+            trace.append((endpoint, image))
+    return trace
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, image: bytes) -> int:
+    if endpoint == "/interpret-images":
+        files = [("files", (f"{i}.jpg", image, "image/jpeg")) for i in range(4)]
+    else:
+        files = {"file": ("a.jpg", image, "image/jpeg")}
+    r = await client.post(endpoint, files=files)
+    if endpoint in ("/interpret-image/stream", "/interpret-images"):
+        # the stream is only complete once the final event arrived
+        if r.status_code == 200 and "event: done" not in r.text:
+            return 599
+    return r.status_code
+
+
+# --- measurements -------------------------------------------------------------
+
+
+def histogram_snapshot() -> dict:
+    """
+    {(metric, label): {le: cumulative count}} for the stage histograms.
+    """
+    snap: dict = {}
+    for family in REGISTRY.collect():
+        if family.name not in STAGE_METRICS:
+            continue
+        label = STAGE_METRICS[family.name]
+        for s in family.samples:
+            if s.name.endswith("_bucket"):
+                key = (family.name, s.labels.get(label, "") if label else "")
+                snap.setdefault(key, {})[float(s.labels["le"])] = s.value
+    return snap
+
+
+def quantile(q: float, buckets: list[tuple[float, float]]) -> float | None:
+    """
+    Linear interpolation inside the bucket, like PromQL's histogram_quantile.
+    """
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    rank = q * total
+    prev_le, prev_count = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if math.isinf(le):
+                return prev_le
+            if count == prev_count:
+                return le
+            return prev_le + (le - prev_le) * (rank - prev_count) / (count - prev_count)
+        prev_le, prev_count = le, count
+    return prev_le
+
+
+def stage_percentiles(before: dict, after: dict) -> dict:
+    out = {}
+    for (metric, label), buckets in sorted(after.items()):
+        old = before.get((metric, label), {})
+        delta = sorted((le, count - old.get(le, 0.0)) for le, count in buckets.items())
+        if not delta or not delta[-1][1]:
+            continue
+        name = metric.removeprefix("deepsymbol_").removesuffix("_seconds") + (f":{label}" if label else "")
+        out[name] = {
+            "count": int(delta[-1][1]),
+            **{f"p{int(q * 100)}_ms": round(quantile(q, delta) * 1000, 2) for q in (0.5, 0.95, 0.99)},
+        }
+    return out
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_level(client, traffic: list, concurrency: int, total: int) -> dict:
+    detection_cache.clear()
+    interpretation_cache.clear()
+    before = histogram_snapshot()
+    work = itertools.islice(itertools.cycle(traffic), total)
+    lock = asyncio.Lock()
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+
+    async def worker():
+        while True:
+            async with lock:
+                item = next(work, None)
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                status = await send(client, *item)
+            except Exception:
+                status = 0
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "req_per_s": round(total / elapsed, 2),
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "latency_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+        },
+        "stages": stage_percentiles(before, histogram_snapshot()),
+        "rss_mb": round(rss_mb(), 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(levels: list, baseline_path: str) -> None:
+    baseline = {lvl["concurrency"]: lvl for lvl in json.load(open(baseline_path))["levels"]}
+    print(f"\nvs {baseline_path}:")
+    for lvl in levels:
+        old = baseline.get(lvl["concurrency"])
+        if old is None:
+            continue
+        rate = lvl["req_per_s"] / old["req_per_s"] - 1
+        p95 = lvl["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1
+        print(f"  concurrency {lvl['concurrency']:>4}: req/s {rate:+.1%}, p95 {p95:+.1%}")
+
+
+async def main_async(args) -> list:
+    install_fakes(args)
+    default_images = synthetic_images(args.distinct, args.width, args.height)
+    if args.trace:
+        traffic = load_trace(args.trace, default_images[0])
+    else:
+        traffic = [(args.endpoint, img) for img in default_images]
+
+    levels = []
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            level = await run_level(client, traffic, concurrency, args.requests)
+            levels.append(level)
+            stages = ", ".join(
+                f"{name} p95 {s['p95_ms']:.0f}ms"
+                for name, s in level["stages"].items()
+                if name.startswith("stage:")
+            )
+            print(
+                f"{concurrency:>5} {level['req_per_s']:>8.1f} {level['latency_ms']['p50']:>8.1f} "
+                f"{level['latency_ms']['p95']:>8.1f} {level['latency_ms']['p99']:>8.1f} {level['rss_mb']:>7.1f}  "
+                f"{level['status']}  {stages}"
+            )
+    await llm_bitnet.aclose_async_client()
+    outbox.stop_dispatcher()
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end load test of the FastAPI app in-process, with local stand-ins for "
+        "BitNet, Firestore and RabbitMQ (SQLite and the detector are real unless --detect-ms is set)"
+    )
+    parser.add_argument("--concurrency", default="1,4,16,32")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--endpoint", default="/interpret-image", choices=ENDPOINTS)
+    parser.add_argument("--trace", help="JSONL of {endpoint, image} requests to replay instead")
+    parser.add_argument("--distinct", type=int, default=1000, help="distinct synthetic images (cache variety)")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--detect-ms", type=float, default=None, help="fake detector CPU per image")
+    parser.add_argument("--llm-ms", type=float, default=300, help="fake BitNet generation time")
+    parser.add_argument("--llm-tokens", type=int, default=40)
+    parser.add_argument("--firestore-ms", type=float, default=20)
+    parser.add_argument("--rabbitmq-ms", type=float, default=5)
+    parser.add_argument("--output", default="benchmark_load.json", help="machine-readable results")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    args = parser.parse_args()
+
+    print(f"{'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rss MB':>7}  status  stages")
+    levels = asyncio.run(main_async(args))
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        "levels": levels,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"wrote {args.output}")
+    if args.baseline:
+        compare(levels, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
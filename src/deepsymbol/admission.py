@@ -0,0 +1,121 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from deepsymbol.metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT
+
+
+# LLM stage: BitNet workers that may run at once, requests allowed to wait for
+# one, and the end-to-end budget (queue wait + generation) of a single request
+LLM_MAX_CONCURRENCY = int(os.getenv("DEEPSYMBOL_LLM_MAX_CONCURRENCY", "2"))
+LLM_MAX_QUEUE = int(os.getenv("DEEPSYMBOL_LLM_MAX_QUEUE", "16"))
+LLM_DEADLINE_SECONDS = float(os.getenv("DEEPSYMBOL_LLM_DEADLINE_SECONDS", "60"))
+
+
+class Overloaded(RuntimeError):
+    """
+    The wait queue is full; `retry_after` is a hint in whole seconds.
+    """
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"{stage} is overloaded, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Concurrency limit with a bounded FIFO wait queue for one pipeline stage.
+
+    Not an asyncio.Semaphore: waiters are plain futures created on the caller's
+    loop, so one module-level limiter works across event loops (tests, workers).
+    A released slot is handed straight to the next waiter, so late arrivals
+    cannot overtake the queue.
+    """
+
+    def __init__(self, stage: str, max_concurrency: int, max_queue: int):
+        self.stage = stage
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self._active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._avg_service = 1.0  # EWMA of slot hold time, for Retry-After
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """
+        Rough time until a new request would get a slot.
+        """
+        backlog = (len(self._waiters) + 1) / self.max_concurrency
+        return max(1, math.ceil(backlog * self._avg_service))
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Hold one slot for the duration of the block; raises Overloaded when the
+        queue is full. Bound the wait with asyncio.timeout() around the block.
+        """
+        queued_at = time.perf_counter()
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                ADMISSION_REJECTED.labels(self.stage).inc()
+                raise Overloaded(self.stage, self.retry_after())
+            await self._wait()
+
+        started = time.perf_counter()
+        ADMISSION_WAIT.labels(self.stage).observe(started - queued_at)
+        self._publish()
+        try:
+            yield
+        finally:
+            self._avg_service = 0.8 * self._avg_service + 0.2 * (time.perf_counter() - started)
+            self._release()
+
+    async def _wait(self) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self._publish()
+        try:
+            await fut
+        except BaseException:
+            if not fut.done() or fut.cancelled():
+                # cancelled (deadline or client gone) while still queued
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            else:
+                # the slot was handed over just as we gave up: pass it on
+                self._release()
+            raise
+        finally:
+            self._publish()
+
+    def _release(self) -> None:
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)  # slot passes to the waiter; _active unchanged
+                self._publish()
+                return
+        self._active -= 1
+        self._publish()
+
+    def _publish(self) -> None:
+        ADMISSION_QUEUE_DEPTH.labels(self.stage).set(len(self._waiters))
+        ADMISSION_ACTIVE.labels(self.stage).set(self._active)
+
+
+llm_limiter = AdmissionLimiter("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE)
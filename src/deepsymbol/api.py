@@ -1,90 +1,551 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
-from fastapi.responses import JSONResponse
-import tempfile
-import shutil
-from datetime import datetime
-from typing import Any, Dict
-
-from deepsymbol.db import init_db, save_interpretation, get_history
-from deepsymbol.vision import detect_objects
-from deepsymbol.llm_bitnet import bitnet_chat_completion
-from deepsymbol.firebase_store import get_output, list_outputs, update_output, delete_output
-from deepsymbol.queue import publish_postprocess_job
-from deepsymbol.auth import require_firebase_user
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+
+from deepsymbol.db import (
+    init_db,
+    save_interpretation_with_outbox,
+    save_interpretations_with_outbox,
+    get_history_page,
+    utc_now_iso,
+)
+from deepsymbol.vision import detect_objects_async, detector_fingerprint
+from deepsymbol.llm_bitnet import FALLBACK_TEXT, aclose_async_client, finalize_text
+from deepsymbol.llm_backends import LLM_BACKEND, complete_async, complete_stream, llm_fingerprint
+from deepsymbol.cache import SingleFlight, content_key, detection_cache, interpretation_cache, json_key
+from deepsymbol.queue import DETECT_QUEUE, close_publisher, publish_stage_task
+from deepsymbol.outbox import get_dispatcher, stop_dispatcher
+from deepsymbol.auth import require_firebase_user, start_cert_refresh, stop_cert_refresh
 from deepsymbol.prompts import build_prompt_from_objects
+from deepsymbol.metrics import ADMISSION_DEADLINE_EXCEEDED, JOBS_SUBMITTED, STREAM_FIRST_TOKEN, stage_timer
+from deepsymbol.admission import LLM_DEADLINE_SECONDS, Overloaded, llm_limiter
+from deepsymbol.startup import readiness
+from deepsymbol.webhooks import check_callback_url
 
 from prometheus_fastapi_instrumentator import Instrumentator
 
 # NEW: Firebase store
 from deepsymbol.firebase_store import (
-    save_output,
     get_output,
     list_outputs,
-    update_output,
-    delete_output,
+    update_output_and_get,
+    delete_output_if_exists,
+    create_job,
+    get_job,
+    update_job,
 )
 
-app = FastAPI(title="DeepSymbol API", description="YOLO + LLM symbolic interpretation")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_cert_refresh()
+    # deliver anything left in the outbox by a previous run
+    get_dispatcher().start()
+    # load and warm the detector etc. in the background; see /ready
+    readiness.start()
+    yield
+    await readiness.stop()
+    stop_cert_refresh()
+    await run_in_threadpool(stop_dispatcher)
+    await aclose_async_client()
+    await run_in_threadpool(close_publisher)
+
+
+app = FastAPI(
+    title="DeepSymbol API",
+    description="YOLO + LLM symbolic interpretation",
+    lifespan=lifespan,
+)
 
 Instrumentator().instrument(app).expose(app, endpoint="/metrics")
 
 init_db()
 
 
+# Uploads are decoded from memory, so cap them to keep RAM bounded
+MAX_UPLOAD_BYTES = int(os.getenv("DEEPSYMBOL_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# /interpret-images: files per request, and how many distinct object sets
+# one request may have in the LLM stage at once
+MAX_BATCH_FILES = int(os.getenv("DEEPSYMBOL_MAX_BATCH_FILES", "50"))
+BATCH_LLM_PARALLELISM = int(os.getenv("DEEPSYMBOL_BATCH_LLM_PARALLELISM", "2"))
+_UPLOAD_CHUNK = 64 * 1024
+
+
+async def _read_upload(file: UploadFile) -> bytes:
+    """
+    Read the upload into memory, rejecting it with 413 as soon as it exceeds the cap.
+    """
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+
+    buf = bytearray()
+    while True:
+        chunk = await file.read(_UPLOAD_CHUNK)
+        if not chunk:
+            break
+        buf.extend(chunk)
+        if len(buf) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+
+    if not buf:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return bytes(buf)
+
+
+# multipart boundaries, part headers and the small form fields next to the files
+_FORM_OVERHEAD = 64 * 1024
+
+
+def _body_limit(path: str) -> int:
+    files = MAX_BATCH_FILES if path == "/interpret-images" else 1
+    return MAX_UPLOAD_BYTES * files + _FORM_OVERHEAD
+
+
+class RequestBodyLimit:
+    """
+    Reject oversized request bodies with 413 before they are parsed: Starlette
+    spools every multipart file part to disk before the endpoint runs, so
+    _read_upload alone only bounds the decode. A declared Content-Length is
+    checked up front; chunked bodies are counted as they arrive.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = _body_limit(scope["path"])
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            response = JSONResponse({"detail": f"Request body exceeds {limit} bytes"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(RequestBodyLimit)
+
+
+def detection_key(data: bytes) -> str:
+    # detector settings are part of the key: a config change must not serve old results
+    return json_key(content_key(data), detector_fingerprint())
+
+
+async def _detect_cached(data: bytes) -> Dict[str, Any]:
+    """
+    Level 1 cache: identical uploads skip the YOLO pass. Hits carry
+    `cached: true` instead of the original run's timings.
+    """
+    key = await run_in_threadpool(detection_key, data)
+    detection = await run_in_threadpool(detection_cache.get, key)
+    if detection is not None:
+        return {**detection, "cached": True}
+    detection = await detect_objects_async(data)
+    stored = {k: v for k, v in detection.items() if k != "timings"}
+    await run_in_threadpool(detection_cache.set, key, stored)
+    return detection
+
+
+def interpretation_key(objects: list[str]) -> str:
+    # Order-insensitive: "person, dog" and "dog, person" share one entry
+    canonical = sorted(o.strip().lower() for o in objects)
+    return json_key(build_prompt_from_objects(canonical), llm_fingerprint())
+
+
+async def _llm_admitted(prompt: str) -> tuple[str, str]:
+    """
+    LLM call (primary backend, then failover) behind the admission limiter.
+    Returns (text, backend). The deadline covers queueing and generation; when
+    it fires the upstream request is cancelled (connection closed).
+    """
+    try:
+        async with asyncio.timeout(LLM_DEADLINE_SECONDS):
+            async with llm_limiter.slot():
+                return await complete_async(prompt)
+    except TimeoutError:
+        ADMISSION_DEADLINE_EXCEEDED.labels("llm").inc()
+        raise
+
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+# Identical prompts generating at the same moment share one LLM call
+llm_flight = SingleFlight("llm")
+
+
+async def _interpret_cached(objects: list[str], prompt: str) -> str:
+    """
+    Level 2 cache: the same object multiset skips the LLM generation, and
+    concurrent misses for it are coalesced into a single call.
+    """
+    key = interpretation_key(objects)
+    interpretation = await run_in_threadpool(interpretation_cache.get, key)
+    if interpretation is None:
+        interpretation = await llm_flight.do(key, lambda: _generate(key, prompt))
+    return interpretation
+
+
+async def _generate(key: str, prompt: str) -> str:
+    interpretation, backend = await _llm_admitted(prompt)
+    # the key is the primary backend's: don't let a failover answer stick to it
+    if interpretation != FALLBACK_TEXT and backend == LLM_BACKEND:
+        await run_in_threadpool(interpretation_cache.set, key, interpretation)
+    return interpretation
+
+
+def _persist(objects: list[str], interpretation: str) -> int:
+    # 4) Save locally (SQLite history) together with an outbox entry, in one transaction
+    with stage_timer("sqlite"):
+        record_id = save_interpretation_with_outbox(
+            objects, interpretation, utc_now_iso()
+        )
+
+    # 5) Firestore + postprocess job are written behind by the outbox dispatcher
+    # (doc id = record_id, published only after the doc exists)
+    get_dispatcher().wake()
+    return record_id
+
+
+def _persist_many(rows: List[tuple[list[str], str]]) -> List[int]:
+    """
+    Bulk variant of _persist: one sqlite transaction for the whole batch.
+    """
+    if not rows:
+        return []
+    with stage_timer("sqlite"):
+        ids = save_interpretations_with_outbox(rows, utc_now_iso())
+    get_dispatcher().wake()
+    return ids
+
+
 @app.post("/interpret-image")
 async def interpret_image(
     file: UploadFile = File(...),
     user=Depends(require_firebase_user),
 ):
-    # Save the uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        shutil.copyfileobj(file.file, tmp)
-        tmp_path = tmp.name
+    # Every blocking step runs off the event loop so /health and /metrics
+    # stay responsive while interpretations are in flight. The upload stays in
+    # memory: no temp file to write, re-read or leak.
+    data = await _read_upload(file)
 
-    # 1) YOLO detection
-    detection = detect_objects(tmp_path)
+    # 1) YOLO detection (micro-batched with other in-flight uploads)
+    try:
+        detection = await _detect_cached(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     objects = detection["objects"]
 
     # 2) Build LLM prompt
     prompt = build_prompt_from_objects(objects)
 
+    # 3) LLM (BitNet by default, see llm_backends.py), cached per object set
     try:
-        interpretation = bitnet_chat_completion(prompt)
+        interpretation = await _interpret_cached(objects, prompt)
+    except Overloaded as e:
+        raise _overloaded(e)
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail=f"LLM did not answer within {LLM_DEADLINE_SECONDS:.0f}s")
     except Exception as e:
-        raise HTTPException(status_code=503, detail=f"BitNet unavailable: {str(e)[:200]}")
-
+        raise HTTPException(status_code=503, detail=f"LLM unavailable: {str(e)[:200]}")
 
-    # 4) Save locally (SQLite history)
-    record_id = save_interpretation(objects, interpretation)
+    record_id = await run_in_threadpool(_persist, objects, interpretation)
 
-    # 5) NEW: Save to Firebase (Firestore)
-    # Use record_id as document id for easy linking between local history and firebase
-    save_output(
-        str(record_id),
+    return JSONResponse(
         {
+            "id": record_id,
             "objects": objects,
             "interpretation": interpretation,
-            "created_at": datetime.utcnow().isoformat() + "Z",
-        },
+        }
     )
-    
-    publish_postprocess_job(
-        {"id": record_id, "objects": objects, "interpretation": interpretation}
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/interpret-image/stream")
+async def interpret_image_stream(
+    file: UploadFile = File(...),
+    user=Depends(require_firebase_user),
+):
+    """
+    Server-sent events: `detections` first, then `token` events as the LLM
+    generates, then `done` with the cleaned (and persisted) interpretation.
+    Failures after the stream has started arrive as an `error` event.
+    """
+    started = time.perf_counter()
+    data = await _read_upload(file)
+    try:
+        detection = await _detect_cached(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    objects = detection["objects"]
+    prompt = build_prompt_from_objects(objects)
+    key = interpretation_key(objects)
+
+    # reject before the 200 stream starts when the LLM queue is already full
+    if (
+        llm_limiter.waiting >= llm_limiter.max_queue
+        and llm_limiter.active >= llm_limiter.max_concurrency
+        and llm_flight.inflight(key) is None
+    ):
+        cached = await run_in_threadpool(interpretation_cache.get, key)
+        if cached is None:
+            raise _overloaded(Overloaded("llm", llm_limiter.retry_after()))
+
+    async def events():
+        yield _sse("detections", detection)
+
+        interpretation = await run_in_threadpool(interpretation_cache.get, key)
+        if interpretation is not None:
+            STREAM_FIRST_TOKEN.observe(time.perf_counter() - started)
+            yield _sse("token", {"text": interpretation})
+        elif llm_flight.inflight(key) is not None:
+            # an identical generation is already running: share its result
+            try:
+                interpretation = await llm_flight.do(key, lambda: _generate(key, prompt))
+            except Overloaded as e:
+                yield _sse("error", {"detail": str(e), "retry_after": e.retry_after})
+                return
+            except Exception as e:
+                yield _sse("error", {"detail": f"LLM unavailable: {str(e)[:200]}"})
+                return
+            STREAM_FIRST_TOKEN.observe(time.perf_counter() - started)
+            yield _sse("token", {"text": interpretation})
+        else:
+            parts: list[str] = []
+            backend = None
+            try:
+                async with asyncio.timeout(LLM_DEADLINE_SECONDS):
+                    async with llm_limiter.slot():
+                        async for delta, backend in complete_stream(prompt):
+                            if not parts:
+                                STREAM_FIRST_TOKEN.observe(time.perf_counter() - started)
+                            parts.append(delta)
+                            yield _sse("token", {"text": delta})
+            except Overloaded as e:
+                yield _sse("error", {"detail": str(e), "retry_after": e.retry_after})
+                return
+            except TimeoutError:
+                ADMISSION_DEADLINE_EXCEEDED.labels("llm").inc()
+                yield _sse("error", {"detail": f"LLM did not answer within {LLM_DEADLINE_SECONDS:.0f}s"})
+                return
+            except Exception as e:
+                yield _sse("error", {"detail": f"LLM unavailable: {str(e)[:200]}"})
+                return
+            interpretation = finalize_text("".join(parts), prompt)
+            if interpretation != FALLBACK_TEXT and backend == LLM_BACKEND:
+                await run_in_threadpool(interpretation_cache.set, key, interpretation)
+
+        record_id = await run_in_threadpool(_persist, objects, interpretation)
+        yield _sse("done", {"id": record_id, "objects": objects, "interpretation": interpretation})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/interpret-images")
+async def interpret_images(
+    files: List[UploadFile] = File(...),
+    user=Depends(require_firebase_user),
+):
+    """
+    Batch variant of /interpret-image (server-sent events). All images go to the
+    detector together, so they share batched YOLO passes; images with the same
+    object set share one interpretation, and at most BATCH_LLM_PARALLELISM
+    generations per request run at once. One `item` event is sent per file as
+    soon as it is ready (or `item` with `error`), then `done` with the record ids
+    after a single bulk write.
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FILES} files per request")
+
+    uploads: list[bytes | HTTPException] = []
+    for f in files:
+        try:
+            uploads.append(await _read_upload(f))
+        except HTTPException as e:
+            uploads.append(e)
+    names = [f.filename for f in files]
+
+    async def detect(data):
+        if isinstance(data, HTTPException):
+            raise ValueError(data.detail)
+        return await _detect_cached(data)
+
+    def error_item(index: int, e: Exception) -> str:
+        item = {"index": index, "filename": names[index], "error": str(e)[:200]}
+        if isinstance(e, Overloaded):
+            item["retry_after"] = e.retry_after
+        return _sse("item", item)
+
+    async def events():
+        # 1) detection: submitted together, so the batcher groups them into full passes
+        detections = await asyncio.gather(*(detect(d) for d in uploads), return_exceptions=True)
+
+        # 2) one LLM call per distinct object set
+        groups: Dict[str, list[int]] = {}
+        for i, detection in enumerate(detections):
+            if isinstance(detection, BaseException):
+                yield error_item(i, detection)
+            else:
+                groups.setdefault(interpretation_key(detection["objects"]), []).append(i)
+
+        limit = asyncio.Semaphore(max(1, BATCH_LLM_PARALLELISM))
+
+        async def interpret(indices: list[int]):
+            objects = detections[indices[0]]["objects"]
+            try:
+                async with limit:
+                    return indices, await _interpret_cached(objects, build_prompt_from_objects(objects))
+            except Exception as e:
+                return indices, e
+
+        tasks = [asyncio.ensure_future(interpret(indices)) for indices in groups.values()]
+        rows: list[tuple[int, list[str], str]] = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indices, interpretation = await next_done
+                if isinstance(interpretation, Exception):
+                    for i in indices:
+                        yield error_item(i, interpretation)
+                    continue
+                for i in indices:
+                    objects = detections[i]["objects"]
+                    rows.append((i, objects, interpretation))
+                    yield _sse(
+                        "item",
+                        {"index": i, "filename": names[i], "objects": objects, "interpretation": interpretation},
+                    )
+        finally:
+            for t in tasks:
+                t.cancel()
+
+        # 3) single bulk write for everything that succeeded
+        rows.sort()
+        ids = await run_in_threadpool(_persist_many, [(objects, text) for _, objects, text in rows])
+        yield _sse(
+            "done",
+            {"count": len(files), "items": [{"index": i, "id": record_id} for (i, _, _), record_id in zip(rows, ids)]},
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    callback_url: str | None = Form(None),
+    priority: int = Form(0),
+    user=Depends(require_firebase_user),
+):
+    """
+    Submit-and-poll mode: queue the image for the inference workers and return at
+    once. Poll GET /jobs/{job_id}, or pass `callback_url` to get the result POSTed.
+    Higher `priority` (0-9) jobs are taken first at every stage.
+    """
+    if callback_url:
+        try:
+            await run_in_threadpool(check_callback_url, callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    data = await _read_upload(file)
+
+    job_id = uuid.uuid4().hex
+    now = utc_now_iso()
+    with stage_timer("firestore"):
+        await run_in_threadpool(
+            create_job,
+            job_id,
+            {"status": "queued", "uid": user.get("uid"), "created_at": now, "updated_at": now},
         )
 
+    message = {"job_id": job_id, "image_b64": base64.b64encode(data).decode("ascii")}
+    if callback_url:
+        message["callback_url"] = callback_url
+    try:
+        # wait for the publisher thread to hand it to the broker, not for the job;
+        # enqueueing may block while the publish queue is full, so not on the loop
+        with stage_timer("rabbitmq"):
+            published = await run_in_threadpool(
+                publish_stage_task, DETECT_QUEUE, message, message_id=f"{job_id}-detect", priority=priority
+            )
+            await asyncio.wrap_future(published)
+    except Exception as e:
+        try:
+            await run_in_threadpool(update_job, job_id, {"status": "failed", "error": "could not be queued"})
+        except Exception as update_error:
+            # the client still gets the 503; the job doc just stays "queued"
+            print(f"[api] could not mark job {job_id} failed: {update_error}")
+        raise HTTPException(status_code=503, detail=f"Job queue unavailable: {str(e)[:200]}")
+    JOBS_SUBMITTED.inc()
 
     return JSONResponse(
-        {
-            "id": record_id,
-            "objects": objects,
-            "interpretation": interpretation,
-        }
+        {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"},
     )
 
 
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, user=Depends(require_firebase_user)):
+    job = await run_in_threadpool(get_job, job_id)
+    # other users' jobs are indistinguishable from missing ones
+    if job is None or job.get("uid") != user.get("uid"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    public = {k: job[k] for k in ("status", "created_at", "updated_at", "result", "error") if k in job}
+    return {"job_id": job_id, **public}
+
+
 @app.get("/history")
-def history(limit: int = 20):
-    return {"items": get_history(limit=limit)}
+def history(
+    limit: int = 20,
+    cursor: int | None = None,
+    object: str | None = None,
+    fields: str | None = None,
+):
+    """
+    Newest first. Pass next_cursor from the previous page as `cursor`;
+    `object` filters by detected object, `fields` is a comma-separated projection
+    (id, created_at, objects, interpretation).
+    """
+    wanted = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        return get_history_page(limit=limit, cursor=cursor, object_name=object, fields=wanted)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # ----------------------------
@@ -92,8 +553,10 @@ def history(limit: int = 20):
 # ----------------------------
 
 @app.get("/firebase/outputs")
-def firebase_outputs(limit: int = 50, user=Depends(require_firebase_user)):
-    return {"items": list_outputs(limit=limit)}
+def firebase_outputs(limit: int = 50, fields: str | None = None, user=Depends(require_firebase_user)):
+    # optional field mask, e.g. ?fields=objects,created_at to skip the interpretation text
+    wanted = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    return {"items": list_outputs(limit=limit, fields=wanted)}
 
 
 @app.get("/firebase/outputs/{item_id}")
@@ -108,28 +571,35 @@ def firebase_get(item_id: str, user=Depends(require_firebase_user)):
 
 @app.put("/firebase/outputs/{item_id}")
 def firebase_update(item_id: str, patch: Dict[str, Any], user=Depends(require_firebase_user)):
-    # check exists (so we return 404 if missing)
-    existing = get_output(item_id)
-    if not existing:
+    # one transaction: 404 if missing, otherwise the patched document
+    try:
+        updated = update_output_and_get(item_id, patch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if updated is None:
         raise HTTPException(status_code=404, detail="Not found")
-
-    # do update
-    update_output(item_id, patch)
-    updated = get_output(item_id) or {}
     updated["id"] = item_id
     return updated
 
 
 @app.delete("/firebase/outputs/{item_id}")
 def firebase_delete(item_id: str, user=Depends(require_firebase_user)):
-    existing = get_output(item_id)
-    if not existing:
+    if not delete_output_if_exists(item_id):
         raise HTTPException(status_code=404, detail="Not found")
-
-    delete_output(item_id)
     return {"status": "deleted", "id": item_id}
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness (vs. /health liveness): 503 until startup warm-up has finished.
+    """
+    status = readiness.status()
+    if not readiness.ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
@@ -1,15 +1,98 @@
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 import os
-import firebase_admin
-from firebase_admin import credentials, auth as fb_auth
+import threading
+import time
+
+from deepsymbol.cache import ResultCache, content_key
+from deepsymbol.metrics import CERT_REFRESHES, TOKEN_VERIFY_SECONDS
 
 bearer_scheme = HTTPBearer(auto_error=False)
 
-# Init Firebase Admin once
-if not firebase_admin._apps:
-    cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "/app/secrets/firebase_key.json")
-    firebase_admin.initialize_app(credentials.Certificate(cred_path))
+# Verified tokens are cached by hash (never persisted) until they expire,
+# so repeat calls skip the RSA signature check.
+TOKEN_CACHE_SIZE = int(os.getenv("DEEPSYMBOL_TOKEN_CACHE_SIZE", "10000"))
+CERT_REFRESH_SECONDS = float(os.getenv("DEEPSYMBOL_CERT_REFRESH_SECONDS", "1800"))
+
+_token_cache = ResultCache("firebase_token", max_size=TOKEN_CACHE_SIZE, ttl_seconds=3600, db_path="")
+_cert_refresh_stop = threading.Event()
+_cert_refresh_thread: threading.Thread | None = None
+
+
+def get_fb_auth():
+    """
+    firebase_admin.auth, imported and initialised on first use (once) rather than
+    at import time, so processes that never verify a token skip the cost.
+    """
+    import firebase_admin
+    from firebase_admin import auth as fb_auth, credentials
+
+    if not firebase_admin._apps:
+        cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "/app/secrets/firebase_key.json")
+        firebase_admin.initialize_app(credentials.Certificate(cred_path))
+    return fb_auth
+
+
+def verify_token_cached(token: str) -> dict:
+    key = content_key(token.encode("utf-8"))
+    decoded = _token_cache.get(key)
+    if decoded is not None:
+        return decoded
+
+    started = time.perf_counter()
+    decoded = get_fb_auth().verify_id_token(token)
+    TOKEN_VERIFY_SECONDS.observe(time.perf_counter() - started)
+
+    remaining = float(decoded.get("exp", 0)) - time.time()
+    if remaining > 0:
+        _token_cache.set(key, decoded, ttl=remaining)
+    return decoded
+
+
+def refresh_signing_certs() -> bool:
+    """
+    Re-fetch Google's signing certificates into firebase_admin's HTTP cache
+    (bypassing it with no-cache), so verify_id_token never waits on a cert fetch.
+
+    That cache is private to firebase_admin (tested with the version pinned in
+    requirements.txt); returns False if its internals are not where we expect,
+    and verify_id_token then simply fetches the certs on demand.
+    """
+    try:
+        from firebase_admin import _token_gen
+
+        fetch = get_fb_auth()._get_client(None)._token_verifier.request
+        cert_uri = _token_gen.ID_TOKEN_CERT_URI
+    except (ImportError, AttributeError) as e:
+        print("CERT REFRESH DISABLED: unsupported firebase_admin internals:", repr(e))
+        return False
+    fetch(cert_uri, method="GET", headers={"Cache-Control": "no-cache"})
+    return True
+
+
+def _cert_refresh_loop() -> None:
+    while True:
+        try:
+            if not refresh_signing_certs():
+                return
+            CERT_REFRESHES.labels("ok").inc()
+        except Exception as e:
+            CERT_REFRESHES.labels("error").inc()
+            print("CERT REFRESH ERROR:", repr(e))
+        if _cert_refresh_stop.wait(CERT_REFRESH_SECONDS):
+            return
+
+
+def start_cert_refresh() -> None:
+    global _cert_refresh_thread
+    if _cert_refresh_thread is None or not _cert_refresh_thread.is_alive():
+        _cert_refresh_stop.clear()
+        _cert_refresh_thread = threading.Thread(target=_cert_refresh_loop, name="cert-refresh", daemon=True)
+        _cert_refresh_thread.start()
+
+
+def stop_cert_refresh() -> None:
+    _cert_refresh_stop.set()
 
 
 def require_firebase_user(
@@ -24,9 +107,8 @@ def require_firebase_user(
 
     token = creds.credentials.strip()
     try:
-        decoded = fb_auth.verify_id_token(token)
+        decoded = verify_token_cached(token)
         return decoded
     except Exception as e:
         print("AUTH ERROR:", repr(e))
         raise HTTPException(status_code=401, detail="Invalid or expired token")
-
@@ -0,0 +1,77 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List
+
+
+class MicroBatcher:
+    """
+    Background thread that groups concurrent requests into batched calls of
+    run_batch(). A batch closes after `max_batch_size` items or `max_wait_ms`
+    after its first item. Each caller gets a Future resolving to its own result.
+
+    Futures are marked running when their batch is collected: callers that gave
+    up before that (cancelled futures, e.g. a disconnected client) are dropped,
+    and later cancel() calls have no effect, so one caller leaving can never
+    break the batch for the others.
+    """
+
+    thread_name = "micro-batcher"
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def run_batch(self, items: List[Any], waited: List[float]) -> List[Any]:
+        """
+        One result per item, in order. `waited` holds each item's seconds in the queue.
+        """
+        raise NotImplementedError
+
+    def submit(self, item: Any) -> Future:
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put((item, fut, time.perf_counter()))
+        return fut
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = self.run_batch([item for item, _, _ in batch], [started - t for _, _, t in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+
+            for (_, fut, _), result in zip(batch, results):
+                fut.set_result(result)
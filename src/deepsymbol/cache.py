@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from deepsymbol.metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES, COALESCED_CALLS, COALESCE_INFLIGHT
+
+# Optional persistent tier shared by all caches (empty = memory only)
+CACHE_DB_PATH = os.getenv("DEEPSYMBOL_CACHE_DB", "")
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def json_key(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _SqliteTier:
+    """
+    Persistent second tier: survives restarts and is shared between workers on a node.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value_json TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                """
+            )
+            conn.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, namespace: str, key: str) -> tuple[Any, float] | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value_json, expires_at FROM result_cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, namespace: str, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (namespace, key, value_json, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            conn.commit()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU + TTL cache with an optional sqlite tier behind it.
+    Values must be JSON-serialisable so they can be persisted.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl_seconds: float, db_path: str = CACHE_DB_PATH):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self._items: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._persistent = _SqliteTier(db_path) if db_path else None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > now:
+                    self._items.move_to_end(key)
+                    CACHE_HITS.labels(self.name, "memory").inc()
+                    return value
+                del self._items[key]
+                CACHE_EVICTIONS.labels(self.name).inc()
+
+        if self._persistent is not None:
+            found = self._persistent.get(self.name, key)
+            if found is not None:
+                value, expires_at = found
+                self._put(key, value, expires_at)
+                CACHE_HITS.labels(self.name, "sqlite").inc()
+                return value
+
+        CACHE_MISSES.labels(self.name).inc()
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        `ttl` can shorten (never extend) the cache-wide TTL for this entry.
+        """
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        self._put(key, value, expires_at)
+        if self._persistent is not None:
+            self._persistent.set(self.name, key, value, expires_at)
+
+    def _put(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                CACHE_EVICTIONS.labels(self.name).inc()
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drop `key` from the memory tier (the sqlite tier is only used for immutable results).
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls with the same key into one: the first caller
+    (leader) starts the call, callers arriving while it runs (followers) await the
+    same task and share its result or exception. Nothing is kept afterwards.
+
+    The shared task is shielded, so one caller going away does not cancel the
+    call for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def inflight(self, key: str) -> Optional[asyncio.Task]:
+        return self._inflight.get(key)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            COALESCED_CALLS.labels(self.name, "leader").inc()
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            COALESCE_INFLIGHT.labels(self.name).set(len(self._inflight))
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            COALESCED_CALLS.labels(self.name, "follower").inc()
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        COALESCE_INFLIGHT.labels(self.name).set(len(self._inflight))
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+
+
+detection_cache = ResultCache(
+    "detection",
+    max_size=int(os.getenv("DEEPSYMBOL_DETECT_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("DEEPSYMBOL_DETECT_CACHE_TTL", "3600")),
+)
+
+interpretation_cache = ResultCache(
+    "interpretation",
+    max_size=int(os.getenv("DEEPSYMBOL_LLM_CACHE_SIZE", "4096")),
+    ttl_seconds=float(os.getenv("DEEPSYMBOL_LLM_CACHE_TTL", "86400")),
+)
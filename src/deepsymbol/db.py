@@ -1,79 +1,316 @@
 import os
 import json
 import sqlite3
+import threading
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 DEFAULT_DB_PATH = os.getenv("DEEPSYMBOL_DB_PATH", "data/deepsymbol.db")
 
+# Pragmas applied once per connection. WAL lets readers proceed while a write is
+# in progress; synchronous=NORMAL is durable across app crashes in WAL mode and
+# only risks the last transactions on power loss.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={int(os.getenv('DEEPSYMBOL_DB_MMAP_BYTES', str(256 * 1024 * 1024)))}",
+    f"PRAGMA cache_size=-{int(os.getenv('DEEPSYMBOL_DB_CACHE_KB', str(64 * 1024)))}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Statements are module constants so sqlite3's per-connection statement cache
+# re-uses the prepared statements instead of re-parsing them.
+_INSERT_SQL = """
+    INSERT INTO interpretations (created_at, objects_json, interpretation)
+    VALUES (?, ?, ?)
+    RETURNING id
+"""
+
+_INSERT_OBJECT_SQL = """
+    INSERT OR IGNORE INTO interpretation_objects (object, interpretation_id)
+    VALUES (?, ?)
+"""
+
+# /history projections: API field name -> column
+HISTORY_FIELDS = {
+    "id": "i.id",
+    "created_at": "i.created_at",
+    "objects": "i.objects_json",
+    "interpretation": "i.interpretation",
+}
+MAX_HISTORY_LIMIT = 200
+
+_SCHEMA_VERSION = 2
+
+_local = threading.local()
+
 
 def _connect() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(DEFAULT_DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DEFAULT_DB_PATH, check_same_thread=False)
+    """
+    Return this thread's connection, opening (and tuning) it on first use.
+    Connections are kept for the lifetime of the thread instead of per call.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DEFAULT_DB_PATH:
+        return conn
+    if conn is not None:
+        conn.close()
+
+    dirname = os.path.dirname(DEFAULT_DB_PATH)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    conn = sqlite3.connect(DEFAULT_DB_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+
+    _local.conn = conn
+    _local.path = DEFAULT_DB_PATH
     return conn
 
 
+def close_db() -> None:
+    """
+    Close the calling thread's connection (e.g. on shutdown or in tests).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
 def init_db() -> None:
     conn = _connect()
-    try:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS interpretations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            objects_json TEXT NOT NULL,
+            interpretation TEXT NOT NULL
+        );
+        """
+    )
+    conn.commit()
+    _migrate(conn)
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= _SCHEMA_VERSION:
+        return
+
+    # every step is idempotent (IF NOT EXISTS / OR IGNORE), so re-running is safe
+    with conn:
+        # v1: normalised object table so /history?object=... is an index range scan
+        # (PK order = object, then id) instead of json-decoding every row
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS interpretation_objects (
+                object TEXT NOT NULL,
+                interpretation_id INTEGER NOT NULL REFERENCES interpretations(id) ON DELETE CASCADE,
+                PRIMARY KEY (object, interpretation_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO interpretation_objects (object, interpretation_id)
+            SELECT lower(trim(j.value)), i.id
+            FROM interpretations i, json_each(i.objects_json) j
+            """
+        )
+        # v2: transactional outbox for write-behind delivery to Firestore / RabbitMQ
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS interpretations (
+            CREATE TABLE IF NOT EXISTS outbox (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                created_at TEXT NOT NULL,
-                objects_json TEXT NOT NULL,
-                interpretation TEXT NOT NULL
+                record_id INTEGER NOT NULL,
+                payload_json TEXT NOT NULL,
+                firestore_done INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT
             );
             """
         )
-        conn.commit()
-    finally:
-        conn.close()
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at, id)")
+        conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+
+def utc_now_iso() -> str:
+    """
+    The one timestamp format for created_at/updated_at: ISO 8601, UTC, "+00:00"
+    offset (so stored strings sort chronologically whichever path wrote them).
+    """
+    return datetime.now(timezone.utc).isoformat()
 
 
 def save_interpretation(objects: List[str], interpretation: str) -> int:
+    return save_interpretations([(objects, interpretation)])[0]
+
+
+def save_interpretations(rows: Sequence[Tuple[List[str], str]]) -> List[int]:
+    """
+    Insert many (objects, interpretation) rows in a single transaction (one fsync)
+    and return their ids in order.
+    """
+    conn = _connect()
+    created_at = utc_now_iso()
+    ids = []
+    with conn:
+        for objects, interpretation in rows:
+            objects_json = json.dumps(objects, ensure_ascii=False)
+            cur = conn.execute(_INSERT_SQL, (created_at, objects_json, interpretation))
+            record_id = int(cur.fetchone()[0])
+            conn.executemany(
+                _INSERT_OBJECT_SQL,
+                [(o, record_id) for o in {o.strip().lower() for o in objects if o.strip()}],
+            )
+            ids.append(record_id)
+    return ids
+
+
+def save_interpretation_with_outbox(objects: List[str], interpretation: str, created_at: str) -> int:
+    return save_interpretations_with_outbox([(objects, interpretation)], created_at)[0]
+
+
+def save_interpretations_with_outbox(rows: Sequence[Tuple[List[str], str]], created_at: str) -> List[int]:
+    """
+    Write-behind: store the history rows and their outbox entries in one local
+    transaction. The outbox dispatcher delivers them to Firestore and RabbitMQ later.
+    """
+    conn = _connect()
+    ids = []
+    with conn:
+        for objects, interpretation in rows:
+            cur = conn.execute(_INSERT_SQL, (created_at, json.dumps(objects, ensure_ascii=False), interpretation))
+            record_id = int(cur.fetchone()[0])
+            conn.executemany(
+                _INSERT_OBJECT_SQL,
+                [(o, record_id) for o in {o.strip().lower() for o in objects if o.strip()}],
+            )
+            payload = {"objects": objects, "interpretation": interpretation, "created_at": created_at}
+            conn.execute(
+                "INSERT INTO outbox (record_id, payload_json) VALUES (?, ?)",
+                (record_id, json.dumps(payload, ensure_ascii=False)),
+            )
+            ids.append(record_id)
+    return ids
+
+
+def claim_outbox(limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Atomically lease due outbox rows, so several dispatchers sharing the file never
+    deliver the same row concurrently. A crashed dispatcher's lease simply expires.
+    """
+    now = time.time()
     conn = _connect()
-    try:
-        created_at = datetime.now(timezone.utc).isoformat()
-        objects_json = json.dumps(objects, ensure_ascii=False)
-        cur = conn.execute(
+    with conn:
+        rows = conn.execute(
             """
-            INSERT INTO interpretations (created_at, objects_json, interpretation)
-            VALUES (?, ?, ?)
+            UPDATE outbox SET next_attempt_at = ?
+            WHERE id IN (
+                SELECT id FROM outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?
+            )
+            RETURNING id, record_id, payload_json, firestore_done, attempts
             """,
-            (created_at, objects_json, interpretation),
+            (now + lease_seconds, now, limit),
+        ).fetchall()
+    out = [
+        {
+            "id": r["id"],
+            "record_id": r["record_id"],
+            "payload": json.loads(r["payload_json"]),
+            "firestore_done": bool(r["firestore_done"]),
+            "attempts": r["attempts"],
+        }
+        for r in rows
+    ]
+    out.sort(key=lambda r: r["id"])
+    return out
+
+
+def mark_outbox_firestore_done(ids: Sequence[int]) -> None:
+    conn = _connect()
+    with conn:
+        conn.executemany("UPDATE outbox SET firestore_done = 1 WHERE id = ?", [(i,) for i in ids])
+
+
+def defer_outbox(ids: Sequence[int], error: str, delay_seconds: float) -> None:
+    conn = _connect()
+    with conn:
+        conn.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            [(time.time() + delay_seconds, error[:500], i) for i in ids],
         )
-        conn.commit()
-        return int(cur.lastrowid)
-    finally:
-        conn.close()
 
 
-def get_history(limit: int = 20) -> List[Dict[str, Any]]:
+def delete_outbox(ids: Sequence[int]) -> None:
     conn = _connect()
-    try:
-        cur = conn.execute(
-            """
-            SELECT id, created_at, objects_json, interpretation
-            FROM interpretations
-            ORDER BY id DESC
-            LIMIT ?
-            """,
-            (limit,),
+    with conn:
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+
+def outbox_depth() -> int:
+    return int(_connect().execute("SELECT COUNT(*) FROM outbox").fetchone()[0])
+
+
+def get_history(limit: int = 20) -> List[Dict[str, Any]]:
+    return get_history_page(limit=limit)["items"]
+
+
+def get_history_page(
+    limit: int = 20,
+    cursor: Optional[int] = None,
+    object_name: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Newest-first keyset pagination: pass the returned next_cursor back as `cursor`
+    to get the following page. Cost is O(page) regardless of table size.
+
+    object_name filters on the indexed interpretation_objects table; `fields`
+    limits which columns are read (and whether objects_json is decoded at all).
+    """
+    limit = max(1, min(int(limit), MAX_HISTORY_LIMIT))
+    wanted = list(fields) if fields else list(HISTORY_FIELDS)
+    unknown = [f for f in wanted if f not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown history fields: {', '.join(unknown)}")
+    if "id" not in wanted:
+        wanted.insert(0, "id")  # needed for the cursor
+
+    columns = ", ".join(f"{HISTORY_FIELDS[f]} AS {f}" for f in wanted)
+    params: list[Any] = []
+    if object_name:
+        sql = (
+            f"SELECT {columns} FROM interpretation_objects o "
+            "JOIN interpretations i ON i.id = o.interpretation_id "
+            "WHERE o.object = ?"
         )
-        rows = cur.fetchall()
-        out = []
-        for r in rows:
-            out.append(
-                {
-                    "id": r["id"],
-                    "created_at": r["created_at"],
-                    "objects": json.loads(r["objects_json"]),
-                    "interpretation": r["interpretation"],
-                }
-            )
-        return out
-    finally:
-        conn.close()
+        params.append(object_name.strip().lower())
+        id_col = "o.interpretation_id"
+    else:
+        sql = f"SELECT {columns} FROM interpretations i WHERE 1 = 1"
+        id_col = "i.id"
+
+    if cursor is not None:
+        sql += f" AND {id_col} < ?"
+        params.append(int(cursor))
+    sql += f" ORDER BY {id_col} DESC LIMIT ?"
+    params.append(limit)
+
+    conn = _connect()
+    rows = conn.execute(sql, params).fetchall()
+    items = []
+    for r in rows:
+        item = {f: r[f] for f in wanted}
+        if "objects" in item:
+            item["objects"] = json.loads(item["objects"])
+        items.append(item)
 
+    next_cursor = items[-1]["id"] if len(items) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
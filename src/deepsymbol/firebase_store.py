@@ -1,17 +1,45 @@
 import os
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Optional, Sequence
 
-import firebase_admin
-from firebase_admin import credentials, firestore
+from deepsymbol.cache import ResultCache
 
-_db: Optional[firestore.Client] = None
+if TYPE_CHECKING:
+    from google.cloud import firestore
 
+# firebase_admin / google-cloud-firestore are imported on first use (get_db):
+# they add noticeable startup time to every process importing this module
+_db: Optional["firestore.Client"] = None
 
-def get_db() -> firestore.Client:
+COLLECTION = "outputs"
+JOBS_COLLECTION = "jobs"
+
+# Firestore caps a WriteBatch at 500 operations
+_MAX_BATCH_WRITES = 500
+
+# Short read-through cache for get_output. Writes made through this module
+# invalidate it; writes from other processes (e.g. the postprocess worker)
+# become visible after at most the TTL.
+_doc_cache = ResultCache(
+    "firestore_doc",
+    max_size=int(os.getenv("DEEPSYMBOL_FIRESTORE_CACHE_SIZE", "2048")),
+    ttl_seconds=float(os.getenv("DEEPSYMBOL_FIRESTORE_CACHE_TTL", "5")),
+    db_path="",
+)
+
+
+def get_db() -> "firestore.Client":
     global _db
     if _db is not None:
         return _db
 
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # local emulator: anonymous credentials, project from GOOGLE_CLOUD_PROJECT
+        _db = firestore.Client()
+        return _db
+
     cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     if not cred_path or not os.path.exists(cred_path):
         raise RuntimeError(
@@ -26,20 +54,49 @@ def get_db() -> firestore.Client:
     return _db
 
 
+def _doc(item_id: str):
+    return get_db().collection(COLLECTION).document(str(item_id))
+
+
+def _run_in_transaction(db, fn: Callable):
+    from firebase_admin import firestore
+
+    return firestore.transactional(fn)(db.transaction())
+
+
 def save_output(item_id: str, payload: Dict[str, Any]) -> None:
-    db = get_db()
-    db.collection("outputs").document(str(item_id)).set(payload)
+    _doc(item_id).set(payload)
+    _doc_cache.invalidate(str(item_id))
 
 
-def get_output(item_id: str) -> Optional[Dict[str, Any]]:
-    db = get_db()
-    doc = db.collection("outputs").document(str(item_id)).get()
-    return doc.to_dict() if doc.exists else None
+def save_outputs_batch(items: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Create/overwrite several documents with one WriteBatch per 500 docs.
+    """
+    _write_batches(items.items(), lambda batch, ref, payload: batch.set(ref, payload))
 
 
-def list_outputs(limit: int = 50) -> list[Dict[str, Any]]:
-    db = get_db()
-    docs = db.collection("outputs").limit(limit).stream()
+def get_output(item_id: str) -> Optional[Dict[str, Any]]:
+    cached = _doc_cache.get(str(item_id))
+    if cached is not None:
+        return dict(cached)
+
+    doc = _doc(item_id).get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict() or {}
+    _doc_cache.set(str(item_id), data)
+    return dict(data)
+
+
+def list_outputs(limit: int = 50, fields: Optional[Sequence[str]] = None) -> list[Dict[str, Any]]:
+    """
+    `fields` is a Firestore field mask: only those fields are sent over the wire.
+    """
+    query = get_db().collection(COLLECTION)
+    if fields:
+        query = query.select(list(fields))
+    docs = query.limit(limit).stream()
     out = []
     for d in docs:
         row = d.to_dict() or {}
@@ -49,11 +106,132 @@ def list_outputs(limit: int = 50) -> list[Dict[str, Any]]:
 
 
 def update_output(item_id: str, patch: Dict[str, Any]) -> None:
+    try:
+        _doc(item_id).update(patch)
+    finally:
+        _doc_cache.invalidate(str(item_id))
+
+
+def _field_paths(patch: Dict[str, Any]) -> list[tuple[tuple[str, ...], Any]]:
+    """
+    Split update() keys the way Firestore does: "a.b" is the nested field b of
+    map a, and backticks quote a literal dot. Raises ValueError for invalid or
+    reserved ("__name__"-style) field names.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    out = []
+    for key, value in patch.items():
+        parts = FieldPath.from_string(key).parts
+        if any(p.startswith("__") and p.endswith("__") for p in parts):
+            raise ValueError(f"Reserved field name: {key!r}")
+        out.append((parts, value))
+    return out
+
+
+def _apply_update(data: Dict[str, Any], paths: list[tuple[tuple[str, ...], Any]]) -> Dict[str, Any]:
+    for parts, value in paths:
+        node = data
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        node[parts[-1]] = value
+    return data
+
+
+def update_output_and_get(item_id: str, patch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Read, patch and return the document in one transaction (a read plus a commit
+    instead of get/update/get). Returns None if the document does not exist.
+    The returned document applies the patch with update()'s field-path semantics.
+    """
+    paths = _field_paths(patch)
     db = get_db()
-    db.collection("outputs").document(str(item_id)).update(patch)
+    ref = _doc(item_id)
+
+    def apply(transaction):
+        snap = ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        transaction.update(ref, patch)
+        return _apply_update(snap.to_dict() or {}, paths)
+
+    try:
+        updated = _run_in_transaction(db, apply)
+    finally:
+        _doc_cache.invalidate(str(item_id))
+    return updated
+
+
+def update_outputs_batch(patches: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Apply several patches with as few round trips as possible (one WriteBatch per 500 docs).
+    """
+    _write_batches(patches.items(), lambda batch, ref, patch: batch.update(ref, patch))
 
 
 def delete_output(item_id: str) -> None:
+    _doc(item_id).delete()
+    _doc_cache.invalidate(str(item_id))
+
+
+def delete_output_if_exists(item_id: str) -> bool:
+    """
+    Single round trip: the exists precondition makes Firestore reject deleting a
+    missing document instead of needing a get() first.
+    """
+    from google.api_core import exceptions as gexc
+
     db = get_db()
-    db.collection("outputs").document(str(item_id)).delete()
+    try:
+        _doc(item_id).delete(option=db.write_option(exists=True))
+    except gexc.NotFound:
+        return False
+    finally:
+        _doc_cache.invalidate(str(item_id))
+    return True
+
 
+def is_permanent_error(e: Exception) -> bool:
+    """
+    True for write errors that retrying cannot fix: the document is gone or the
+    patch itself is invalid. Anything else (network, 5xx, DeadlineExceeded,
+    credentials) is treated as transient.
+    """
+    from google.api_core import exceptions as gexc
+
+    return isinstance(e, (gexc.NotFound, gexc.InvalidArgument))
+
+
+def create_job(job_id: str, payload: Dict[str, Any]) -> None:
+    get_db().collection(JOBS_COLLECTION).document(job_id).set(payload)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Uncached: job status changes while clients poll it.
+    """
+    doc = get_db().collection(JOBS_COLLECTION).document(job_id).get()
+    if not doc.exists:
+        return None
+    return doc.to_dict() or {}
+
+
+def update_job(job_id: str, patch: Dict[str, Any]) -> None:
+    get_db().collection(JOBS_COLLECTION).document(job_id).update(patch)
+
+
+def _write_batches(items: Iterable, op: Callable) -> None:
+    db = get_db()
+    items = list(items)
+    for start in range(0, len(items), _MAX_BATCH_WRITES):
+        batch = db.batch()
+        chunk = items[start:start + _MAX_BATCH_WRITES]
+        for item_id, data in chunk:
+            op(batch, db.collection(COLLECTION).document(str(item_id)), data)
+        try:
+            batch.commit()
+        finally:
+            for item_id, _ in chunk:
+                _doc_cache.invalidate(str(item_id))
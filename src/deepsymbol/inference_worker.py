@@ -0,0 +1,295 @@
+import argparse
+import base64
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+import pika
+from prometheus_client import start_http_server
+
+from deepsymbol.db import utc_now_iso
+from deepsymbol.firebase_store import update_job
+from deepsymbol.llm_backends import complete
+from deepsymbol.metrics import (
+    INFERENCE_INFLIGHT,
+    INFERENCE_JOB_SECONDS,
+    INFERENCE_JOBS,
+    STARTUP_PHASE_SECONDS,
+    WEBHOOK_DELIVERIES,
+    stage_timer,
+)
+from deepsymbol.prompts import build_prompt_from_objects
+from deepsymbol.queue import DETECT_QUEUE, LLM_QUEUE, QUEUE_ARGUMENTS, RABBITMQ_HOST, publish_stage_task
+from deepsymbol.startup import PRELOAD
+from deepsymbol.vision import detect_objects, warm_up
+from deepsymbol.webhooks import check_callback_url, sign
+
+
+# Stages this process runs (comma-separated). Run both on one node, or split
+# them: e.g. detect-only workers on CPU nodes, llm-only workers next to BitNet.
+STAGES = [s.strip() for s in os.getenv("INFERENCE_STAGES", "detect,llm").split(",") if s.strip()]
+
+# Per-stage concurrency. Prefetch equals concurrency, so the broker only hands a
+# worker what it can start right away and idle workers on other nodes take the
+# rest (fair dispatch instead of round-robin).
+DETECT_CONCURRENCY = int(os.getenv("INFERENCE_DETECT_CONCURRENCY", "2"))
+LLM_CONCURRENCY = int(os.getenv("INFERENCE_LLM_CONCURRENCY", "2"))
+METRICS_PORT = int(os.getenv("INFERENCE_METRICS_PORT", "9102"))
+WEBHOOK_TIMEOUT = float(os.getenv("INFERENCE_WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_ATTEMPTS = 3
+HANDOFF_TIMEOUT = 30.0
+
+
+def _now() -> str:
+    return utc_now_iso()
+
+
+def detect_task(msg: Dict[str, Any]) -> Dict[str, Any]:
+    detection = detect_objects(base64.b64decode(msg["image_b64"]))
+    return {"objects": detection["objects"]}
+
+
+def llm_task(msg: Dict[str, Any]) -> Dict[str, Any]:
+    interpretation, _ = complete(build_prompt_from_objects(msg["objects"]))
+    return {"interpretation": interpretation}
+
+
+# stage -> (queue, task, next stage or None, concurrency)
+PIPELINE = {
+    "detect": (DETECT_QUEUE, detect_task, "llm", DETECT_CONCURRENCY),
+    "llm": (LLM_QUEUE, llm_task, None, LLM_CONCURRENCY),
+}
+
+
+def post_webhook(url: str, body: Dict[str, Any]) -> Optional[str]:
+    """
+    Best-effort signed callback with a short backoff; returns the last error, if any.
+    The target is re-checked here (its DNS may have changed since submission),
+    and redirects are not followed.
+    """
+    try:
+        check_callback_url(url)
+    except ValueError as e:
+        WEBHOOK_DELIVERIES.labels("failed").inc()
+        print(f"[inference] webhook {url} refused: {e}")
+        return str(e)
+
+    content = json.dumps(body).encode("utf-8")
+    error = None
+    for attempt in range(WEBHOOK_ATTEMPTS):
+        try:
+            headers = {"Content-Type": "application/json", **sign(content)}
+            r = httpx.post(url, content=content, headers=headers, timeout=WEBHOOK_TIMEOUT)
+            if r.status_code < 400:
+                WEBHOOK_DELIVERIES.labels("ok").inc()
+                return None
+            error = f"HTTP {r.status_code}"
+        except httpx.HTTPError as e:
+            error = repr(e)
+        time.sleep(2 ** attempt)
+    WEBHOOK_DELIVERIES.labels("failed").inc()
+    print(f"[inference] webhook {url} failed: {error}")
+    return error
+
+
+class StageConsumer:
+    """
+    Runs one pipeline stage's tasks on a thread pool and acks from the
+    connection thread. On success the task's output is merged into the message
+    and handed to the next stage's queue (same priority), or, for the last
+    stage, stored as the job result.
+
+    A task that fails is requeued once (it may have hit a worker that was
+    shutting down or a BitNet restart); a redelivered task that fails again
+    fails the job.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        connection,
+        channel,
+        executor: ThreadPoolExecutor,
+        task: Callable[[Dict[str, Any]], Dict[str, Any]],
+        next_stage: Optional[str] = None,
+        publish: Callable[..., Future] = publish_stage_task,
+        store: Callable[[str, Dict[str, Any]], None] = update_job,
+        notify: Callable[[str, Dict[str, Any]], Optional[str]] = post_webhook,
+    ):
+        self.stage = stage
+        self.connection = connection
+        self.channel = channel
+        self.executor = executor
+        self.task = task
+        self.next_stage = next_stage
+        self.publish = publish
+        self.store = store
+        self.notify = notify
+        self.consumer_tag: Optional[str] = None
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def on_message(self, method, properties, body: bytes) -> None:
+        try:
+            msg = json.loads(body.decode("utf-8"))
+            str(msg["job_id"])
+        except Exception:
+            print(f"[inference] dropping undecodable {self.stage} task: {body[:200]!r}")
+            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+
+        priority = (properties.priority if properties is not None else None) or 0
+        with self._lock:
+            self._inflight += 1
+            INFERENCE_INFLIGHT.labels(self.stage).set(self._inflight)
+        self.executor.submit(self._handle, method.delivery_tag, bool(method.redelivered), priority, msg)
+
+    def _handle(self, tag: int, redelivered: bool, priority: int, msg: Dict[str, Any]) -> None:
+        job_id = str(msg["job_id"])
+        started = time.perf_counter()
+        requeue = False
+        try:
+            self.store(job_id, {"status": "running", "stage": self.stage, "updated_at": _now()})
+            out = {k: v for k, v in msg.items() if k != "image_b64"}
+            out.update(self.task(msg))
+            if self.next_stage is not None:
+                # ack only once the next stage's task is safely with the broker
+                next_queue = PIPELINE[self.next_stage][0]
+                with stage_timer("rabbitmq"):
+                    self.publish(next_queue, out, message_id=f"{job_id}-{self.next_stage}", priority=priority).result(
+                        timeout=HANDOFF_TIMEOUT
+                    )
+            else:
+                result = {k: v for k, v in out.items() if k not in ("job_id", "callback_url")}
+                self._finish(job_id, msg, {"status": "done", "result": result, "updated_at": _now()})
+            INFERENCE_JOBS.labels(self.stage, "ok").inc()
+        except Exception as e:
+            print(f"[inference] {self.stage} task for job {job_id} failed: {e}")
+            if not redelivered:
+                requeue = True
+                INFERENCE_JOBS.labels(self.stage, "retried").inc()
+            else:
+                INFERENCE_JOBS.labels(self.stage, "failed").inc()
+                self._finish(job_id, msg, {"status": "failed", "error": str(e)[:500], "updated_at": _now()})
+        INFERENCE_JOB_SECONDS.labels(self.stage).observe(time.perf_counter() - started)
+
+        self.connection.add_callback_threadsafe(lambda: self._settle(tag, requeue))
+
+    def _finish(self, job_id: str, msg: Dict[str, Any], outcome: Dict[str, Any]) -> None:
+        self._safe_store(job_id, outcome)
+        callback_url = msg.get("callback_url")
+        if callback_url:
+            error = self.notify(callback_url, {"job_id": job_id, **outcome})
+            if error:
+                self._safe_store(job_id, {"callback_error": error})
+
+    def _safe_store(self, job_id: str, patch: Dict[str, Any]) -> None:
+        try:
+            self.store(job_id, patch)
+        except Exception as e:
+            print(f"[inference] could not update job {job_id}: {e}")
+
+    def _settle(self, tag: int, requeue: bool) -> None:
+        if requeue:
+            self.channel.basic_nack(delivery_tag=tag, requeue=True)
+        else:
+            self.channel.basic_ack(delivery_tag=tag)
+        with self._lock:
+            self._inflight -= 1
+            INFERENCE_INFLIGHT.labels(self.stage).set(self._inflight)
+
+    def pending(self) -> int:
+        return self._inflight
+
+
+def _install_signal_handlers(stop: threading.Event) -> None:
+    def handler(signum, frame):
+        print(f"[inference] received signal {signum}, shutting down...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+
+def run(
+    stop: threading.Event,
+    stages: list[str] = STAGES,
+    tasks: Optional[Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]]] = None,
+    **consumer_kwargs,
+) -> None:
+    """
+    Consume the given stages over one connection (one channel and thread pool per
+    stage). `tasks` and `consumer_kwargs` let benchmarks swap in synthetic work.
+    """
+    params = pika.ConnectionParameters(host=RABBITMQ_HOST)
+    connection = pika.BlockingConnection(params)
+    consumers = []
+    executors = []
+    try:
+        for stage in stages:
+            queue_name, task, next_stage, concurrency = PIPELINE[stage]
+            channel = connection.channel()
+            channel.queue_declare(queue=queue_name, durable=True, arguments=QUEUE_ARGUMENTS.get(queue_name))
+            channel.basic_qos(prefetch_count=concurrency)
+            executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"inference-{stage}")
+            executors.append(executor)
+            consumer = StageConsumer(
+                stage, connection, channel, executor, (tasks or {}).get(stage, task), next_stage, **consumer_kwargs
+            )
+            consumer.consumer_tag = channel.basic_consume(
+                queue=queue_name,
+                on_message_callback=lambda ch, method, props, body, c=consumer: c.on_message(method, props, body),
+            )
+            consumers.append(consumer)
+            print(f"[inference] consuming {queue_name!r} as stage {stage!r} (concurrency={concurrency})")
+
+        while not stop.is_set():
+            connection.process_data_events(time_limit=1)
+
+        # graceful shutdown: stop deliveries, finish and ack what we hold
+        for c in consumers:
+            c.channel.basic_cancel(c.consumer_tag)
+        deadline = time.monotonic() + 120
+        while any(c.pending() for c in consumers) and time.monotonic() < deadline:
+            connection.process_data_events(time_limit=0.1)
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if connection.is_open:
+            connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepSymbol inference worker")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated: detect,llm")
+    args = parser.parse_args()
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in PIPELINE]
+    if unknown:
+        raise SystemExit(f"unknown stages: {', '.join(unknown)}")
+
+    stop = threading.Event()
+    _install_signal_handlers(stop)
+    start_http_server(METRICS_PORT)
+
+    if PRELOAD and "detect" in stages:
+        # load the model before subscribing, so the first task isn't the slow one
+        for phase, seconds in warm_up().items():
+            STARTUP_PHASE_SECONDS.labels(phase).set(seconds)
+            print(f"[inference] {phase}: {seconds:.2f}s")
+
+    while not stop.is_set():
+        try:
+            run(stop, stages)
+        except Exception as e:
+            print(f"[inference] error: {e} — retrying in 3s")
+            stop.wait(3)
+
+
+if __name__ == "__main__":
+    main()
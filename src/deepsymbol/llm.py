@@ -1,59 +1,194 @@
-from typing import Dict, Any
+import asyncio
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List
 
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from deepsymbol.batching import MicroBatcher
+from deepsymbol.llm_bitnet import MAX_TOKENS, SYSTEM_PROMPT, chat_messages, finalize_text
+from deepsymbol.metrics import LLM_OUTPUT_TOKENS, LOCAL_LLM_BATCH_SIZE, stage_timer
 
+if TYPE_CHECKING:
+    from transformers import PreTrainedModel, PreTrainedTokenizerBase
+
+
+# Local CPU backend: DEEPSYMBOL_LLM_BACKEND=local, or DEEPSYMBOL_LLM_FAILOVER=local
+# behind BitNet (see llm_backends.py). torch/transformers load on first use.
 # Chat-oriented, compact LLM (1.1B parameters).
-# Much smarter than distilgpt2 but still CPU-friendly.
-MODEL_ID = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
+MODEL_ID = os.getenv("DEEPSYMBOL_LOCAL_LLM_MODEL", "TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+
+# int8: dynamic int8 quantization of the Linear layers (smallest and usually
+# fastest on x86); bf16: for CPUs with native bf16 (AVX512-BF16 / AMX); fp32: reference
+DTYPE = os.getenv("DEEPSYMBOL_LOCAL_LLM_DTYPE", "int8").lower()
+# intra-op threads; 0 = the CPUs this process may run on (torch's default counts
+# the host's cores, which oversubscribes a CPU-limited container)
+THREADS = int(os.getenv("DEEPSYMBOL_LOCAL_LLM_THREADS", "0"))
+
+# Concurrent prompts are collected for up to BATCH_WAIT_MS (or BATCH_SIZE
+# prompts) and generated together as one padded batch
+BATCH_SIZE = int(os.getenv("DEEPSYMBOL_LOCAL_LLM_BATCH_SIZE", "4"))
+BATCH_WAIT_MS = float(os.getenv("DEEPSYMBOL_LOCAL_LLM_BATCH_WAIT_MS", "20"))
+
+_DTYPES = ("int8", "bf16", "fp32")
+
+_tokenizer: "PreTrainedTokenizerBase | None" = None
+_model: "PreTrainedModel | None" = None
+_load_lock = threading.Lock()
+
 
-_tokenizer: AutoTokenizer | None = None
-_model: AutoModelForCausalLM | None = None
+def default_threads() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
 
-def get_llm() -> tuple[AutoTokenizer, AutoModelForCausalLM]:
+def get_llm() -> tuple["PreTrainedTokenizerBase", "PreTrainedModel"]:
     """
-    Lazily load TinyLlama chat model on CPU.
+    Lazily load the local chat model on CPU (only once), in DTYPE.
     """
     global _tokenizer, _model
 
-    if _tokenizer is None or _model is None:
-        device = torch.device("cpu")
+    with _load_lock:
+        if _tokenizer is None or _model is None:
+            if DTYPE not in _DTYPES:
+                raise RuntimeError(f"Unknown DEEPSYMBOL_LOCAL_LLM_DTYPE: {DTYPE!r} (expected one of {_DTYPES})")
 
-        _tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
 
-        _model = AutoModelForCausalLM.from_pretrained(
-            MODEL_ID,
-            torch_dtype=torch.float32,  # bf16 на CPU может глючить, поэтому float32
-        )
-        _model.to(device)
-        _model.eval()
+            torch.set_num_threads(THREADS or default_threads())
+
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+            # decoder-only: pad on the left so every row continues from its own prompt
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+
+            model = AutoModelForCausalLM.from_pretrained(
+                MODEL_ID,
+                torch_dtype=torch.bfloat16 if DTYPE == "bf16" else torch.float32,
+            )
+            model.eval()
+            if DTYPE == "int8":
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+            _tokenizer, _model = tokenizer, model
 
     return _tokenizer, _model
 
 
-def generate_text(prompt: str, max_new_tokens: int = 128) -> Dict[str, Any]:
+def render_chat(tokenizer: "PreTrainedTokenizerBase", prompt: str) -> str:
     """
-    Generate a response from TinyLlama given a natural language prompt.
+    The system + user messages BitNet gets, in the model's own chat format.
     """
-    tokenizer, model = get_llm()
-    device = next(model.parameters()).device
+    if getattr(tokenizer, "chat_template", None):
+        return tokenizer.apply_chat_template(chat_messages(prompt), tokenize=False, add_generation_prompt=True)
+    return f"{SYSTEM_PROMPT}\n{prompt}\n"
 
-    inputs = tokenizer(prompt, return_tensors="pt").to(device)
 
-    with torch.no_grad():
+def generate_batch(prompts: List[str], max_new_tokens: int = MAX_TOKENS) -> List[Dict[str, Any]]:
+    """
+    Greedy generation for several prompts in one padded batch. Returns, per
+    prompt, the cleaned text (same contract as bitnet_chat_completion) and the
+    number of generated tokens.
+    """
+    import torch
+
+    tokenizer, model = get_llm()
+    texts = [render_chat(tokenizer, p) for p in prompts]
+    # the chat template already adds BOS
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, add_special_tokens=False)
+
+    with torch.inference_mode():
         outputs = model.generate(
             **inputs,
             max_new_tokens=max_new_tokens,
-            do_sample=True,
-            top_p=0.9,
-            temperature=0.7,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
         )
 
-    generated = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    results = []
+    new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+    for prompt, ids in zip(prompts, new_tokens):
+        n_tokens = int((ids != tokenizer.pad_token_id).sum())
+        LLM_OUTPUT_TOKENS.observe(n_tokens)
+        raw = tokenizer.decode(ids, skip_special_tokens=True)
+        results.append({"text": finalize_text(raw, prompt), "tokens": n_tokens})
+    return results
+
+
+class GenerationBatcher(MicroBatcher):
+    """
+    Groups concurrent prompts into batched generate() calls (see MicroBatcher);
+    each caller's Future resolves to its own result dict.
+    """
+
+    thread_name = "llm-batcher"
+
+    def __init__(self, max_batch_size: int = BATCH_SIZE, max_wait_ms: float = BATCH_WAIT_MS):
+        super().__init__(max_batch_size, max_wait_ms)
+
+    def run_batch(self, items: List[str], waited: List[float]) -> List[Dict[str, Any]]:
+        LOCAL_LLM_BATCH_SIZE.observe(len(items))
+        with stage_timer("llm_local"):
+            return generate_batch(items)
 
+
+_batcher: GenerationBatcher | None = None
+
+
+def get_batcher() -> GenerationBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = GenerationBatcher()
+    return _batcher
+
+
+def local_chat_completion(prompt: str) -> str:
+    return get_batcher().submit(prompt).result()["text"]
+
+
+async def local_chat_completion_async(prompt: str) -> str:
+    """
+    Await a local generation without blocking the event loop; shares batches
+    with other callers. Cancelling the await drops the prompt if not yet started.
+    """
+    result = await asyncio.wrap_future(get_batcher().submit(prompt))
+    return result["text"]
+
+
+def local_fingerprint() -> dict:
+    """
+    Everything besides the user prompt that shapes the generated text (used in cache keys).
+    """
     return {
-        "prompt": prompt,
-        "output_text": generated,
+        "backend": "local",
+        "model": MODEL_ID,
+        "dtype": DTYPE,
+        "messages": [{"role": "system", "content": SYSTEM_PROMPT}],
+        "do_sample": False,
+        "max_tokens": MAX_TOKENS,
     }
 
+
+def warm_up() -> Dict[str, float]:
+    """
+    Load (and quantize) the model and run a one-token generation. Returns seconds per phase.
+    """
+    started = time.perf_counter()
+    get_llm()
+    loaded = time.perf_counter()
+    generate_batch(["Detected objects: tree."], max_new_tokens=1)
+    return {"local_llm_load": loaded - started, "local_llm_warmup": time.perf_counter() - loaded}
+
+
+def generate_text(prompt: str, max_new_tokens: int = 128) -> Dict[str, Any]:
+    """
+    Generate a response from the local model given a natural language prompt.
+    """
+    result = generate_batch([prompt], max_new_tokens=max_new_tokens)[0]
+    return {
+        "prompt": prompt,
+        "output_text": result["text"],
+    }
@@ -0,0 +1,142 @@
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from deepsymbol import llm, llm_bitnet
+from deepsymbol.metrics import LLM_FAILOVERS
+
+
+# Which backend generates interpretations ("bitnet" or "local", see llm.py), and
+# an optional second one to fail over to when the first raises
+LLM_BACKEND = os.getenv("DEEPSYMBOL_LLM_BACKEND", "bitnet").lower()
+LLM_FAILOVER = os.getenv("DEEPSYMBOL_LLM_FAILOVER", "").lower()
+
+
+class LLMBackend:
+    """
+    One way to turn a prompt into cleaned interpretation text. Functions are
+    looked up by name on their module at call time, so they can be patched.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        module,
+        complete: str,
+        complete_async: str,
+        fingerprint: str,
+        stream: Optional[str] = None,
+    ):
+        self.name = name
+        self._module = module
+        self._complete = complete
+        self._complete_async = complete_async
+        self._fingerprint = fingerprint
+        self._stream = stream
+
+    def complete(self, prompt: str) -> str:
+        return getattr(self._module, self._complete)(prompt)
+
+    async def complete_async(self, prompt: str) -> str:
+        return await getattr(self._module, self._complete_async)(prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Raw text deltas; backends without streaming yield their whole answer once.
+        """
+        if self._stream is None:
+            yield await self.complete_async(prompt)
+            return
+        async for delta in getattr(self._module, self._stream)(prompt):
+            yield delta
+
+    def fingerprint(self) -> dict:
+        return getattr(self._module, self._fingerprint)()
+
+
+BACKENDS: Dict[str, LLMBackend] = {
+    "bitnet": LLMBackend(
+        "bitnet",
+        llm_bitnet,
+        complete="bitnet_chat_completion",
+        complete_async="bitnet_chat_completion_async",
+        fingerprint="llm_fingerprint",
+        stream="bitnet_chat_completion_stream",
+    ),
+    "local": LLMBackend(
+        "local",
+        llm,
+        complete="local_chat_completion",
+        complete_async="local_chat_completion_async",
+        fingerprint="local_fingerprint",
+    ),
+}
+
+
+def backend_chain() -> List[LLMBackend]:
+    names = [LLM_BACKEND] + ([LLM_FAILOVER] if LLM_FAILOVER and LLM_FAILOVER != LLM_BACKEND else [])
+    unknown = [n for n in names if n not in BACKENDS]
+    if unknown:
+        raise RuntimeError(f"Unknown LLM backend(s): {', '.join(unknown)} (expected one of {sorted(BACKENDS)})")
+    return [BACKENDS[n] for n in names]
+
+
+def llm_fingerprint() -> dict:
+    """
+    Cache-key fingerprint of the primary backend. Failover answers are not cached.
+    """
+    return backend_chain()[0].fingerprint()
+
+
+def _failing_over(chain: List[LLMBackend], i: int, error: Exception) -> bool:
+    if i + 1 >= len(chain):
+        return False
+    LLM_FAILOVERS.labels(chain[i].name, chain[i + 1].name).inc()
+    print(f"[llm] {chain[i].name} failed ({str(error)[:200]}); failing over to {chain[i + 1].name}")
+    return True
+
+
+def complete(prompt: str) -> Tuple[str, str]:
+    """
+    (interpretation, backend name) from the primary backend or, if it raises, the failover.
+    """
+    chain = backend_chain()
+    for i, backend in enumerate(chain):
+        try:
+            return backend.complete(prompt), backend.name
+        except Exception as e:
+            if not _failing_over(chain, i, e):
+                raise
+    raise AssertionError("unreachable")
+
+
+async def complete_async(prompt: str) -> Tuple[str, str]:
+    """
+    Async variant of complete(). A deadline around it still cancels the whole
+    chain: cancellation is not an error and never triggers failover.
+    """
+    chain = backend_chain()
+    for i, backend in enumerate(chain):
+        try:
+            return await backend.complete_async(prompt), backend.name
+        except Exception as e:
+            if not _failing_over(chain, i, e):
+                raise
+    raise AssertionError("unreachable")
+
+
+async def complete_stream(prompt: str) -> AsyncIterator[Tuple[str, str]]:
+    """
+    (delta, backend name) pairs. Fails over only before the first delta; once
+    text has reached the client a failure is re-raised.
+    """
+    chain = backend_chain()
+    for i, backend in enumerate(chain):
+        started = False
+        try:
+            async for delta in backend.stream(prompt):
+                started = True
+                yield delta, backend.name
+            return
+        except Exception as e:
+            if started or not _failing_over(chain, i, e):
+                raise
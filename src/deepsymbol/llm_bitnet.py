@@ -1,37 +1,71 @@
+import json
 import os
 import httpx
 import re
+from typing import AsyncIterator
 
+from deepsymbol.admission import LLM_DEADLINE_SECONDS
+from deepsymbol.metrics import (
+    LLM_FALLBACK,
+    LLM_OUTPUT_TOKENS,
+    LLM_PROMPT_CACHED_RATIO,
+    LLM_PROMPT_EVAL_SAVED_SECONDS,
+    stage_timer,
+)
 
-def bitnet_chat_completion(prompt: str) -> str:
-    base_url = os.getenv("BITNET_BASE_URL", "http://localhost:8080").rstrip("/")
-    model = os.getenv("BITNET_MODEL", "ggml-model-i2_s.gguf")
-    url = f"{base_url}/v1/chat/completions"
+FALLBACK_TEXT = "The image may symbolise an internal emotional state that is hard to define, suggesting uncertainty or introspection."
+
+_async_client: httpx.AsyncClient | None = None
+
+
+def _base_url() -> str:
+    return os.getenv("BITNET_BASE_URL", "http://localhost:8080").rstrip("/")
+
+
+def _chat_url() -> str:
+    return f"{_base_url()}/v1/chat/completions"
 
-    payload = {
+
+# Shared by every LLM backend (see llm.py), so they answer the same way
+SYSTEM_PROMPT = (
+    "You are an AI oracle that interprets psychological symbols.\n"
+    "Rules:\n"
+    "- Answer with ONLY the interpretation.\n"
+    "- 2 to 4 sentences.\n"
+    "- Do NOT repeat the prompt.\n"
+    "- Do NOT write headings.\n"
+    "- Do NOT ask follow-up questions.\n"
+)
+MAX_TOKENS = 120
+
+
+def chat_messages(prompt: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _build_payload(prompt: str) -> dict:
+    model = os.getenv("BITNET_MODEL", "ggml-model-i2_s.gguf")
+    return {
         "model": model,
-        "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "You are an AI oracle that interprets psychological symbols.\n"
-                    "Rules:\n"
-                    "- Answer with ONLY the interpretation.\n"
-                    "- 2 to 4 sentences.\n"
-                    "- Do NOT repeat the prompt.\n"
-                    "- Do NOT write headings.\n"
-                    "- Do NOT ask follow-up questions.\n"
-                ),
-            },
-            {"role": "user", "content": prompt},
-        ],
+        "messages": chat_messages(prompt),
         "temperature": 0.2,
-        "max_tokens": 120,
+        "max_tokens": MAX_TOKENS,
     }
 
-    with httpx.Client(timeout=None) as client:
-        r = client.post(url, json=payload)
 
+def llm_fingerprint() -> dict:
+    """
+    Everything besides the user prompt that shapes the generated text (used in cache keys).
+    """
+    payload = _build_payload("")
+    payload["messages"] = payload["messages"][:-1]
+    return {"backend": "bitnet", **payload}
+
+
+def _parse_response(r: httpx.Response, prompt: str) -> str:
     try:
         data = r.json()
     except Exception:
@@ -47,7 +81,29 @@ def bitnet_chat_completion(prompt: str) -> str:
     if not choices:
         raise RuntimeError(f"BitNet response missing 'choices': {data}")
 
+    usage = data.get("usage") or {}
+    if usage.get("completion_tokens") is not None:
+        LLM_OUTPUT_TOKENS.observe(usage["completion_tokens"])
+    _observe_prompt_cache(usage)
+
     raw = (choices[0].get("message") or {}).get("content", "") or ""
+    return finalize_text(raw, prompt)
+
+
+def _observe_prompt_cache(usage: dict) -> None:
+    """
+    Our BitNet server reports how much of the prompt came from the KV cache
+    (bitnet/server.py); plain OpenAI-style servers don't, and are skipped.
+    """
+    prompt_tokens = usage.get("prompt_tokens")
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if prompt_tokens and cached is not None:
+        LLM_PROMPT_CACHED_RATIO.observe(cached / prompt_tokens)
+    if usage.get("prompt_eval_saved_ms") is not None:
+        LLM_PROMPT_EVAL_SAVED_SECONDS.observe(usage["prompt_eval_saved_ms"] / 1000.0)
+
+
+def finalize_text(raw: str, prompt: str) -> str:
     raw = raw.strip()
 
     cleaned = _clean_llm_text(raw, prompt)
@@ -57,11 +113,109 @@ def bitnet_chat_completion(prompt: str) -> str:
         # fallback: try raw
         if raw.strip():
             return raw.strip()
-        return "The image may symbolise an internal emotional state that is hard to define, suggesting uncertainty or introspection."
+        LLM_FALLBACK.inc()
+        return FALLBACK_TEXT
 
     return cleaned
 
 
+def bitnet_chat_completion(prompt: str) -> str:
+    with stage_timer("llm"):
+        with httpx.Client(timeout=LLM_DEADLINE_SECONDS) as client:
+            r = client.post(_chat_url(), json=_build_payload(prompt))
+        return _parse_response(r, prompt)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Shared AsyncClient so concurrent requests reuse pooled keep-alive connections.
+    No client timeout: callers bound each request with a deadline (see api.py).
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(timeout=None)
+    return _async_client
+
+
+async def aclose_async_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def bitnet_chat_completion_async(prompt: str) -> str:
+    """
+    Non-blocking variant of bitnet_chat_completion for use inside the event loop.
+    """
+    with stage_timer("llm"):
+        r = await get_async_client().post(_chat_url(), json=_build_payload(prompt))
+        return _parse_response(r, prompt)
+
+
+async def bitnet_ping_async(timeout: float = 5.0) -> bool:
+    """
+    True when BitNet answers /health with a loaded model (our pool server reports
+    "ok" once a worker is ready; a bare llama-server returns 200 once loaded).
+    Also opens a pooled connection for the first real request.
+    """
+    try:
+        r = await get_async_client().get(f"{_base_url()}/health", timeout=timeout)
+    except httpx.HTTPError:
+        return False
+    if r.status_code != 200:
+        return False
+    try:
+        return r.json().get("status", "ok") == "ok"
+    except ValueError:
+        return True
+
+
+async def bitnet_chat_completion_stream(prompt: str) -> AsyncIterator[str]:
+    """
+    Yield raw text deltas as BitNet generates them (OpenAI-style SSE).
+    Callers should run the concatenated text through finalize_text()
+    to get the same cleaned result bitnet_chat_completion would return.
+    Raises RuntimeError on an error status, a non-SSE body, an error event
+    or a truncated stream, so callers can fail over.
+    """
+    payload = {**_build_payload(prompt), "stream": True}
+    tokens = 0
+    with stage_timer("llm"):
+        async with get_async_client().stream("POST", _chat_url(), json=payload) as r:
+            if r.status_code >= 400:
+                body = (await r.aread()).decode("utf-8", "replace")
+                raise RuntimeError(f"BitNet HTTP {r.status_code}: {body[:400]}")
+            if not r.headers.get("content-type", "").startswith("text/event-stream"):
+                body = (await r.aread()).decode("utf-8", "replace")
+                raise RuntimeError(f"BitNet returned a non-SSE stream response: {body[:400]}")
+
+            done = False
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    done = True
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    raise RuntimeError(f"BitNet returned a malformed stream chunk: {data[:200]}")
+                if "error" in chunk:
+                    raise RuntimeError(f"BitNet error response: {chunk['error']}")
+                if chunk.get("usage"):
+                    _observe_prompt_cache(chunk["usage"])
+                for choice in chunk.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        tokens += 1  # llama-server streams one token per chunk
+                        yield text
+            if not done:
+                raise RuntimeError("BitNet stream ended without [DONE]")
+    LLM_OUTPUT_TOKENS.observe(tokens)
+
+
 def _clean_llm_text(text: str, prompt: str) -> str:
     t = text.strip()
 
@@ -0,0 +1,245 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# All custom metrics live here so each is registered exactly once and shows up
+# on the /metrics endpoint exposed by the Instrumentator (default registry).
+
+DETECT_BATCH_MAX_SIZE = Gauge(
+    "deepsymbol_detect_batch_max_size",
+    "Configured maximum number of images per YOLO batch",
+)
+DETECT_BATCH_MAX_WAIT = Gauge(
+    "deepsymbol_detect_batch_max_wait_seconds",
+    "Configured time the batcher waits to fill a YOLO batch",
+)
+DETECT_BATCH_SIZE = Histogram(
+    "deepsymbol_detect_batch_size",
+    "Number of images per YOLO forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+DETECT_QUEUE_WAIT = Histogram(
+    "deepsymbol_detect_queue_wait_seconds",
+    "Time a detection request waited before its batch started",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+CACHE_HITS = Counter(
+    "deepsymbol_cache_hits_total",
+    "Result cache hits",
+    ["cache", "tier"],
+)
+CACHE_MISSES = Counter(
+    "deepsymbol_cache_misses_total",
+    "Result cache misses",
+    ["cache"],
+)
+CACHE_EVICTIONS = Counter(
+    "deepsymbol_cache_evictions_total",
+    "Entries dropped from the in-memory cache tier (LRU or TTL)",
+    ["cache"],
+)
+
+POSTPROCESS_MESSAGES = Counter(
+    "deepsymbol_postprocess_messages_total",
+    "Postprocess messages handled by the worker",
+    ["outcome"],
+)
+POSTPROCESS_BATCH_SIZE = Histogram(
+    "deepsymbol_postprocess_batch_size",
+    "Messages per batched Firestore write",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+POSTPROCESS_BATCH_SECONDS = Histogram(
+    "deepsymbol_postprocess_batch_seconds",
+    "Time to post-process and write one batch",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+POSTPROCESS_QUEUE_LAG = Histogram(
+    "deepsymbol_postprocess_queue_lag_seconds",
+    "Time between publish and the worker picking a message up",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+POSTPROCESS_QUEUE_DEPTH = Gauge(
+    "deepsymbol_postprocess_queue_depth",
+    "Ready messages waiting in the postprocess queue",
+)
+POSTPROCESS_INFLIGHT = Gauge(
+    "deepsymbol_postprocess_inflight_messages",
+    "Messages delivered to the worker but not yet acked",
+)
+
+STREAM_FIRST_TOKEN = Histogram(
+    "deepsymbol_stream_first_token_seconds",
+    "Time from request start to the first interpretation token on /interpret-image/stream",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+
+TOKEN_VERIFY_SECONDS = Histogram(
+    "deepsymbol_token_verify_seconds",
+    "Firebase ID token signature verification time (cache misses only)",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+CERT_REFRESHES = Counter(
+    "deepsymbol_signing_cert_refreshes_total",
+    "Background refreshes of Google's token signing certificates",
+    ["outcome"],
+)
+
+OUTBOX_PENDING = Gauge(
+    "deepsymbol_outbox_pending",
+    "Interpretations stored locally but not yet delivered to Firestore/RabbitMQ",
+)
+OUTBOX_DELIVERIES = Counter(
+    "deepsymbol_outbox_deliveries_total",
+    "Outbox delivery attempts",
+    ["stage", "outcome"],
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "deepsymbol_admission_queue_depth",
+    "Requests waiting for a slot in a rate-limited stage",
+    ["stage"],
+)
+ADMISSION_ACTIVE = Gauge(
+    "deepsymbol_admission_active",
+    "Requests currently holding a slot in a rate-limited stage",
+    ["stage"],
+)
+ADMISSION_WAIT = Histogram(
+    "deepsymbol_admission_wait_seconds",
+    "Time spent queued before getting a slot",
+    ["stage"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+ADMISSION_REJECTED = Counter(
+    "deepsymbol_admission_rejected_total",
+    "Requests rejected with 503 because the stage's wait queue was full",
+    ["stage"],
+)
+ADMISSION_DEADLINE_EXCEEDED = Counter(
+    "deepsymbol_admission_deadline_exceeded_total",
+    "Requests that ran out of their deadline while queued or in the upstream call",
+    ["stage"],
+)
+
+COALESCED_CALLS = Counter(
+    "deepsymbol_coalesced_calls_total",
+    "Single-flight calls by role: followers shared a leader's in-flight result",
+    ["flight", "role"],
+)
+COALESCE_INFLIGHT = Gauge(
+    "deepsymbol_coalesce_inflight_keys",
+    "Distinct keys with a call in flight",
+    ["flight"],
+)
+
+JOBS_SUBMITTED = Counter(
+    "deepsymbol_jobs_submitted_total",
+    "Async interpretation jobs accepted by POST /jobs",
+)
+INFERENCE_JOBS = Counter(
+    "deepsymbol_inference_tasks_total",
+    "Async job tasks handled by inference workers, per pipeline stage",
+    ["stage", "outcome"],
+)
+INFERENCE_JOB_SECONDS = Histogram(
+    "deepsymbol_inference_task_seconds",
+    "Time an inference worker spends on one task of a stage",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128),
+)
+INFERENCE_INFLIGHT = Gauge(
+    "deepsymbol_inference_inflight_tasks",
+    "Tasks an inference worker is currently processing, per stage",
+    ["stage"],
+)
+WEBHOOK_DELIVERIES = Counter(
+    "deepsymbol_webhook_deliveries_total",
+    "Job result callbacks",
+    ["outcome"],
+)
+
+STARTUP_PHASE_SECONDS = Gauge(
+    "deepsymbol_startup_phase_seconds",
+    "Duration of each startup warm-up phase of the current process",
+    ["phase"],
+)
+READY = Gauge(
+    "deepsymbol_ready",
+    "1 once startup warm-up has finished and /ready reports ready",
+)
+
+# Per-stage view of a request/job: the Instrumentator only times whole HTTP
+# requests. Stages: detect, llm, sqlite, firestore, rabbitmq, postprocess
+# (label values are shared by the api, outbox and worker processes; the
+# Prometheus `job` label tells them apart).
+STAGE_SECONDS = Histogram(
+    "deepsymbol_stage_seconds",
+    "Time spent in one pipeline stage",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+STAGE_CALLS = Counter(
+    "deepsymbol_stage_calls_total",
+    "Pipeline stage executions by outcome",
+    ["stage", "outcome"],
+)
+DETECT_PHASE_SECONDS = Histogram(
+    "deepsymbol_detect_phase_seconds",
+    "Per-image time of each detector phase (decode, preprocess, inference, postprocess)",
+    ["phase"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DETECTED_OBJECTS = Histogram(
+    "deepsymbol_detected_objects",
+    "Objects detected per image",
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+LLM_OUTPUT_TOKENS = Histogram(
+    "deepsymbol_llm_output_tokens",
+    "Tokens generated per BitNet completion",
+    buckets=(1, 8, 16, 32, 48, 64, 96, 120, 160, 256, 512),
+)
+LLM_FALLBACK = Counter(
+    "deepsymbol_llm_fallback_total",
+    "Interpretations replaced by the fallback text because the cleaned LLM output was empty",
+)
+LLM_PROMPT_CACHED_RATIO = Histogram(
+    "deepsymbol_llm_prompt_cached_ratio",
+    "Share of a BitNet completion's prompt tokens reused from the KV cache instead of evaluated",
+    buckets=(0, 0.25, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1),
+)
+LLM_PROMPT_EVAL_SAVED_SECONDS = Histogram(
+    "deepsymbol_llm_prompt_eval_saved_seconds",
+    "Prompt-evaluation time saved per BitNet completion by reusing the cached prompt prefix",
+    buckets=(0, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+LOCAL_LLM_BATCH_SIZE = Histogram(
+    "deepsymbol_local_llm_batch_size",
+    "Prompts per batched generate() call of the local LLM backend",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+LLM_FAILOVERS = Counter(
+    "deepsymbol_llm_failovers_total",
+    "Generations retried on the failover LLM backend after the primary failed",
+    ["from_backend", "to_backend"],
+)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """
+    Time the block into STAGE_SECONDS and count it as ok or error in STAGE_CALLS.
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+        STAGE_CALLS.labels(stage, outcome).inc()
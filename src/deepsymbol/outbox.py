@@ -0,0 +1,176 @@
+import os
+import threading
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict
+
+from deepsymbol import db
+from deepsymbol.firebase_store import save_outputs_batch
+from deepsymbol.metrics import OUTBOX_DELIVERIES, OUTBOX_PENDING, stage_timer
+from deepsymbol.queue import publish_outbox_job
+
+
+OUTBOX_BATCH = int(os.getenv("DEEPSYMBOL_OUTBOX_BATCH", "100"))
+OUTBOX_POLL_SECONDS = float(os.getenv("DEEPSYMBOL_OUTBOX_POLL_SECONDS", "1"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("DEEPSYMBOL_OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("DEEPSYMBOL_OUTBOX_MAX_BACKOFF", "300"))
+# One deadline for a whole batch's broker confirms, well inside the lease so
+# another dispatcher cannot re-claim rows this one is still publishing
+PUBLISH_DEADLINE = min(10.0, OUTBOX_LEASE_SECONDS / 4)
+
+
+def _backoff(attempts: int) -> float:
+    return min(0.5 * (2 ** attempts), OUTBOX_MAX_BACKOFF)
+
+
+class OutboxDispatcher:
+    """
+    Background delivery of locally committed interpretations:
+    Firestore first (batched), then the postprocess job (the worker patches the
+    Firestore doc, so it must exist). A row is deleted only after both succeed;
+    failures are retried with exponential backoff.
+
+    Delivery is at-least-once. Firestore docs are keyed by record id, so a
+    repeated write is harmless; a repeated postprocess message (e.g. one the
+    broker took after its row was deferred) only re-applies the same patch.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = OUTBOX_BATCH,
+        poll_seconds: float = OUTBOX_POLL_SECONDS,
+        save_batch: Callable[[Dict[str, Dict[str, Any]]], None] = save_outputs_batch,
+        publish: Callable[..., Future] = publish_outbox_job,
+    ):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.save_batch = save_batch
+        self.publish = publish
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def wake(self) -> None:
+        """
+        Nudge the dispatcher after a new entry was committed (starts it if needed).
+        """
+        self._ensure_started()
+        self._wake.set()
+
+    def start(self) -> None:
+        self._ensure_started()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                delivered = self.run_once()
+            except Exception as e:
+                print(f"[outbox] dispatcher error: {e}")
+                delivered = 0
+            if delivered < self.batch_size:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+        db.close_db()
+
+    def run_once(self) -> int:
+        """
+        Deliver one batch of due entries; returns how many were fully delivered.
+        """
+        rows = db.claim_outbox(self.batch_size, OUTBOX_LEASE_SECONDS)
+        if not rows:
+            OUTBOX_PENDING.set(db.outbox_depth())
+            return 0
+
+        # 1) Firestore, one WriteBatch for everything not yet written
+        to_save = [r for r in rows if not r["firestore_done"]]
+        if to_save:
+            try:
+                with stage_timer("firestore"):
+                    self.save_batch({str(r["record_id"]): r["payload"] for r in to_save})
+                db.mark_outbox_firestore_done([r["id"] for r in to_save])
+                OUTBOX_DELIVERIES.labels("firestore", "ok").inc(len(to_save))
+                for r in to_save:
+                    r["firestore_done"] = True
+            except Exception as e:
+                OUTBOX_DELIVERIES.labels("firestore", "error").inc(len(to_save))
+                print(f"[outbox] Firestore batch failed: {e}")
+                for r in to_save:
+                    db.defer_outbox([r["id"]], repr(e), _backoff(r["attempts"]))
+
+        # 2) RabbitMQ, only for entries whose Firestore doc exists
+        ready = [r for r in rows if r["firestore_done"]]
+        delivered = self._publish(ready) if ready else []
+
+        db.delete_outbox(delivered)
+        OUTBOX_PENDING.set(db.outbox_depth())
+        return len(delivered)
+
+    def _publish(self, rows: list) -> list:
+        """
+        Publish the rows' postprocess jobs and wait (up to PUBLISH_DEADLINE in
+        total) for the broker confirms; returns the ids of the rows that were
+        confirmed. Messages still queued at the deadline are withdrawn and their
+        rows deferred.
+        """
+        delivered = []
+        with stage_timer("rabbitmq"):
+            futures = [
+                (
+                    r,
+                    self.publish(
+                        {
+                            "id": r["record_id"],
+                            "objects": r["payload"]["objects"],
+                            "interpretation": r["payload"]["interpretation"],
+                        },
+                        message_id=f"outbox-{r['id']}",
+                    ),
+                )
+                for r in rows
+            ]
+            wait([fut for _, fut in futures], timeout=PUBLISH_DEADLINE)
+            for r, fut in futures:
+                if fut.done() and not fut.cancelled() and fut.exception() is None:
+                    delivered.append(r["id"])
+                    continue
+                # not yet handed to the publisher thread: withdraw it, so it is
+                # not sent later on top of the retry
+                fut.cancel()
+                if fut.done() and not fut.cancelled():
+                    error = fut.exception()
+                else:
+                    error = TimeoutError(f"no broker confirm within {PUBLISH_DEADLINE:.0f}s")
+                OUTBOX_DELIVERIES.labels("rabbitmq", "error").inc()
+                db.defer_outbox([r["id"]], repr(error), _backoff(r["attempts"]))
+        OUTBOX_DELIVERIES.labels("rabbitmq", "ok").inc(len(delivered))
+        return delivered
+
+
+_dispatcher: OutboxDispatcher | None = None
+
+
+def get_dispatcher() -> OutboxDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboxDispatcher()
+    return _dispatcher
+
+
+def stop_dispatcher(timeout: float = 5.0) -> None:
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop(timeout)
+        _dispatcher = None
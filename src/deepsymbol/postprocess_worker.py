@@ -1,14 +1,40 @@
 import json
 import os
+import signal
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
 import pika
+from prometheus_client import start_http_server
 
-from deepsymbol.firebase_store import update_output
+from deepsymbol.firebase_store import is_permanent_error, update_output, update_outputs_batch
+from deepsymbol.metrics import (
+    POSTPROCESS_BATCH_SECONDS,
+    POSTPROCESS_BATCH_SIZE,
+    POSTPROCESS_INFLIGHT,
+    POSTPROCESS_MESSAGES,
+    POSTPROCESS_QUEUE_DEPTH,
+    POSTPROCESS_QUEUE_LAG,
+    stage_timer,
+)
 
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 QUEUE_NAME = os.getenv("RABBITMQ_QUEUE", "postprocess")
 
+# Worker tuning: prefetch should be >= BATCH_SIZE * CONCURRENCY to keep all threads busy
+PREFETCH_COUNT = int(os.getenv("POSTPROCESS_PREFETCH", "200"))
+BATCH_SIZE = int(os.getenv("POSTPROCESS_BATCH_SIZE", "50"))
+FLUSH_INTERVAL = float(os.getenv("POSTPROCESS_FLUSH_INTERVAL", "0.5"))
+CONCURRENCY = int(os.getenv("POSTPROCESS_CONCURRENCY", "4"))
+METRICS_PORT = int(os.getenv("POSTPROCESS_METRICS_PORT", "9101"))
+# Pause before requeueing a batch that hit a transient Firestore error, so an
+# outage doesn't turn into a tight redelivery loop
+RETRY_BACKOFF = float(os.getenv("POSTPROCESS_RETRY_BACKOFF", "2"))
+
 
 def simple_postprocess(objects: list[str], interpretation: str) -> dict:
     # Very lightweight "post-processing" (no extra LLM, no heavy compute)
@@ -20,35 +46,232 @@ def simple_postprocess(objects: list[str], interpretation: str) -> dict:
     return {"post_summary": summary, "keywords": keywords, "processed_at": time.time()}
 
 
-def main():
-    while True:
+class _Batch:
+    def __init__(self, items: list):
+        self.items = items  # (delivery_tag, msg or None if undecodable)
+        self.done = False
+        self.dropped: set[int] = set()  # undecodable, or the doc is gone: never retried
+        self.retry: set[int] = set()  # transient failure: requeued
+
+    def settled(self, tag: int) -> bool:
+        return tag in self.dropped or tag in self.retry
+
+    @property
+    def last_tag(self) -> int:
+        return self.items[-1][0]
+
+
+class BatchingConsumer:
+    """
+    Groups deliveries into batches, writes each batch to Firestore on a thread pool
+    and acks in delivery order.
+
+    Acks are only ever sent from the connection thread (via add_callback_threadsafe),
+    and a batch is acked with multiple=True only once every earlier batch is settled,
+    so a slow batch can never be acked by a later one.
+    """
+
+    def __init__(
+        self,
+        connection,
+        channel,
+        executor: ThreadPoolExecutor,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        write_batch: Callable[[Dict[str, Dict[str, Any]]], None] = update_outputs_batch,
+        write_one: Callable[[str, Dict[str, Any]], None] = update_output,
+    ):
+        self.connection = connection
+        self.channel = channel
+        self.executor = executor
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.write_batch = write_batch
+        self.write_one = write_one
+        self._buffer: list = []
+        self._buffer_since = 0.0
+        self._inflight: deque[_Batch] = deque()
+        self._unacked = 0
+
+    def on_message(self, method, properties, body: bytes) -> None:
+        if properties is not None and properties.timestamp:
+            POSTPROCESS_QUEUE_LAG.observe(max(0.0, time.time() - properties.timestamp))
+        try:
+            msg = json.loads(body.decode("utf-8"))
+            str(msg["id"])
+        except Exception:
+            print(f"[postprocess] dropping undecodable message: {body[:200]!r}")
+            msg = None
+
+        if not self._buffer:
+            self._buffer_since = time.monotonic()
+        self._buffer.append((method.delivery_tag, msg))
+        self._unacked += 1
+        POSTPROCESS_INFLIGHT.set(self._unacked)
+        # steady traffic never lets the consumer go idle, so the age check
+        # cannot be left to tick() alone
+        if len(self._buffer) >= self.batch_size or self._buffer_expired():
+            self.flush()
+
+    def tick(self) -> None:
+        """
+        Called when the consumer is idle: flush a partial batch that has waited long enough.
+        """
+        if self._buffer_expired():
+            self.flush()
+
+    def _buffer_expired(self) -> bool:
+        return bool(self._buffer) and time.monotonic() - self._buffer_since >= self.flush_interval
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        batch = _Batch(self._buffer)
+        self._buffer = []
+        self._inflight.append(batch)
+        self.executor.submit(self._process, batch)
+
+    def _process(self, batch: _Batch) -> None:
+        started = time.perf_counter()
+        try:
+            patches: Dict[str, Dict[str, Any]] = {}
+            with stage_timer("postprocess"):
+                for tag, msg in batch.items:
+                    try:
+                        if msg is None:
+                            raise ValueError("undecodable")
+                        objects, interpretation = msg.get("objects", []), msg.get("interpretation", "")
+                        patches[str(msg["id"])] = simple_postprocess(objects, interpretation)
+                    except Exception as e:
+                        if msg is not None:
+                            print(f"[postprocess] dropping malformed message {msg.get('id')}: {e!r}")
+                        batch.dropped.add(tag)
+
+            failed = self._write(patches)
+            for tag, msg in batch.items:
+                if not batch.settled(tag) and str(msg["id"]) in failed:
+                    (batch.dropped if failed[str(msg["id"])] else batch.retry).add(tag)
+        except Exception as e:
+            print(f"[postprocess] batch failed: {e!r}; requeueing it")
+            batch.retry.update(tag for tag, _ in batch.items if not batch.settled(tag))
+        finally:
+            if batch.retry:
+                time.sleep(RETRY_BACKOFF)
+            POSTPROCESS_BATCH_SIZE.observe(len(batch.items))
+            POSTPROCESS_BATCH_SECONDS.observe(time.perf_counter() - started)
+            self.connection.add_callback_threadsafe(lambda: self._complete(batch))
+
+    def _write(self, patches: Dict[str, Dict[str, Any]]) -> Dict[str, bool]:
+        """
+        Write the patches; returns the ids that failed, mapped to whether the
+        failure is permanent (drop) rather than transient (retry).
+        """
+        if not patches:
+            return {}
         try:
-            params = pika.ConnectionParameters(host=RABBITMQ_HOST)
-            connection = pika.BlockingConnection(params)
-            channel = connection.channel()
-            channel.queue_declare(queue=QUEUE_NAME, durable=True)
+            with stage_timer("firestore"):
+                self.write_batch(patches)
+            return {}
+        except Exception as e:
+            if not is_permanent_error(e):
+                print(f"[postprocess] batch write failed ({e!r}); requeueing {len(patches)} docs")
+                return {record_id: False for record_id in patches}
+            # one bad doc (e.g. deleted in the meantime) fails the whole WriteBatch:
+            # retry individually so only the bad messages are dropped
+            print(f"[postprocess] batch write failed ({e}); retrying {len(patches)} docs one by one")
+
+        failed = {}
+        for record_id, patch in patches.items():
+            try:
+                with stage_timer("firestore"):
+                    self.write_one(record_id, patch)
+            except Exception as one_error:
+                print(f"[postprocess] update {record_id} failed: {one_error!r}")
+                failed[record_id] = is_permanent_error(one_error)
+        return failed
+
+    def _complete(self, batch: _Batch) -> None:
+        batch.done = True
+        while self._inflight and self._inflight[0].done:
+            head = self._inflight.popleft()
+            if not head.dropped and not head.retry:
+                self.channel.basic_ack(delivery_tag=head.last_tag, multiple=True)
+            else:
+                for tag, _ in head.items:
+                    if tag in head.dropped or tag in head.retry:
+                        self.channel.basic_nack(delivery_tag=tag, requeue=tag in head.retry)
+                    else:
+                        self.channel.basic_ack(delivery_tag=tag)
+            POSTPROCESS_MESSAGES.labels("ok").inc(len(head.items) - len(head.dropped) - len(head.retry))
+            POSTPROCESS_MESSAGES.labels("failed").inc(len(head.dropped))
+            POSTPROCESS_MESSAGES.labels("retried").inc(len(head.retry))
+            self._unacked -= len(head.items)
+        POSTPROCESS_INFLIGHT.set(self._unacked)
+
+    def pending(self) -> int:
+        return self._unacked
+
+
+def _install_signal_handlers(stop: threading.Event) -> None:
+    def handler(signum, frame):
+        print(f"[postprocess] received signal {signum}, shutting down...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
 
-            def callback(ch, method, properties, body):
-                msg = json.loads(body.decode("utf-8"))
-                record_id = str(msg["id"])
-                objects = msg.get("objects", [])
-                interpretation = msg.get("interpretation", "")
 
-                patch = simple_postprocess(objects, interpretation)
-                update_output(record_id, patch)
+def run(stop: threading.Event) -> None:
+    params = pika.ConnectionParameters(host=RABBITMQ_HOST)
+    connection = pika.BlockingConnection(params)
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
 
-                ch.basic_ack(delivery_tag=method.delivery_tag)
+    with ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="postprocess") as executor:
+        consumer = BatchingConsumer(connection, channel, executor)
+        print("[postprocess] waiting for messages...")
 
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
-            print("[postprocess] waiting for messages...")
-            channel.start_consuming()
+        last_depth_check = 0.0
+        for method, properties, body in channel.consume(QUEUE_NAME, inactivity_timeout=FLUSH_INTERVAL):
+            if method is not None:
+                consumer.on_message(method, properties, body)
+            else:
+                consumer.tick()
 
+            now = time.monotonic()
+            if now - last_depth_check >= 5:
+                declared = channel.queue_declare(queue=QUEUE_NAME, durable=True, passive=True)
+                POSTPROCESS_QUEUE_DEPTH.set(declared.method.message_count)
+                last_depth_check = now
+
+            if stop.is_set():
+                break
+
+        # graceful shutdown: stop deliveries, finish what we hold, ack it, close
+        consumer.flush()
+        deadline = time.monotonic() + 30
+        while consumer.pending() and time.monotonic() < deadline:
+            connection.process_data_events(time_limit=0.1)
+
+    requeued = channel.cancel()
+    if requeued:
+        print(f"[postprocess] returned {requeued} prefetched messages to the queue")
+    connection.close()
+
+
+def main():
+    stop = threading.Event()
+    _install_signal_handlers(stop)
+    start_http_server(METRICS_PORT)
+
+    while not stop.is_set():
+        try:
+            run(stop)
         except Exception as e:
             print(f"[postprocess] error: {e} — retrying in 3s")
-            time.sleep(3)
+            stop.wait(3)
 
 
 if __name__ == "__main__":
     main()
-
@@ -8,10 +8,13 @@ def build_prompt_from_objects(objects: list[str]) -> str:
             "Return only the interpretation."
         )
 
+    # Fixed instructions first and the detected objects last: BitNet reuses the
+    # evaluated KV state of the longest prefix shared with the previous prompt,
+    # so only this last line needs prompt processing.
     objects_str = ", ".join(objects)
     return (
-        f"Detected objects: {objects_str}.\n"
         "Interpret what these objects might symbolise psychologically (dream symbolism).\n"
         "Answer in 2-4 short sentences.\n"
-        "Do NOT repeat the prompt. Do NOT add headings. Just the interpretation."
+        "Do NOT repeat the prompt. Do NOT add headings. Just the interpretation.\n"
+        f"Detected objects: {objects_str}."
     )
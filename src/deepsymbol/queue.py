@@ -1,24 +1,247 @@
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
 import pika
+import pika.exceptions
 
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 QUEUE_NAME = os.getenv("RABBITMQ_QUEUE", "postprocess")
+# Async job pipeline: POST /jobs -> detect queue -> LLM queue (see inference_worker.py).
+# Both are priority queues; the declare arguments must match on every client.
+DETECT_QUEUE = os.getenv("RABBITMQ_DETECT_QUEUE", "inference_detect")
+LLM_QUEUE = os.getenv("RABBITMQ_LLM_QUEUE", "inference_llm")
+MAX_PRIORITY = 9
+QUEUE_ARGUMENTS = {
+    DETECT_QUEUE: {"x-max-priority": MAX_PRIORITY},
+    LLM_QUEUE: {"x-max-priority": MAX_PRIORITY},
+}
+
+# Publisher tuning
+PUBLISH_CONFIRMS = os.getenv("RABBITMQ_PUBLISH_CONFIRMS", "0") == "1"
+PUBLISH_BATCH = int(os.getenv("RABBITMQ_PUBLISH_BATCH", "100"))
+PUBLISH_QUEUE_SIZE = int(os.getenv("RABBITMQ_PUBLISH_QUEUE_SIZE", "10000"))
+MAX_BACKOFF = float(os.getenv("RABBITMQ_MAX_BACKOFF", "30"))
 
 
-def publish_postprocess_job(payload: dict) -> None:
+def _default_connection() -> pika.BlockingConnection:
     params = pika.ConnectionParameters(host=RABBITMQ_HOST)
-    connection = pika.BlockingConnection(params)
-    channel = connection.channel()
-    channel.queue_declare(queue=QUEUE_NAME, durable=True)
-
-    body = json.dumps(payload).encode("utf-8")
-    channel.basic_publish(
-        exchange="",
-        routing_key=QUEUE_NAME,
-        body=body,
-        properties=pika.BasicProperties(delivery_mode=2),  # persistent
-    )
-    connection.close()
+    return pika.BlockingConnection(params)
+
+
+class PostprocessPublisher:
+    """
+    Long-lived publisher: one background thread owns the AMQP connection
+    (pika's BlockingConnection is not thread-safe) and drains an in-memory queue.
+
+    - publish() returns immediately with a Future that resolves once the broker
+      accepted the message (confirmed, if publisher confirms are enabled)
+    - under burst, up to `batch_size` queued messages are published back to back
+    - connection failures are retried with exponential backoff, without losing
+      queued messages
+    """
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], pika.BlockingConnection] = _default_connection,
+        queue_name: str = QUEUE_NAME,
+        confirms: bool = PUBLISH_CONFIRMS,
+        batch_size: int = PUBLISH_BATCH,
+        max_pending: int = PUBLISH_QUEUE_SIZE,
+    ):
+        self.connection_factory = connection_factory
+        self.queue_name = queue_name
+        self.queue_arguments = QUEUE_ARGUMENTS.get(queue_name)
+        self.confirms = confirms
+        self.batch_size = max(1, batch_size)
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._connection = None
+        self._channel = None
+
+    def publish(self, payload: dict, message_id: str | None = None, priority: int | None = None) -> Future:
+        """
+        `message_id` is set on the AMQP message (it identifies retries of the same task);
+        `priority` (0..MAX_PRIORITY) only has an effect on priority queues.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        fut: Future = Future()
+        self._ensure_started()
+        try:
+            self._pending.put((body, fut, time.time(), message_id, priority), timeout=5)
+        except queue.Full:
+            raise RuntimeError("Postprocess publish queue is full")
+        return fut
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Flush what is queued (best effort within `timeout`) and close the connection.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="amqp-publisher", daemon=True)
+                self._thread.start()
+
+    def _ensure_channel(self):
+        if self._channel is None or not self._channel.is_open:
+            self._reset()
+            self._connection = self.connection_factory()
+            channel = self._connection.channel()
+            channel.queue_declare(queue=self.queue_name, durable=True, arguments=self.queue_arguments)
+            if self.confirms:
+                channel.confirm_delivery()
+            self._channel = channel
+        return self._channel
+
+    def _reset(self) -> None:
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+        self._channel = None
+
+    def _next_batch(self) -> list:
+        """
+        Up to `batch_size` queued messages. Their futures are marked running, so a
+        caller can no longer cancel them; messages whose caller already gave up
+        (cancelled future) are skipped.
+        """
+        try:
+            items = [self._pending.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return [item for item in items if item[1].set_running_or_notify_cancel()]
+
+    def _publish_batch(self, batch: list) -> None:
+        channel = self._ensure_channel()
+        while batch:
+            body, fut, enqueued_at, message_id, priority = batch[0]
+            try:
+                channel.basic_publish(
+                    exchange="",
+                    routing_key=self.queue_name,
+                    body=body,
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,  # persistent
+                        timestamp=int(enqueued_at),  # lets the worker report queue lag
+                        message_id=message_id,
+                        priority=priority,
+                    ),
+                )
+            except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+                # the broker refused this message; retrying will not help
+                batch.pop(0)
+                fut.set_exception(RuntimeError(f"Broker rejected message: {e}"))
+                continue
+            batch.pop(0)
+            fut.set_result(None)
+
+    def _run(self) -> None:
+        backoff = 0.5
+        batch: list = []
+        while True:
+            if not batch:
+                batch = self._next_batch()
+                if not batch:
+                    if self._stop.is_set():
+                        break
+                    self._keepalive()
+                    continue
+
+            try:
+                self._publish_batch(batch)
+                backoff = 0.5
+            except Exception as e:
+                print(f"[publisher] error: {e} — reconnecting in {backoff:.1f}s")
+                self._reset()
+                if self._stop.wait(backoff):
+                    self._fail_all(batch, e)
+                    batch = []
+                    break
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+        self._reset()
+
+    def _keepalive(self) -> None:
+        # let pika answer heartbeats while idle
+        if self._connection is not None and self._connection.is_open:
+            try:
+                self._connection.process_data_events(time_limit=0)
+            except Exception:
+                self._reset()
+
+    def _fail_all(self, batch: list, error: Exception) -> None:
+        while True:
+            try:
+                item = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if item[1].set_running_or_notify_cancel():
+                batch.append(item)
+        for _, fut, *_ in batch:
+            fut.set_exception(RuntimeError(f"Publisher closed before delivery: {error}"))
+
+
+_publishers: dict[tuple[str, bool], PostprocessPublisher] = {}
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(queue_name: str = QUEUE_NAME, confirms: bool = PUBLISH_CONFIRMS) -> PostprocessPublisher:
+    """
+    One long-lived publisher (thread + connection) per queue and confirm mode.
+    """
+    key = (queue_name, confirms)
+    with _publishers_lock:
+        publisher = _publishers.get(key)
+        if publisher is None:
+            publisher = _publishers[key] = PostprocessPublisher(queue_name=queue_name, confirms=confirms)
+        return publisher
+
+
+def publish_postprocess_job(payload: dict, message_id: str | None = None) -> Future:
+    return get_publisher().publish(payload, message_id=message_id)
+
+
+def publish_outbox_job(payload: dict, message_id: str | None = None) -> Future:
+    """
+    Postprocess job for an outbox row. Always sent with publisher confirms,
+    whatever RABBITMQ_PUBLISH_CONFIRMS says: the row is deleted once the Future
+    resolves, so that must mean the broker has the message.
+    """
+    return get_publisher(QUEUE_NAME, confirms=True).publish(payload, message_id=message_id)
+
+
+def publish_stage_task(queue_name: str, payload: dict, message_id: str | None = None, priority: int = 0) -> Future:
+    """
+    Queue a task for an inference worker stage (DETECT_QUEUE or LLM_QUEUE).
+    """
+    priority = max(0, min(int(priority), MAX_PRIORITY))
+    return get_publisher(queue_name).publish(payload, message_id=message_id, priority=priority)
+
 
+def close_publisher(timeout: float = 5.0) -> None:
+    with _publishers_lock:
+        publishers = list(_publishers.values())
+        _publishers.clear()
+    for publisher in publishers:
+        publisher.close(timeout)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from deepsymbol import llm, vision
+from deepsymbol.auth import get_fb_auth
+from deepsymbol.llm_backends import LLM_BACKEND, LLM_FAILOVER
+from deepsymbol.llm_bitnet import bitnet_ping_async
+from deepsymbol.metrics import READY, STARTUP_PHASE_SECONDS
+
+
+# Warm the detector, Firebase auth and the BitNet connection right after startup
+# (in the background, so /health answers meanwhile); /ready is 503 until done.
+# 0 = load everything lazily on first use and report ready immediately.
+PRELOAD = os.getenv("DEEPSYMBOL_PRELOAD", "1") == "1"
+# BitNet is a separate service with its own readiness: warm-up waits this long
+# for it to report a loaded model, then declares the API ready regardless
+BITNET_WAIT_SECONDS = float(os.getenv("DEEPSYMBOL_READY_BITNET_WAIT_SECONDS", "120"))
+BITNET_PING_INTERVAL = 2.0
+
+
+class Readiness:
+    """
+    Warm-up state behind /ready. The detector, Firebase auth and (when it is the
+    primary LLM backend) the local model are required: if one fails to load the
+    process stays unready, so it never gets traffic it cannot serve.
+    """
+
+    def __init__(
+        self,
+        bitnet_wait_seconds: float = BITNET_WAIT_SECONDS,
+        llm_backends: Optional[List[str]] = None,
+    ):
+        self.bitnet_wait_seconds = bitnet_wait_seconds
+        self.llm_backends = llm_backends or [b for b in (LLM_BACKEND, LLM_FAILOVER) if b]
+        self.ready = False
+        self.checks: Dict[str, str] = {"detector": "pending", "firebase": "pending"}
+        for backend in self.llm_backends:
+            self.checks["bitnet" if backend == "bitnet" else "local_llm"] = "pending"
+        self.timings: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def status(self) -> dict:
+        return {"status": "ready" if self.ready else "starting", "checks": dict(self.checks), "timings": dict(self.timings)}
+
+    def _record(self, phase: str, seconds: float) -> None:
+        self.timings[phase] = round(seconds, 3)
+        STARTUP_PHASE_SECONDS.labels(phase).set(seconds)
+
+    def _mark_ready(self) -> None:
+        self._record("total", time.perf_counter() - self._started)
+        self.ready = True
+        READY.set(1)
+
+    def start(self) -> None:
+        if not PRELOAD:
+            self.checks = {name: "lazy" for name in self.checks}
+            self._mark_ready()
+            return
+        self._task = asyncio.create_task(self.warm_up())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def warm_up(self) -> None:
+        steps = [self._warm_detector(), self._warm_firebase()]
+        if "bitnet" in self.llm_backends:
+            steps.append(self._ping_bitnet())
+        if "local" in self.llm_backends:
+            steps.append(self._warm_local_llm(required=self.llm_backends[0] == "local"))
+        results = await asyncio.gather(*steps)
+        if all(results):
+            self._mark_ready()
+            print(f"[startup] ready in {self.timings['total']:.2f}s: {self.timings}")
+        else:
+            print(f"[startup] warm-up failed, staying unready: {self.checks}")
+
+    async def _warm_detector(self) -> bool:
+        try:
+            phases = await run_in_threadpool(vision.warm_up)
+        except Exception as e:
+            self.checks["detector"] = f"error: {e}"
+            return False
+        for phase, seconds in phases.items():
+            self._record(phase, seconds)
+        self.checks["detector"] = "ok"
+        return True
+
+    async def _warm_firebase(self) -> bool:
+        started = time.perf_counter()
+        try:
+            await run_in_threadpool(get_fb_auth)
+        except Exception as e:
+            self.checks["firebase"] = f"error: {e}"
+            return False
+        self._record("firebase_init", time.perf_counter() - started)
+        self.checks["firebase"] = "ok"
+        return True
+
+    async def _warm_local_llm(self, required: bool) -> bool:
+        try:
+            phases = await run_in_threadpool(llm.warm_up)
+        except Exception as e:
+            self.checks["local_llm"] = f"error: {e}"
+            # as a failover only, a broken local model must not take the API down
+            return not required
+        for phase, seconds in phases.items():
+            self._record(phase, seconds)
+        self.checks["local_llm"] = "ok"
+        return True
+
+    async def _ping_bitnet(self) -> bool:
+        started = time.perf_counter()
+        deadline = started + self.bitnet_wait_seconds
+        while not await bitnet_ping_async():
+            if time.perf_counter() >= deadline:
+                self.checks["bitnet"] = "unreachable"
+                print(f"[startup] BitNet not ready after {self.bitnet_wait_seconds:.0f}s, continuing without it")
+                return True
+            await asyncio.sleep(BITNET_PING_INTERVAL)
+        self._record("bitnet_ping", time.perf_counter() - started)
+        self.checks["bitnet"] = "ok"
+        return True
+
+
+readiness = Readiness()
@@ -1,36 +1,112 @@
+import asyncio
+import io
+import os
+import time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import TYPE_CHECKING, List, Dict, Any, BinaryIO, Optional, Sequence, Union
 
-from ultralytics import YOLO
+import cv2
+import numpy as np
+
+from deepsymbol import vision_onnx
+from deepsymbol.batching import MicroBatcher
+from deepsymbol.metrics import (
+    DETECT_BATCH_MAX_SIZE,
+    DETECT_BATCH_MAX_WAIT,
+    DETECT_BATCH_SIZE,
+    DETECT_PHASE_SECONDS,
+    DETECT_QUEUE_WAIT,
+    DETECTED_OBJECTS,
+    stage_timer,
+)
+
+if TYPE_CHECKING:
+    from ultralytics import YOLO
 
 
 _MODEL_PATH = "yolo11n.pt"
-_yolo_model: YOLO | None = None
+# ultralytics (and torch) is imported by get_yolo_model, not at import time
+_yolo_model: Optional["YOLO"] = None
+_onnx_detector: vision_onnx.OnnxDetector | None = None
+
+# "torch" (Ultralytics/PyTorch) or "onnx" (onnxruntime CPU, see vision_onnx.py)
+DETECTOR_BACKEND = os.getenv("DEEPSYMBOL_DETECTOR_BACKEND", "torch").lower()
+
+# Detection settings (Ultralytics defaults): lower imgsz / higher conf trade
+# accuracy for latency; DEEPSYMBOL_DETECT_CLASSES is a comma-separated allow-list
+# of class names (empty = all 80 COCO classes)
+IMGSZ = int(os.getenv("DEEPSYMBOL_DETECT_IMGSZ", "640"))
+CONF = float(os.getenv("DEEPSYMBOL_DETECT_CONF", "0.25"))
+IOU = float(os.getenv("DEEPSYMBOL_DETECT_IOU", "0.7"))
+MAX_DET = int(os.getenv("DEEPSYMBOL_DETECT_MAX_DET", "300"))
+CLASSES = [c.strip() for c in os.getenv("DEEPSYMBOL_DETECT_CLASSES", "").split(",") if c.strip()]
+
+# Uploads larger than this (longest side, pixels) are downscaled right after
+# decoding, before they are queued for the model; 0 disables it
+MAX_IMAGE_SIDE = int(os.getenv("DEEPSYMBOL_MAX_IMAGE_SIDE", "1280"))
+
+# Micro-batching: concurrent callers are collected for up to BATCH_WAIT_MS
+# (or until BATCH_SIZE images are queued) and share one forward pass.
+BATCH_SIZE = int(os.getenv("DEEPSYMBOL_DETECT_BATCH_SIZE", "8"))
+BATCH_WAIT_MS = float(os.getenv("DEEPSYMBOL_DETECT_BATCH_WAIT_MS", "10"))
+
+
+def detector_fingerprint() -> Dict[str, Any]:
+    """
+    Everything besides the image that shapes a detection result (used in cache keys).
+    """
+    model = _MODEL_PATH
+    if DETECTOR_BACKEND == "onnx":
+        model = f"{vision_onnx.ONNX_MODEL_PATH} int8={vision_onnx.ONNX_INT8}"
+    return {
+        "backend": DETECTOR_BACKEND,
+        "model": model,
+        "imgsz": IMGSZ,
+        "conf": CONF,
+        "iou": IOU,
+        "max_det": MAX_DET,
+        "classes": sorted(CLASSES),
+        "max_image_side": MAX_IMAGE_SIDE,
+    }
 
 
-def get_yolo_model() -> YOLO:
+def get_yolo_model() -> "YOLO":
     """
     Lazily load YOLO model (only once).
     """
     global _yolo_model
     if _yolo_model is None:
+        from ultralytics import YOLO
+
         _yolo_model = YOLO(_MODEL_PATH)
     return _yolo_model
 
 
-def detect_objects(image_path: str) -> Dict[str, Any]:
+def get_onnx_detector() -> vision_onnx.OnnxDetector:
     """
-    Run object detection on an image and return detected objects.
+    Lazily export (first run only) and load the ONNX detector.
     """
-    img_path = Path(image_path)
-    if not img_path.exists():
-        raise FileNotFoundError(f"Image not found: {img_path}")
+    global _onnx_detector
+    if _onnx_detector is None:
+        path = vision_onnx.export_onnx(_MODEL_PATH, int8=vision_onnx.ONNX_INT8)
+        _onnx_detector = vision_onnx.OnnxDetector(path)
+    return _onnx_detector
 
-    model = get_yolo_model()
 
-    results = model(str(img_path), device="cpu")
-    r = results[0]
+def class_ids(names: Dict[int, str], allowed: Sequence[str]) -> Optional[List[int]]:
+    """
+    Map a class-name allow-list onto the model's class ids (None = no filter).
+    """
+    if not allowed:
+        return None
+    lookup = {str(n).lower(): int(i) for i, n in names.items()}
+    unknown = [c for c in allowed if c.lower() not in lookup]
+    if unknown:
+        raise RuntimeError(f"Unknown detection classes in DEEPSYMBOL_DETECT_CLASSES: {', '.join(unknown)}")
+    return sorted(lookup[c.lower()] for c in allowed)
+
 
+def _result_to_dict(r) -> Dict[str, Any]:
     class_ids = r.boxes.cls.tolist() if r.boxes is not None else []
     scores = r.boxes.conf.tolist() if r.boxes is not None else []
 
@@ -38,9 +114,180 @@ def detect_objects(image_path: str) -> Dict[str, Any]:
     for cls_id in class_ids:
         names.append(r.names[int(cls_id)])
 
+    speed = r.speed or {}
     return {
         "objects": names,
         "confidences": scores,
         "num_objects": len(names),
+        "timings": {
+            "preprocess_ms": speed.get("preprocess"),
+            "inference_ms": speed.get("inference"),
+            "postprocess_ms": speed.get("postprocess"),
+        },
     }
 
+
+def _detect_batch(
+    sources: list,
+    imgsz: int = IMGSZ,
+    conf: float = CONF,
+    iou: float = IOU,
+    max_det: int = MAX_DET,
+    classes: Sequence[str] = CLASSES,
+) -> List[Dict[str, Any]]:
+    """
+    Run a single YOLO forward pass over several images.
+    """
+    if DETECTOR_BACKEND == "onnx":
+        detector = get_onnx_detector()
+        return detector(
+            sources, imgsz=imgsz, conf=conf, iou=iou, max_det=max_det, classes=class_ids(detector.names, classes)
+        )
+    if DETECTOR_BACKEND != "torch":
+        raise RuntimeError(f"Unknown DEEPSYMBOL_DETECTOR_BACKEND: {DETECTOR_BACKEND!r}")
+
+    model = get_yolo_model()
+    results = model(
+        sources,
+        device="cpu",
+        batch=len(sources),
+        imgsz=imgsz,
+        conf=conf,
+        iou=iou,
+        max_det=max_det,
+        classes=class_ids(model.names, classes),
+        verbose=False,
+    )
+    return [_result_to_dict(r) for r in results]
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Load the configured detector and run one synthetic image through it, so the
+    first real request pays neither model loading nor first-inference setup.
+    Returns seconds per phase.
+
+    Raises RuntimeError if DEEPSYMBOL_DETECT_CLASSES names a class the model
+    does not know, so a typo keeps /ready red instead of failing every request.
+    """
+    started = time.perf_counter()
+    detector = get_onnx_detector() if DETECTOR_BACKEND == "onnx" else get_yolo_model()
+    class_ids(detector.names, CLASSES)
+    loaded = time.perf_counter()
+    _detect_batch([np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8)])
+    return {"detector_load": loaded - started, "detector_warmup": time.perf_counter() - loaded}
+
+
+class DetectionBatcher(MicroBatcher):
+    """
+    Groups detection requests into batched model calls (see MicroBatcher).
+    """
+
+    thread_name = "yolo-batcher"
+
+    def __init__(self, max_batch_size: int = BATCH_SIZE, max_wait_ms: float = BATCH_WAIT_MS):
+        super().__init__(max_batch_size, max_wait_ms)
+        DETECT_BATCH_MAX_SIZE.set(self.max_batch_size)
+        DETECT_BATCH_MAX_WAIT.set(self.max_wait)
+
+    def run_batch(self, items: List[Any], waited: List[float]) -> List[Dict[str, Any]]:
+        for seconds in waited:
+            DETECT_QUEUE_WAIT.observe(seconds)
+        DETECT_BATCH_SIZE.observe(len(items))
+        return _detect_batch(items)
+
+
+_batcher: DetectionBatcher | None = None
+
+
+def get_batcher() -> DetectionBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = DetectionBatcher()
+    return _batcher
+
+
+ImageInput = Union[str, Path, bytes, bytearray, memoryview, BinaryIO, np.ndarray]
+
+
+def decode_image(data: bytes | bytearray | memoryview) -> np.ndarray:
+    """
+    Decode encoded image bytes (JPEG/PNG/...) straight from memory into a BGR array.
+    """
+    arr = np.frombuffer(data, dtype=np.uint8)
+    img = cv2.imdecode(arr, cv2.IMREAD_COLOR) if arr.size else None
+    if img is None:
+        raise ValueError("Could not decode image data")
+    return img
+
+
+def downscale(img: np.ndarray, max_side: int = MAX_IMAGE_SIDE) -> np.ndarray:
+    """
+    Shrink images whose longest side exceeds `max_side` (the model letterboxes to
+    IMGSZ anyway, so this only saves memory and resize work later on).
+    """
+    h, w = img.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return img
+    r = max_side / max(h, w)
+    return cv2.resize(img, (max(1, round(w * r)), max(1, round(h * r))), interpolation=cv2.INTER_AREA)
+
+
+def _to_source(image: ImageInput) -> np.ndarray:
+    """
+    Normalise the accepted inputs into a decoded (and if needed downscaled) BGR array.
+    """
+    if isinstance(image, np.ndarray):
+        return downscale(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return downscale(decode_image(image))
+    if isinstance(image, (str, Path)):
+        img_path = Path(image)
+        if not img_path.exists():
+            raise FileNotFoundError(f"Image not found: {img_path}")
+        img = cv2.imread(str(img_path), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Could not decode image: {img_path}")
+        return downscale(img)
+    if isinstance(image, io.IOBase) or hasattr(image, "read"):
+        return downscale(decode_image(image.read()))
+    raise TypeError(f"Unsupported image input: {type(image).__name__}")
+
+
+def _with_decode_time(result: Dict[str, Any], started: float, finished: float) -> Dict[str, Any]:
+    timings = dict(result.get("timings") or {})
+    timings["decode_ms"] = (finished - started) * 1000
+    for name, ms in timings.items():
+        if ms is not None:
+            DETECT_PHASE_SECONDS.labels(name.removesuffix("_ms")).observe(ms / 1000)
+    DETECTED_OBJECTS.observe(result.get("num_objects", len(result.get("objects", []))))
+    return {**result, "timings": timings}
+
+
+def detect_objects(image: ImageInput) -> Dict[str, Any]:
+    """
+    Run object detection on an image and return detected objects.
+    Accepts a path, encoded bytes, a binary buffer or a decoded BGR numpy array.
+    `timings` holds per-stage milliseconds (decode, preprocess, inference, postprocess).
+    """
+    with stage_timer("detect"):
+        started = time.perf_counter()
+        source = _to_source(image)
+        decoded = time.perf_counter()
+        return _with_decode_time(get_batcher().submit(source).result(), started, decoded)
+
+
+async def detect_objects_async(image: ImageInput) -> Dict[str, Any]:
+    """
+    Await detection without blocking the event loop; shares batches with other callers.
+    """
+    with stage_timer("detect"):
+        started = time.perf_counter()
+        if isinstance(image, np.ndarray) and max(image.shape[:2]) <= MAX_IMAGE_SIDE:
+            source = image
+        else:
+            # decoding/resizing is CPU work, keep it off the event loop
+            source = await asyncio.to_thread(_to_source, image)
+        decoded = time.perf_counter()
+        result = await asyncio.wrap_future(get_batcher().submit(source))
+        return _with_decode_time(result, started, decoded)
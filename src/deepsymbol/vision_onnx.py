@@ -0,0 +1,191 @@
+import ast
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+
+ONNX_MODEL_PATH = os.getenv("DEEPSYMBOL_ONNX_MODEL", "yolo11n.onnx")
+ONNX_INT8 = os.getenv("DEEPSYMBOL_ONNX_INT8", "0") == "1"
+ONNX_THREADS = int(os.getenv("DEEPSYMBOL_ONNX_THREADS", "0"))  # 0 = onnxruntime default
+
+# Ultralytics predict() defaults, so both backends report the same detections
+IMGSZ = 640
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DET = 300
+STRIDE = 32
+
+
+def int8_path(path: str) -> str:
+    p = Path(path)
+    return str(p.with_name(f"{p.stem}.int8{p.suffix}"))
+
+
+def export_onnx(weights: str, output: str = ONNX_MODEL_PATH, int8: bool = False, imgsz: int = IMGSZ) -> str:
+    """
+    Export the Torch weights to ONNX once (dynamic batch) and optionally write an
+    INT8 dynamically-quantized copy next to it. Existing files are reused, so this
+    is cheap after the first call. Returns the path to load.
+    """
+    target = int8_path(output) if int8 else output
+    if os.path.exists(target):
+        return target
+
+    if not os.path.exists(output):
+        from ultralytics import YOLO
+
+        exported = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, verbose=False)
+        if os.path.abspath(exported) != os.path.abspath(output):
+            os.replace(exported, output)
+
+    if int8:
+        import onnx
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(output, target, weight_type=QuantType.QUInt8)
+        # keep the class names (and other export metadata) on the quantized model
+        source = onnx.load(output, load_external_data=False)
+        quantized = onnx.load(target)
+        if not quantized.metadata_props:
+            for prop in source.metadata_props:
+                quantized.metadata_props.add(key=prop.key, value=prop.value)
+            onnx.save(quantized, target)
+    return target
+
+
+def letterbox(img: np.ndarray, size: int = IMGSZ) -> np.ndarray:
+    """
+    Resize keeping the aspect ratio and pad to size x size with gray (114),
+    like Ultralytics' LetterBox.
+    """
+    h, w = img.shape[:2]
+    r = min(size / h, size / w)
+    nh, nw = round(h * r), round(w * r)
+    if (nh, nw) != (h, w):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top, left = (size - nh) // 2, (size - nw) // 2
+    out = np.full((size, size, 3), 114, dtype=np.uint8)
+    out[top:top + nh, left:left + nw] = img
+    return out
+
+
+def preprocess(images: List[np.ndarray], size: int = IMGSZ) -> np.ndarray:
+    """
+    BGR uint8 HWC images -> float32 NCHW RGB in [0, 1].
+    """
+    batch = np.stack([letterbox(img, size) for img in images])
+    batch = batch[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def postprocess(
+    pred: np.ndarray,
+    names: Dict[int, str],
+    conf: float = CONF_THRESHOLD,
+    iou: float = IOU_THRESHOLD,
+    max_det: int = MAX_DET,
+    classes: Optional[Sequence[int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Decode raw YOLO11 output (batch, 4 + classes, anchors) with per-class NMS
+    into the detector contract, highest confidence first. `classes` keeps only
+    those class ids (applied after the best class is picked, as Ultralytics does).
+    """
+    results = []
+    for p in pred:
+        p = p.T  # (anchors, 4 + classes): cx, cy, w, h, class scores
+        scores = p[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences > conf
+        if classes is not None:
+            keep &= np.isin(class_ids, classes)
+        boxes, confidences, class_ids = p[keep, :4], confidences[keep], class_ids[keep]
+
+        objects: List[str] = []
+        kept_conf: List[float] = []
+        if len(boxes):
+            xywh = np.column_stack((boxes[:, 0] - boxes[:, 2] / 2, boxes[:, 1] - boxes[:, 3] / 2, boxes[:, 2], boxes[:, 3]))
+            idx = cv2.dnn.NMSBoxesBatched(
+                xywh.tolist(), confidences.tolist(), class_ids.tolist(), conf, iou
+            )
+            idx = sorted(np.array(idx).reshape(-1).tolist(), key=lambda i: -confidences[i])[:max_det]
+            objects = [names.get(int(class_ids[i]), str(int(class_ids[i]))) for i in idx]
+            kept_conf = [float(confidences[i]) for i in idx]
+
+        results.append({"objects": objects, "confidences": kept_conf, "num_objects": len(objects)})
+    return results
+
+
+def _load_image(source) -> np.ndarray:
+    if isinstance(source, np.ndarray):
+        return source
+    img = cv2.imread(str(source), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not read image: {source}")
+    return img
+
+
+class OnnxDetector:
+    """
+    YOLO detector on onnxruntime's CPU provider: no PyTorch import, lower
+    per-call overhead. Same output contract as the Torch backend.
+    """
+
+    def __init__(self, model_path: str, imgsz: int = IMGSZ, threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        # a static export only accepts its fixed batch size and input size
+        batch_dim, _, height_dim, _ = self.session.get_inputs()[0].shape
+        self.fixed_batch = batch_dim if isinstance(batch_dim, int) else None
+        self.fixed_size = height_dim if isinstance(height_dim, int) else None
+        self.imgsz = imgsz
+
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = ast.literal_eval(meta["names"]) if "names" in meta else {}
+
+    def __call__(
+        self,
+        sources: list,
+        imgsz: Optional[int] = None,
+        conf: float = CONF_THRESHOLD,
+        iou: float = IOU_THRESHOLD,
+        max_det: int = MAX_DET,
+        classes: Optional[Sequence[int]] = None,
+    ) -> List[Dict[str, Any]]:
+        images = [_load_image(s) for s in sources]
+        # the network downsamples by 32: round up like Ultralytics' check_imgsz
+        imgsz = self.fixed_size or -(-(imgsz or self.imgsz) // STRIDE) * STRIDE
+        settings = dict(imgsz=imgsz, conf=conf, iou=iou, max_det=max_det, classes=classes)
+        if self.fixed_batch == 1:
+            return [r for img in images for r in self._run([img], **settings)]
+        return self._run(images, **settings)
+
+    def _run(self, images: List[np.ndarray], imgsz: int, **nms) -> List[Dict[str, Any]]:
+        t0 = time.perf_counter()
+        batch = preprocess(images, imgsz)
+        t1 = time.perf_counter()
+        pred = self.session.run(None, {self.input_name: batch})[0]
+        t2 = time.perf_counter()
+        results = postprocess(pred, self.names, **nms)
+        t3 = time.perf_counter()
+
+        # per-image milliseconds, like Ultralytics' Results.speed
+        n = len(images)
+        for r in results:
+            r["timings"] = {
+                "preprocess_ms": (t1 - t0) * 1000 / n,
+                "inference_ms": (t2 - t1) * 1000 / n,
+                "postprocess_ms": (t3 - t2) * 1000 / n,
+            }
+        return results
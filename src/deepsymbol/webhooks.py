@@ -0,0 +1,67 @@
+import hashlib
+import hmac
+import ipaddress
+import os
+import socket
+import time
+from typing import Dict
+from urllib.parse import urlsplit
+
+
+# Job results are POSTed to client-supplied URLs from inside the compose
+# network, so callback targets must resolve to public addresses only (no
+# bitnet:8080, RabbitMQ management, cloud metadata, ...). Hosts listed here
+# (exact names, or ".example.com" for a domain and its subdomains) skip the
+# address check, e.g. for an internal receiver; other hosts still get it.
+ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("DEEPSYMBOL_CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip()]
+
+# Shared secret for the X-DeepSymbol-Signature header. Callbacks are refused
+# while it is unset.
+WEBHOOK_SECRET = os.getenv("DEEPSYMBOL_WEBHOOK_SECRET", "")
+
+
+def _allow_listed(host: str) -> bool:
+    return any(host == h or (h.startswith(".") and (host.endswith(h) or host == h[1:])) for h in ALLOWED_HOSTS)
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_url(url: str) -> None:
+    """
+    Raise ValueError unless `url` is an http(s) URL whose host is allow-listed
+    or resolves only to public addresses. Resolves DNS, so call it off the event loop.
+    """
+    if not WEBHOOK_SECRET:
+        raise ValueError("callbacks are disabled (DEEPSYMBOL_WEBHOOK_SECRET is not set)")
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if _allow_listed(host):
+        return
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError) as e:
+        raise ValueError(f"callback host {host!r} does not resolve: {e}")
+    if not infos or not all(_is_public(info[4][0]) for info in infos):
+        raise ValueError(f"callback host {host!r} resolves to a non-public address")
+
+
+def sign(body: bytes, timestamp: int | None = None) -> Dict[str, str]:
+    """
+    Headers letting the receiver verify the callback: HMAC-SHA256 over
+    "<timestamp>.<body>" with the shared secret (the timestamp bounds replays).
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(WEBHOOK_SECRET.encode("utf-8"), f"{timestamp}.".encode("ascii") + body, hashlib.sha256)
+    return {
+        "X-DeepSymbol-Timestamp": str(timestamp),
+        "X-DeepSymbol-Signature": f"sha256={digest.hexdigest()}",
+    }
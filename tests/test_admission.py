@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from deepsymbol.admission import AdmissionLimiter, Overloaded
+
+
+def test_limiter_queues_fifo_and_rejects_when_full():
+    limiter = AdmissionLimiter("test", max_concurrency=1, max_queue=2)
+    order = []
+
+    async def job(name, hold):
+        async with limiter.slot():
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def run():
+        first = asyncio.create_task(job("a", 0.05))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(job(n, 0)) for n in ("b", "c")]
+        await asyncio.sleep(0)
+        assert (limiter.active, limiter.waiting) == (1, 2)
+
+        with pytest.raises(Overloaded) as exc:
+            async with limiter.slot():
+                pass
+        assert exc.value.retry_after >= 1
+
+        await asyncio.gather(first, *queued)
+
+    asyncio.run(run())
+    assert order == ["a", "b", "c"]
+    assert (limiter.active, limiter.waiting) == (0, 0)
+
+
+def test_deadline_cancels_queued_and_running_work():
+    limiter = AdmissionLimiter("test", max_concurrency=1, max_queue=4)
+
+    async def run():
+        cancelled = asyncio.Event()
+
+        async def upstream():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def call(timeout):
+            async with asyncio.timeout(timeout):
+                async with limiter.slot():
+                    await upstream()
+
+        running = asyncio.create_task(call(0.1))
+        await asyncio.sleep(0)
+        with pytest.raises(TimeoutError):
+            await call(0.02)  # times out while queued
+        assert limiter.waiting == 0
+
+        with pytest.raises(TimeoutError):
+            await running  # times out mid-call: the upstream call is cancelled
+        assert cancelled.is_set()
+
+        async with limiter.slot():  # the slot was released
+            pass
+
+    asyncio.run(run())
+    assert (limiter.active, limiter.waiting) == (0, 0)
@@ -0,0 +1,488 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+import firebase_admin
+
+# keep the sqlite history created by deepsymbol.api out of the repo
+os.environ.setdefault("DEEPSYMBOL_DB_PATH", os.path.join(tempfile.mkdtemp(), "deepsymbol.db"))
+
+
+def test_health_latency_flat_while_interpretations_in_flight(monkeypatch):
+    # Make sure auth.py does not try to init Firebase in this test
+    firebase_admin._apps = ["already-initialized"]
+
+    from deepsymbol import api, llm_bitnet, vision
+
+    def slow_detect_batch(sources):
+        time.sleep(0.2)  # blocking, like a real YOLO forward pass
+        return [{"objects": ["dog"], "confidences": [0.9], "num_objects": 1} for _ in sources]
+
+    async def slow_llm(prompt):
+        await asyncio.sleep(0.5)
+        return "A dog often symbolises loyalty."
+
+    def slow_persist(objects, interpretation):
+        time.sleep(0.2)  # sqlite + Firestore + RabbitMQ
+        return 1
+
+    monkeypatch.setattr(vision, "_detect_batch", slow_detect_batch)
+    monkeypatch.setattr(llm_bitnet, "bitnet_chat_completion_async", slow_llm)
+    monkeypatch.setattr(api, "_persist", slow_persist)
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    async def health_latency(client):
+        t0 = time.perf_counter()
+        r = await client.get("/health")
+        assert r.status_code == 200
+        return time.perf_counter() - t0
+
+    with open("data/test.jpg", "rb") as f:
+        image = f.read()
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            idle = [await health_latency(client) for _ in range(5)]
+
+            jobs = [
+                asyncio.create_task(
+                    client.post("/interpret-image", files={"file": ("a.jpg", image, "image/jpeg")})
+                )
+                for _ in range(6)
+            ]
+            await asyncio.sleep(0.05)
+
+            busy = []
+            while not all(j.done() for j in jobs):
+                busy.append(await health_latency(client))
+                await asyncio.sleep(0.02)
+            responses = await asyncio.gather(*jobs)
+        return idle, busy, responses
+
+    idle, busy, responses = asyncio.run(run())
+
+    assert all(r.status_code == 200 for r in responses)
+    assert len(busy) > 10
+    # a blocked loop would make /health wait for a full YOLO / LLM / persist step
+    assert max(busy) < 0.1
+    assert sorted(busy)[len(busy) // 2] < max(idle) + 0.05
+
+
+def test_interpret_image_rejects_oversized_upload(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api
+
+    monkeypatch.setattr(api, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    client = TestClient(api.app)
+    r = client.post("/interpret-image", files={"file": ("big.jpg", b"x" * 4096, "image/jpeg")})
+    assert r.status_code == 413
+
+
+def test_oversized_bodies_are_rejected_before_multipart_parsing(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api
+
+    read = []
+    monkeypatch.setattr(api, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(api, "_FORM_OVERHEAD", 512)
+    monkeypatch.setattr(api, "_read_upload", lambda f: read.append(f))
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    # declared Content-Length
+    r = TestClient(api.app).post("/interpret-image", files={"file": ("big.jpg", b"x" * 4096, "image/jpeg")})
+    assert r.status_code == 413 and "Request body exceeds" in r.json()["detail"]
+
+    # chunked, no Content-Length: counted while it is received
+    async def chunks():
+        yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.jpg\"\r\n\r\n"
+        for _ in range(8):
+            yield b"x" * 512
+
+    async def post_chunked():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/interpret-image", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=b"}
+            )
+
+    r = asyncio.run(post_chunked())
+    assert r.status_code == 413
+    assert read == []
+
+
+def test_interpretation_cache_key_ignores_object_order():
+    firebase_admin._apps = ["already-initialized"]
+
+    from deepsymbol import api
+
+    assert api.interpretation_key(["person", "dog"]) == api.interpretation_key(["Dog", "person"])
+    assert api.interpretation_key(["dog"]) != api.interpretation_key(["dog", "dog"])
+
+
+def test_stream_endpoint_sends_detections_then_tokens(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api, cache, llm_bitnet, vision
+
+    monkeypatch.setattr(
+        vision,
+        "_detect_batch",
+        lambda sources: [{"objects": ["owl"], "confidences": [0.8], "num_objects": 1} for _ in sources],
+    )
+    monkeypatch.setattr(cache.detection_cache, "get", lambda key: None)
+    monkeypatch.setattr(api.interpretation_cache, "get", lambda key: None)
+
+    async def fake_stream(prompt):
+        for piece in ["An owl ", "suggests wisdom."]:
+            yield piece
+
+    monkeypatch.setattr(llm_bitnet, "bitnet_chat_completion_stream", fake_stream)
+    monkeypatch.setattr(api, "_persist", lambda objects, interpretation: 42)
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    with open("data/test.jpg", "rb") as f:
+        image = f.read()
+
+    client = TestClient(api.app)
+    with client.stream("POST", "/interpret-image/stream", files={"file": ("a.jpg", image, "image/jpeg")}) as r:
+        assert r.status_code == 200
+        events = [line[len("event: "):] for line in r.iter_lines() if line.startswith("event: ")]
+
+    assert events == ["detections", "token", "token", "done"]
+
+
+def test_llm_queue_full_returns_503_with_retry_after(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api, cache, vision
+    from deepsymbol.admission import AdmissionLimiter
+
+    monkeypatch.setattr(
+        vision,
+        "_detect_batch",
+        lambda sources: [{"objects": ["owl"], "confidences": [0.8], "num_objects": 1} for _ in sources],
+    )
+    monkeypatch.setattr(cache.detection_cache, "get", lambda key: None)
+    monkeypatch.setattr(api.interpretation_cache, "get", lambda key: None)
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    # no queue and the only slot already taken
+    limiter = AdmissionLimiter("llm", max_concurrency=1, max_queue=0)
+    limiter._active = 1
+    monkeypatch.setattr(api, "llm_limiter", limiter)
+
+    with open("data/test.jpg", "rb") as f:
+        image = f.read()
+
+    client = TestClient(api.app)
+    for path in ("/interpret-image", "/interpret-image/stream"):
+        r = client.post(path, files={"file": ("a.jpg", image, "image/jpeg")})
+        assert r.status_code == 503
+        assert int(r.headers["Retry-After"]) >= 1
+
+
+def test_batch_endpoint_dedupes_object_sets_and_bulk_persists(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    import json
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api, cache, llm_bitnet, vision
+
+    detect_calls = []
+
+    def fake_detect_batch(sources):
+        detect_calls.append(len(sources))
+        return [{"objects": ["owl"], "confidences": [0.8], "num_objects": 1} for _ in sources]
+
+    llm_calls = []
+
+    async def fake_llm(prompt):
+        llm_calls.append(prompt)
+        return "An owl suggests wisdom."
+
+    persisted = []
+
+    def fake_persist_many(rows):
+        persisted.append(rows)
+        return list(range(100, 100 + len(rows)))
+
+    monkeypatch.setattr(vision, "_detect_batch", fake_detect_batch)
+    monkeypatch.setattr(cache.detection_cache, "get", lambda key: None)
+    monkeypatch.setattr(api.interpretation_cache, "get", lambda key: None)
+    monkeypatch.setattr(llm_bitnet, "bitnet_chat_completion_async", fake_llm)
+    monkeypatch.setattr(api, "_persist_many", fake_persist_many)
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    with open("data/test.jpg", "rb") as f:
+        image = f.read()
+    files = [
+        ("files", ("a.jpg", image, "image/jpeg")),
+        ("files", ("broken.jpg", b"not an image", "image/jpeg")),
+        ("files", ("b.jpg", image, "image/jpeg")),
+    ]
+
+    client = TestClient(api.app)
+    with client.stream("POST", "/interpret-images", files=files) as r:
+        assert r.status_code == 200
+        events = []
+        event = None
+        for line in r.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+
+    items = {data["index"]: data for name, data in events if name == "item"}
+    assert "error" in items[1]
+    assert items[0]["interpretation"] == items[2]["interpretation"] == "An owl suggests wisdom."
+    assert len(llm_calls) == 1  # both owls share one generation
+    assert sum(detect_calls) == 2
+
+    assert len(persisted) == 1 and len(persisted[0]) == 2  # one bulk write
+    name, done = events[-1]
+    assert name == "done"
+    assert done["items"] == [{"index": 0, "id": 100}, {"index": 2, "id": 101}]
+
+
+def test_jobs_submit_and_poll(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    import base64
+    from concurrent.futures import Future
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api
+
+    jobs = {}
+    published = []
+
+    def fake_publish(queue_name, message, message_id=None, priority=0):
+        published.append((message, message_id))
+        fut = Future()
+        fut.set_result(None)
+        return fut
+
+    monkeypatch.setattr(api, "create_job", lambda job_id, doc: jobs.__setitem__(job_id, dict(doc)))
+    monkeypatch.setattr(api, "get_job", lambda job_id: jobs.get(job_id))
+    monkeypatch.setattr(api, "publish_stage_task", fake_publish)
+    user = {"uid": "u1"}
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: user)
+
+    client = TestClient(api.app)
+    r = client.post("/jobs", files={"file": ("a.jpg", b"jpeg bytes", "image/jpeg")})
+    assert r.status_code == 202
+    job_id = r.json()["job_id"]
+    assert r.headers["Location"] == f"/jobs/{job_id}"
+
+    message, message_id = published[0]
+    assert message_id == f"{job_id}-detect" and base64.b64decode(message["image_b64"]) == b"jpeg bytes"
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "queued"
+
+    # a worker finishes it
+    jobs[job_id].update(status="done", result={"objects": ["owl"], "interpretation": "Wisdom."})
+    body = client.get(f"/jobs/{job_id}").json()
+    assert body["status"] == "done" and body["result"]["objects"] == ["owl"]
+    assert "uid" not in body
+
+    user["uid"] = "someone-else"
+    assert client.get(f"/jobs/{job_id}").status_code == 404
+
+
+def test_ready_turns_green_only_after_warm_up(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api, startup
+
+    pings = []
+
+    async def bitnet_ping():
+        pings.append(1)
+        return len(pings) > 1  # BitNet comes up on the second ping
+
+    monkeypatch.setattr(startup.vision, "warm_up", lambda: {"detector_load": 0.5, "detector_warmup": 0.1})
+    monkeypatch.setattr(startup, "get_fb_auth", lambda: None)
+    monkeypatch.setattr(startup, "bitnet_ping_async", bitnet_ping)
+    monkeypatch.setattr(startup, "BITNET_PING_INTERVAL", 0)
+    readiness = startup.Readiness()
+    monkeypatch.setattr(api, "readiness", readiness)
+
+    client = TestClient(api.app)
+    r = client.get("/ready")
+    assert r.status_code == 503 and r.json()["checks"]["detector"] == "pending"
+    assert client.get("/health").status_code == 200
+
+    asyncio.run(readiness.warm_up())
+    r = client.get("/ready")
+    assert r.status_code == 200
+    body = r.json()
+    assert body["checks"] == {"detector": "ok", "firebase": "ok", "bitnet": "ok"}
+    assert body["timings"]["detector_load"] == 0.5 and "total" in body["timings"]
+
+
+def test_ready_stays_red_when_detector_fails(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from deepsymbol import startup
+
+    def broken_warm_up():
+        raise RuntimeError("yolo11n.pt not found")
+
+    async def bitnet_down():
+        return False
+
+    monkeypatch.setattr(startup.vision, "warm_up", broken_warm_up)
+    monkeypatch.setattr(startup, "get_fb_auth", lambda: None)
+    monkeypatch.setattr(startup, "bitnet_ping_async", bitnet_down)
+    readiness = startup.Readiness(bitnet_wait_seconds=0)
+
+    asyncio.run(readiness.warm_up())
+    assert not readiness.ready
+    assert readiness.checks["detector"].startswith("error")
+    # an unreachable BitNet alone would not block readiness
+    assert readiness.checks["bitnet"] == "unreachable"
+
+
+def test_failover_answer_is_served_but_not_cached(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from deepsymbol import api, cache, llm, llm_backends, llm_bitnet
+
+    async def bitnet_down(prompt):
+        raise RuntimeError("connection refused")
+
+    async def local(prompt):
+        return "A local answer."
+
+    monkeypatch.setattr(llm_bitnet, "bitnet_chat_completion_async", bitnet_down)
+    monkeypatch.setattr(llm, "local_chat_completion_async", local)
+    monkeypatch.setattr(llm_backends, "LLM_FAILOVER", "local")
+    cache.interpretation_cache.clear()
+
+    key = api.interpretation_key(["owl"])
+    assert asyncio.run(api._generate(key, "Detected objects: owl.")) == "A local answer."
+    # the key belongs to the primary backend; BitNet should answer it once it is back
+    assert cache.interpretation_cache.get(key) is None
+
+
+def test_jobs_reject_internal_callback_urls(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api, webhooks
+
+    published = []
+    monkeypatch.setattr(webhooks, "WEBHOOK_SECRET", "s3cret")
+    monkeypatch.setattr(api, "create_job", lambda job_id, doc: None)
+    monkeypatch.setattr(api, "publish_stage_task", lambda *a, **kw: published.append(a))
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    client = TestClient(api.app)
+    r = client.post(
+        "/jobs",
+        files={"file": ("a.jpg", b"jpeg bytes", "image/jpeg")},
+        data={"callback_url": "http://169.254.169.254/latest/meta-data/"},
+    )
+    assert r.status_code == 400 and "non-public" in r.json()["detail"]
+    assert published == []
+
+
+def test_jobs_publish_backpressure_does_not_block_the_event_loop(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from concurrent.futures import Future
+
+    from deepsymbol import api
+
+    def full_queue_publish(queue_name, message, message_id=None, priority=0):
+        time.sleep(0.5)  # publish() waiting for room in a full publish queue
+        fut = Future()
+        fut.set_result(None)
+        return fut
+
+    monkeypatch.setattr(api, "create_job", lambda job_id, doc: None)
+    monkeypatch.setattr(api, "publish_stage_task", full_queue_publish)
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            submit = asyncio.create_task(
+                client.post("/jobs", files={"file": ("a.jpg", b"jpeg bytes", "image/jpeg")})
+            )
+            # measured from before the pause: a blocked loop delays the wake-up too
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.1)
+            assert (await client.get("/health")).status_code == 200
+            health = time.perf_counter() - t0
+            return health, await submit
+
+    health, response = asyncio.run(run())
+    assert response.status_code == 202
+    assert health < 0.3
+
+
+def test_jobs_publish_failure_is_503_even_if_the_job_update_fails(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from fastapi.testclient import TestClient
+
+    from deepsymbol import api
+
+    def broker_down(*a, **kw):
+        raise RuntimeError("Postprocess publish queue is full")
+
+    def firestore_down(job_id, patch):
+        raise RuntimeError("Firestore unavailable")
+
+    monkeypatch.setattr(api, "create_job", lambda job_id, doc: None)
+    monkeypatch.setattr(api, "publish_stage_task", broker_down)
+    monkeypatch.setattr(api, "update_job", firestore_down)
+    monkeypatch.setitem(api.app.dependency_overrides, api.require_firebase_user, lambda: {"uid": "u1"})
+
+    r = TestClient(api.app).post("/jobs", files={"file": ("a.jpg", b"jpeg bytes", "image/jpeg")})
+    assert r.status_code == 503 and "Job queue unavailable" in r.json()["detail"]
+
+
+def test_detection_cache_is_keyed_by_detector_settings_and_hides_old_timings(monkeypatch):
+    firebase_admin._apps = ["already-initialized"]
+
+    from deepsymbol import api, vision
+
+    runs = []
+
+    async def fake_detect(data):
+        runs.append(data)
+        return {"objects": ["owl"], "num_objects": 1, "timings": {"inference_ms": 12.0}}
+
+    monkeypatch.setattr(api, "detect_objects_async", fake_detect)
+    data = b"detector settings test " + os.urandom(8)
+
+    first = asyncio.run(api._detect_cached(data))
+    hit = asyncio.run(api._detect_cached(data))
+    assert first["timings"] == {"inference_ms": 12.0} and "cached" not in first
+    assert hit == {"objects": ["owl"], "num_objects": 1, "cached": True}
+
+    monkeypatch.setattr(vision, "CONF", 0.6)
+    assert "cached" not in asyncio.run(api._detect_cached(data))
+    assert len(runs) == 2  # the new threshold missed the cache
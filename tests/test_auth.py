@@ -1,5 +1,6 @@
 import pytest
 import firebase_admin
+from firebase_admin import auth as fb_auth
 
 from fastapi import HTTPException
 from fastapi.security import HTTPAuthorizationCredentials
@@ -26,7 +27,7 @@ def test_require_firebase_user_valid_token(monkeypatch):
         assert token == "goodtoken"
         return {"uid": "u123", "email": "test@example.com"}
 
-    monkeypatch.setattr(auth_module.fb_auth, "verify_id_token", fake_verify)
+    monkeypatch.setattr(fb_auth, "verify_id_token", fake_verify)
 
     creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="goodtoken")
     decoded = auth_module.require_firebase_user(creds=creds)
@@ -41,10 +42,117 @@ def test_require_firebase_user_invalid_token(monkeypatch):
     def fake_verify(token):
         raise Exception("bad token")
 
-    monkeypatch.setattr(auth_module.fb_auth, "verify_id_token", fake_verify)
+    monkeypatch.setattr(fb_auth, "verify_id_token", fake_verify)
 
     creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="badtoken")
     with pytest.raises(HTTPException) as e:
         auth_module.require_firebase_user(creds=creds)
 
     assert e.value.status_code == 401
+
+
+def _local_signing_key(key_id="local-key"):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from google.auth import crypt
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return crypt.RSASigner.from_string(private_pem, key_id=key_id), {key_id: public_pem}
+
+
+def _mint(signer, uid, ttl):
+    import time
+
+    from google.auth import jwt
+
+    now = int(time.time())
+    claims = {
+        "iss": "https://securetoken.google.com/demo-project",
+        "aud": "demo-project",
+        "sub": uid,
+        "iat": now,
+        "exp": now + ttl,
+    }
+    return jwt.encode(signer, claims).decode("utf-8")
+
+
+def test_verified_token_is_cached_until_exp(monkeypatch):
+    import time
+
+    from google.auth import jwt
+
+    firebase_admin._apps = ["already-initialized"]
+
+    from deepsymbol import auth as auth_module
+
+    signer, certs = _local_signing_key()
+    calls = []
+
+    def verify_with_local_key(token):
+        calls.append(token)
+        claims = jwt.decode(token, certs=certs, audience="demo-project")
+        claims["uid"] = claims["sub"]
+        return claims
+
+    monkeypatch.setattr(fb_auth, "verify_id_token", verify_with_local_key)
+
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=_mint(signer, "u42", ttl=1))
+    assert auth_module.require_firebase_user(creds=creds)["uid"] == "u42"
+    assert auth_module.require_firebase_user(creds=creds)["uid"] == "u42"
+    assert len(calls) == 1
+
+    # once exp has passed the cached entry is gone and the token is verified again
+    time.sleep(1.2)
+    try:
+        auth_module.require_firebase_user(creds=creds)
+    except HTTPException as e:
+        assert e.status_code == 401
+    assert len(calls) == 2
+
+
+def test_token_signed_by_unknown_key_is_rejected(monkeypatch):
+    from google.auth import jwt
+
+    firebase_admin._apps = ["already-initialized"]
+
+    from deepsymbol import auth as auth_module
+
+    _, trusted = _local_signing_key()
+    rogue_signer, _ = _local_signing_key()
+
+    monkeypatch.setattr(
+        fb_auth,
+        "verify_id_token",
+        lambda token: jwt.decode(token, certs=trusted, audience="demo-project"),
+    )
+
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=_mint(rogue_signer, "evil", ttl=60))
+    with pytest.raises(HTTPException) as e:
+        auth_module.require_firebase_user(creds=creds)
+    assert e.value.status_code == 401
+
+
+def test_cert_refresh_uses_the_verifier_session_and_stops_if_it_is_gone(monkeypatch, capsys):
+    from types import SimpleNamespace
+
+    from deepsymbol import auth as auth_module
+
+    fetched = []
+    verifier = SimpleNamespace(request=lambda url, **kw: fetched.append((url, kw["headers"])))
+    client = SimpleNamespace(_token_verifier=verifier)
+    monkeypatch.setattr(auth_module, "get_fb_auth", lambda: SimpleNamespace(_get_client=lambda app: client))
+
+    assert auth_module.refresh_signing_certs() is True
+    assert fetched[0][0].startswith("https://www.googleapis.com/") and fetched[0][1] == {"Cache-Control": "no-cache"}
+
+    # a firebase_admin release without these internals: logged once, then the loop ends
+    monkeypatch.setattr(auth_module, "get_fb_auth", lambda: SimpleNamespace())
+    auth_module._cert_refresh_stop.clear()
+    auth_module._cert_refresh_loop()
+    assert capsys.readouterr().out.count("CERT REFRESH DISABLED") == 1
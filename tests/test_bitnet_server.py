@@ -0,0 +1,207 @@
+import importlib.util
+import json
+import os
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+from deepsymbol.llm_bitnet import chat_messages
+from deepsymbol.prompts import build_prompt_from_objects
+
+# bitnet/server.py ships in its own container, outside the deepsymbol package
+_spec = importlib.util.spec_from_file_location(
+    "bitnet_server", os.path.join(os.path.dirname(__file__), "..", "bitnet", "server.py")
+)
+server = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(server)
+
+
+class FakeLlamaResponse:
+    """What urlopen returns for llama-server's /completion: a JSON body, or SSE lines."""
+
+    def __init__(self, body=None, lines=()):
+        self.body = body
+        self.lines = lines
+        self.status = 200
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self):
+        return json.dumps(self.body).encode()
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+def _fake_llama(monkeypatch, response):
+    requests = []
+
+    def urlopen(req, timeout=None):
+        requests.append(json.loads(req.data))
+        return response
+
+    monkeypatch.setattr(server.urllib.request, "urlopen", urlopen)
+    return requests
+
+
+def _ready_pool(monkeypatch, size=1):
+    pool = server.WorkerPool(size)
+    for w in pool.workers:
+        w.ready = True
+        pool._idle.put(w)
+    monkeypatch.setattr(server, "pool", pool)
+    return pool
+
+
+LLAMA_RESULT = {
+    "content": " An owl suggests wisdom. ",
+    "tokens_evaluated": 120,
+    "tokens_predicted": 7,
+    "timings": {"prompt_n": 9, "prompt_ms": 36.0, "prompt_per_token_ms": 4.0},
+}
+
+
+def test_render_prompt_keeps_system_message_in_bitnet_chat_format():
+    prompt = server.render_prompt(chat_messages("Detected objects: owl."))
+
+    assert prompt.startswith("System: You are an AI oracle")
+    assert prompt.endswith("<|eot_id|>User: Detected objects: owl.<|eot_id|>Assistant: ")
+    assert server.render_prompt([]) == "User: Hello<|eot_id|>Assistant: "
+
+
+def test_prompts_for_different_objects_share_everything_but_the_objects_line():
+    a = server.render_prompt(chat_messages(build_prompt_from_objects(["owl"])))
+    b = server.render_prompt(chat_messages(build_prompt_from_objects(["cat", "mirror"])))
+
+    shared = os.path.commonprefix([a, b])
+    assert shared.endswith("Just the interpretation.\nDetected objects: ")
+    assert "System: You are an AI oracle" in shared
+    assert a[len(shared):] == "owl.<|eot_id|>Assistant: "
+
+
+def test_prompt_stats_counts_cached_tokens_and_saved_time():
+    assert server.prompt_stats(LLAMA_RESULT) == {
+        "prompt_tokens": 120,
+        "cached_tokens": 111,
+        "prompt_ms": 36.0,
+        "prompt_eval_saved_ms": 444.0,
+    }
+    # no timings (older llama-server): nothing is claimed as cached
+    assert server.prompt_stats({"tokens_evaluated": 12})["cached_tokens"] == 0
+
+
+def test_chat_sends_full_prompt_with_cache_and_reports_usage(monkeypatch):
+    pool = _ready_pool(monkeypatch)
+    requests = _fake_llama(monkeypatch, FakeLlamaResponse(body=LLAMA_RESULT))
+
+    r = TestClient(server.app).post("/v1/chat/completions", json={"messages": chat_messages("Detected objects: owl.")})
+
+    body = r.json()
+    assert body["choices"][0]["message"]["content"] == "An owl suggests wisdom."
+    assert body["usage"]["prompt_tokens_details"] == {"cached_tokens": 111}
+    assert body["usage"]["prompt_eval_saved_ms"] == 444.0
+    assert requests[0]["cache_prompt"] is True
+    assert requests[0]["prompt"].startswith("System: ")
+    worker = pool.workers[0]
+    assert not worker.busy and worker.prompt_tokens_cached == 111
+
+
+def test_stream_is_openai_sse_with_usage_and_done_terminator(monkeypatch):
+    pool = _ready_pool(monkeypatch)
+    lines = [
+        b'data: {"content": "An owl", "stop": false}\n',
+        b"\n",
+        b'data: {"content": " means wisdom.", "stop": false}\n',
+        b'data: ' + json.dumps({**LLAMA_RESULT, "content": "", "stop": True}).encode() + b"\n",
+    ]
+    requests = _fake_llama(monkeypatch, FakeLlamaResponse(lines=lines))
+
+    r = TestClient(server.app).post(
+        "/v1/chat/completions", json={"messages": chat_messages("Detected objects: owl."), "stream": True}
+    )
+
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = [e[len("data: "):] for e in r.text.split("\n\n") if e]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(e) for e in events[:-1]]
+    assert all(c["object"] == "chat.completion.chunk" for c in chunks)
+    assert [c["choices"][0]["delta"] for c in chunks] == [
+        {"role": "assistant"},
+        {"content": "An owl"},
+        {"content": " means wisdom."},
+        {},
+    ]
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert chunks[-1]["usage"]["completion_tokens"] == 7
+    assert requests[0]["stream"] is True
+    assert not pool.workers[0].busy and pool._idle.qsize() == 1
+
+
+def test_busy_pool_answers_503_for_plain_and_streaming_requests(monkeypatch):
+    monkeypatch.setattr(server, "pool", server.WorkerPool(1))  # no worker ever becomes ready
+    monkeypatch.setattr(server, "ACQUIRE_TIMEOUT", 0.05)
+    monkeypatch.setattr(server.time, "sleep", lambda s: None)
+    client = TestClient(server.app)
+
+    for stream in (False, True):
+        r = client.post("/v1/chat/completions", json={"messages": chat_messages("x"), "stream": stream})
+        assert r.status_code == 503
+        assert r.json()["error"]["type"] == "bitnet_pool_busy"
+
+
+def test_acquire_skips_unready_workers_and_release_returns_them(monkeypatch):
+    monkeypatch.setattr(server.time, "sleep", lambda s: None)
+    pool = server.WorkerPool(2)
+    loading, ready = pool.workers
+    ready.ready = True
+    pool._idle.put(loading)
+    pool._idle.put(ready)
+
+    w = pool.acquire(timeout=1)
+    assert w is ready and w.busy
+    # only the loading worker is idle now: acquiring times out
+    assert pool.acquire(timeout=0.05) is None
+
+    pool.release(w)
+    assert not w.busy
+    assert ready in list(pool._idle.queue)
+
+
+def test_dead_worker_is_restarted_with_exponential_backoff(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    worker = server.BitNetWorker(0, 8090)
+    starts = []
+
+    def start():
+        starts.append(now[0])
+        worker.proc = SimpleNamespace(poll=lambda: 1, returncode=1, pid=42)  # dies straight away
+
+    monkeypatch.setattr(worker, "start", start)
+    worker.proc = SimpleNamespace(poll=lambda: -9, returncode=-9, pid=41)
+    worker.ready = True
+
+    worker.check()
+    assert starts == [100.0] and not worker.ready and worker.last_error == "exited with code -9"
+
+    for t in (100.5, 101.0, 102.0, 102.5, 103.0):
+        now[0] = t
+        worker.check()
+    # restarted after 1s, then held back for 2s
+    assert starts == [100.0, 101.0, 103.0]
+    assert worker.restarts == 3
+
+
+def test_health_reports_per_worker_prompt_cache_totals(monkeypatch):
+    pool = _ready_pool(monkeypatch, size=2)
+    pool.workers[0].record_prompt(server.prompt_stats(LLAMA_RESULT))
+
+    body = TestClient(server.app).get("/health").json()
+
+    assert body["status"] == "ok" and body["ready_workers"] == 2
+    assert body["workers"][0]["prompt_tokens_cached"] == 111
+    assert body["workers"][0]["prompt_eval_saved_ms"] == 444.0
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from prometheus_client import REGISTRY
+
+from deepsymbol.cache import ResultCache, SingleFlight, content_key, json_key
+
+
+def _hits(name, tier):
+    return REGISTRY.get_sample_value("deepsymbol_cache_hits_total", {"cache": name, "tier": tier}) or 0.0
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResultCache("t_lru", max_size=2, ttl_seconds=60, db_path="")
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recent
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl():
+    cache = ResultCache("t_ttl", max_size=10, ttl_seconds=0.05, db_path="")
+    cache.set("k", {"objects": ["dog"]})
+    assert cache.get("k") == {"objects": ["dog"]}
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    first = ResultCache("t_sqlite", max_size=10, ttl_seconds=60, db_path=db_path)
+    first.set("k", "A dog symbolises loyalty.")
+
+    before = _hits("t_sqlite", "sqlite")
+    second = ResultCache("t_sqlite", max_size=10, ttl_seconds=60, db_path=db_path)
+    assert second.get("k") == "A dog symbolises loyalty."
+    assert _hits("t_sqlite", "sqlite") == before + 1
+    # promoted into memory on the way out
+    assert second.get("k") == "A dog symbolises loyalty."
+    assert _hits("t_sqlite", "memory") >= 1
+
+
+def test_keys_are_stable():
+    assert content_key(b"abc") == content_key(b"abc")
+    assert content_key(b"abc") != content_key(b"abd")
+    assert json_key({"a": 1, "b": 2}) == json_key({"b": 2, "a": 1})
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def generate(n):
+        calls.append(n)
+        await asyncio.sleep(0.05)
+        return f"result {n}"
+
+    async def run():
+        same = [flight.do("k", lambda i=i: generate(i)) for i in range(5)]
+        other = flight.do("other", lambda: generate("x"))
+        return await asyncio.gather(*same, other)
+
+    results = asyncio.run(run())
+    assert calls == [0, "x"]  # one upstream call per key
+    assert results == ["result 0"] * 5 + ["result x"]
+    assert len(flight) == 0  # nothing retained once finished
+
+
+def test_single_flight_shares_errors_and_survives_leader_cancel():
+    flight = SingleFlight("test")
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def run():
+        results = await asyncio.gather(flight.do("e", boom), flight.do("e", boom), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+        leader = asyncio.create_task(flight.do("s", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("s", slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == "ok"
+
+    asyncio.run(run())
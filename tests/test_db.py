@@ -0,0 +1,121 @@
+import threading
+
+from deepsymbol import db
+
+
+def test_wal_and_batched_insert(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+
+    conn = db._connect()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db._connect() is conn  # reused, not reopened per call
+
+    ids = db.save_interpretations([(["dog"], "Loyalty."), (["cat", "tree"], "Independence.")])
+    single = db.save_interpretation(["moon"], "Intuition.")
+    assert ids == [ids[0], ids[0] + 1]
+    assert single == ids[1] + 1
+
+    history = db.get_history(limit=2)
+    assert [h["objects"] for h in history] == [["moon"], ["cat", "tree"]]
+    db.close_db()
+
+
+def test_concurrent_writers_use_their_own_connections(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+
+    errors = []
+
+    def writer(n):
+        try:
+            for i in range(25):
+                db.save_interpretation([f"obj{n}"], f"text {i}")
+            db.close_db()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert len(db.get_history(limit=1000)) == 100
+    db.close_db()
+
+
+def test_history_keyset_pagination_filter_and_projection(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+    db.save_interpretations([(["dog"] if i % 2 else ["cat"], f"text {i}") for i in range(10)])
+
+    first = db.get_history_page(limit=4)
+    second = db.get_history_page(limit=4, cursor=first["next_cursor"])
+    last = db.get_history_page(limit=4, cursor=second["next_cursor"])
+    ids = [r["id"] for page in (first, second, last) for r in page["items"]]
+    assert ids == list(range(10, 0, -1))
+    assert last["next_cursor"] is None
+
+    dogs = db.get_history_page(limit=3, object_name="Dog", fields=["objects"])
+    assert [r["objects"] for r in dogs["items"]] == [["dog"]] * 3
+    assert set(dogs["items"][0]) == {"id", "objects"}
+
+    plan = " ".join(
+        row[-1]
+        for row in db._connect().execute(
+            "EXPLAIN QUERY PLAN SELECT interpretation_id FROM interpretation_objects "
+            "WHERE object = ? AND interpretation_id < ? ORDER BY interpretation_id DESC",
+            ("dog", 5),
+        )
+    )
+    assert "PRIMARY KEY" in plan and "TEMP B-TREE" not in plan
+    db.close_db()
+
+
+def test_migration_backfills_object_index(tmp_path, monkeypatch):
+    import sqlite3
+
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.execute(
+        "CREATE TABLE interpretations (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL, "
+        "objects_json TEXT NOT NULL, interpretation TEXT NOT NULL)"
+    )
+    old.execute(
+        "INSERT INTO interpretations (created_at, objects_json, interpretation) VALUES ('t', '[\"Person\", \"dog\"]', 'x')"
+    )
+    old.commit()
+    old.close()
+
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", path)
+    db.init_db()
+    assert [r["id"] for r in db.get_history_page(object_name="person")["items"]] == [1]
+    db.close_db()
+
+
+def test_bulk_save_with_outbox_is_one_transaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+
+    ids = db.save_interpretations_with_outbox(
+        [(["dog"], "Loyalty."), (["owl"], "Wisdom."), (["dog"], "Loyalty.")], "2024-01-01T00:00:00Z"
+    )
+
+    assert ids == [ids[0], ids[0] + 1, ids[0] + 2]
+    assert db.outbox_depth() == 3
+    assert [r["record_id"] for r in db.claim_outbox(10, 60)] == ids
+    db.close_db()
+
+
+def test_history_timestamps_share_one_format_across_write_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+    db.save_interpretation(["dog"], "Loyalty.")
+    db.save_interpretation_with_outbox(["owl"], "Wisdom.", db.utc_now_iso())
+
+    stamps = [h["created_at"] for h in db.get_history(limit=2)]
+    assert all(s.endswith("+00:00") and "T" in s for s in stamps)
+    assert stamps[0] >= stamps[1]  # newest first, comparable as strings
+    db.close_db()
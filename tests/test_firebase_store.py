@@ -0,0 +1,195 @@
+import os
+import uuid
+
+import pytest
+from google.api_core import exceptions as gexc
+
+from deepsymbol import firebase_store
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, fields=None):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+        self._fields = fields
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        if self._fields:
+            return {k: v for k, v in self._data.items() if k in self._fields}
+        return dict(self._data)
+
+
+class FakeDocRef:
+    def __init__(self, store, doc_id):
+        self.store = store
+        self.id = doc_id
+
+    def get(self, transaction=None):
+        self.store.reads += 1
+        return FakeSnapshot(self.id, self.store.docs.get(self.id))
+
+    def set(self, payload):
+        self.store.docs[self.id] = dict(payload)
+
+    def update(self, patch):
+        if self.id not in self.store.docs:
+            raise gexc.NotFound("No document to update")
+        self.store.docs[self.id].update(patch)
+
+    def delete(self, option=None):
+        if option == "exists" and self.id not in self.store.docs:
+            raise gexc.NotFound("No document to delete")
+        self.store.docs.pop(self.id, None)
+
+
+class FakeQuery:
+    def __init__(self, store, fields=None, limit=None):
+        self.store, self.fields, self._limit = store, fields, limit
+
+    def select(self, fields):
+        return FakeQuery(self.store, fields, self._limit)
+
+    def limit(self, n):
+        return FakeQuery(self.store, self.fields, n)
+
+    def stream(self):
+        for doc_id in list(self.store.docs)[: self._limit]:
+            yield FakeSnapshot(doc_id, self.store.docs[doc_id], self.fields)
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id):
+        return FakeDocRef(self.store, doc_id)
+
+
+class FakeBatch:
+    def __init__(self, store):
+        self.store, self.ops = store, []
+
+    def set(self, ref, payload):
+        self.ops.append(lambda: ref.set(payload))
+
+    def update(self, ref, patch):
+        self.ops.append(lambda: ref.update(patch))
+
+    def commit(self):
+        self.store.commits += 1
+        for op in self.ops:
+            op()
+
+
+class FakeTransaction:
+    def __init__(self):
+        self.writes = []
+
+    def update(self, ref, patch):
+        self.writes.append((ref, patch))
+
+
+class FakeFirestore:
+    """In-memory stand-in for the subset of the Firestore client used by firebase_store."""
+
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+        self.commits = 0
+
+    def collection(self, name):
+        return FakeCollection(self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self):
+        return FakeTransaction()
+
+    def write_option(self, exists):
+        return "exists" if exists else None
+
+
+def _fake_transaction(db, fn):
+    tx = db.transaction()
+    result = fn(tx)
+    for ref, patch in tx.writes:
+        ref.update(patch)
+    return result
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(firebase_store, "_db", db)
+    monkeypatch.setattr(firebase_store, "_run_in_transaction", _fake_transaction)
+    firebase_store._doc_cache.clear()
+    yield db
+    firebase_store._doc_cache.clear()
+
+
+def test_batched_saves_and_read_through_cache(fake_db):
+    firebase_store.save_outputs_batch({str(i): {"objects": ["dog"], "interpretation": f"t{i}"} for i in range(3)})
+    assert fake_db.commits == 1
+
+    assert firebase_store.get_output("1")["interpretation"] == "t1"
+    assert firebase_store.get_output("1")["interpretation"] == "t1"
+    assert fake_db.reads == 1  # second read served from cache
+
+    # callers may mutate what they get back without poisoning the cache
+    firebase_store.get_output("1")["id"] = "1"
+    assert "id" not in firebase_store.get_output("1")
+
+
+def test_update_and_get_invalidates_cache(fake_db):
+    firebase_store.save_output("7", {"interpretation": "old"})
+    assert firebase_store.get_output("7") == {"interpretation": "old"}
+
+    updated = firebase_store.update_output_and_get("7", {"interpretation": "new"})
+    assert updated == {"interpretation": "new"}
+    assert firebase_store.get_output("7") == {"interpretation": "new"}
+    assert firebase_store.update_output_and_get("missing", {"x": 1}) is None
+
+
+def test_delete_if_exists_and_field_mask(fake_db):
+    firebase_store.save_output("1", {"objects": ["cat"], "interpretation": "long text"})
+    assert firebase_store.list_outputs(limit=10, fields=["objects"]) == [{"objects": ["cat"], "id": "1"}]
+
+    assert firebase_store.delete_output_if_exists("1") is True
+    assert firebase_store.delete_output_if_exists("1") is False
+    assert firebase_store.get_output("1") is None
+
+
+@pytest.mark.skipif(not os.getenv("FIRESTORE_EMULATOR_HOST"), reason="Firestore emulator not running")
+def test_round_trip_against_emulator(monkeypatch):
+    monkeypatch.setattr(firebase_store, "_db", None)
+    monkeypatch.setattr(firebase_store, "COLLECTION", f"test-outputs-{uuid.uuid4().hex[:8]}")
+    firebase_store._doc_cache.clear()
+
+    firebase_store.save_outputs_batch({"a": {"interpretation": "x"}, "b": {"interpretation": "y"}})
+    assert firebase_store.update_output_and_get("a", {"interpretation": "z"}) == {"interpretation": "z"}
+    assert firebase_store.update_output_and_get("nope", {"interpretation": "z"}) is None
+    assert {r["id"] for r in firebase_store.list_outputs(fields=["interpretation"])} == {"a", "b"}
+    assert firebase_store.delete_output_if_exists("b") is True
+    assert firebase_store.delete_output_if_exists("b") is False
+
+
+def test_update_and_get_applies_dotted_keys_as_field_paths(fake_db):
+    firebase_store.save_output("7", {"meta": {"mood": "calm", "score": 1}, "interpretation": "old"})
+
+    updated = firebase_store.update_output_and_get("7", {"meta.mood": "tense", "`a.b`": 2, "tags.first": "owl"})
+
+    assert updated == {
+        "meta": {"mood": "tense", "score": 1},
+        "interpretation": "old",
+        "a.b": 2,
+        "tags": {"first": "owl"},
+    }
+
+
+@pytest.mark.parametrize("key", ["__name__", "meta.__x__", "a..b", ""])
+def test_update_and_get_rejects_invalid_field_paths(fake_db, key):
+    firebase_store.save_output("7", {"interpretation": "old"})
+    with pytest.raises(ValueError):
+        firebase_store.update_output_and_get("7", {key: 1})
+    assert firebase_store.get_output("7") == {"interpretation": "old"}
@@ -0,0 +1,132 @@
+import base64
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from deepsymbol.inference_worker import PIPELINE, StageConsumer
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acks = []
+        self.nacks = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.nacks.append((delivery_tag, requeue))
+
+
+class FakeConnection:
+    def add_callback_threadsafe(self, cb):
+        cb()
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def _done() -> Future:
+    fut: Future = Future()
+    fut.set_result(None)
+    return fut
+
+
+def _deliver(consumer, tag, msg, redelivered=False, priority=None):
+    consumer.on_message(
+        SimpleNamespace(delivery_tag=tag, redelivered=redelivered),
+        SimpleNamespace(priority=priority),
+        json.dumps(msg).encode(),
+    )
+
+
+def test_detect_stage_hands_off_to_llm_stage_with_priority():
+    channel = FakeChannel()
+    published = []
+
+    def publish(queue_name, payload, message_id=None, priority=0):
+        published.append((queue_name, payload, message_id, priority))
+        return _done()
+
+    consumer = StageConsumer(
+        "detect",
+        FakeConnection(),
+        channel,
+        InlineExecutor(),
+        task=lambda msg: {"objects": ["owl"]},
+        next_stage="llm",
+        publish=publish,
+        store=lambda job_id, patch: None,
+    )
+    image = base64.b64encode(b"jpeg bytes").decode()
+    _deliver(consumer, 1, {"job_id": "j1", "image_b64": image, "callback_url": "https://x.test/h"}, priority=7)
+
+    [(queue_name, payload, message_id, priority)] = published
+    assert queue_name == PIPELINE["llm"][0]
+    assert payload == {"job_id": "j1", "callback_url": "https://x.test/h", "objects": ["owl"]}  # image dropped
+    assert (message_id, priority) == ("j1-llm", 7)
+    assert channel.acks == [1]
+
+
+def test_last_stage_stores_result_and_posts_callback():
+    channel = FakeChannel()
+    stored = []
+    callbacks = []
+    consumer = StageConsumer(
+        "llm",
+        FakeConnection(),
+        channel,
+        InlineExecutor(),
+        task=lambda msg: {"interpretation": "Wisdom."},
+        store=lambda job_id, patch: stored.append(patch["status"]),
+        notify=lambda url, body: callbacks.append((url, body["status"], body["result"])),
+    )
+
+    _deliver(consumer, 1, {"job_id": "j1", "objects": ["owl"], "callback_url": "https://x.test/h"})
+
+    assert stored == ["running", "done"]
+    assert callbacks == [("https://x.test/h", "done", {"objects": ["owl"], "interpretation": "Wisdom."})]
+    assert channel.acks == [1]
+    assert consumer.pending() == 0
+
+
+def test_failed_task_is_retried_once_then_fails_the_job():
+    channel = FakeChannel()
+    stored = []
+
+    def broken(msg):
+        raise RuntimeError("BitNet down")
+
+    consumer = StageConsumer(
+        "llm",
+        FakeConnection(),
+        channel,
+        InlineExecutor(),
+        task=broken,
+        store=lambda job_id, patch: stored.append(patch.get("status")),
+        notify=lambda url, body: None,
+    )
+
+    _deliver(consumer, 1, {"job_id": "j1", "objects": []})
+    assert channel.nacks == [(1, True)] and "failed" not in stored
+
+    _deliver(consumer, 2, {"job_id": "j1", "objects": []}, redelivered=True)
+    assert channel.acks == [2] and stored[-1] == "failed"
+
+    consumer.on_message(SimpleNamespace(delivery_tag=3, redelivered=False), None, b"garbage")
+    assert channel.nacks[-1] == (3, False)
+
+
+def test_webhook_to_internal_address_is_refused_without_a_request(monkeypatch):
+    from deepsymbol import inference_worker, webhooks
+
+    posts = []
+    monkeypatch.setattr(webhooks, "WEBHOOK_SECRET", "s3cret")
+    monkeypatch.setattr(inference_worker.httpx, "post", lambda *a, **kw: posts.append(a))
+
+    error = inference_worker.post_webhook("http://127.0.0.1:15672/api/queues", {"job_id": "j1"})
+
+    assert "non-public" in error
+    assert posts == []
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from deepsymbol import llm, llm_backends, llm_bitnet
+
+
+def _failovers():
+    return REGISTRY.get_sample_value(
+        "deepsymbol_llm_failovers_total", {"from_backend": "bitnet", "to_backend": "local"}
+    ) or 0.0
+
+
+def _bitnet_down(monkeypatch):
+    async def down(prompt):
+        raise RuntimeError("connection refused")
+
+    async def down_stream(prompt):
+        raise RuntimeError("connection refused")
+        yield  # pragma: no cover
+
+    async def local(prompt):
+        return "A local answer."
+
+    monkeypatch.setattr(llm_bitnet, "bitnet_chat_completion_async", down)
+    monkeypatch.setattr(llm_bitnet, "bitnet_chat_completion_stream", down_stream)
+    monkeypatch.setattr(llm, "local_chat_completion_async", local)
+
+
+def test_fails_over_to_local_backend(monkeypatch):
+    _bitnet_down(monkeypatch)
+    monkeypatch.setattr(llm_backends, "LLM_FAILOVER", "local")
+    before = _failovers()
+
+    assert asyncio.run(llm_backends.complete_async("x")) == ("A local answer.", "local")
+
+    async def collect():
+        return [item async for item in llm_backends.complete_stream("x")]
+
+    # local has no streaming: its whole answer arrives as one delta
+    assert asyncio.run(collect()) == [("A local answer.", "local")]
+    assert _failovers() == before + 2
+
+
+def test_without_failover_the_error_surfaces(monkeypatch):
+    _bitnet_down(monkeypatch)
+    monkeypatch.setattr(llm_backends, "LLM_FAILOVER", "")
+
+    with pytest.raises(RuntimeError, match="connection refused"):
+        asyncio.run(llm_backends.complete_async("x"))
+
+
+def test_stream_does_not_fail_over_after_first_delta(monkeypatch):
+    async def flaky_stream(prompt):
+        yield "A dog "
+        raise RuntimeError("worker crashed")
+
+    monkeypatch.setattr(llm_bitnet, "bitnet_chat_completion_stream", flaky_stream)
+    monkeypatch.setattr(llm_backends, "LLM_FAILOVER", "local")
+    seen = []
+
+    async def collect():
+        async for item in llm_backends.complete_stream("x"):
+            seen.append(item)
+
+    with pytest.raises(RuntimeError, match="worker crashed"):
+        asyncio.run(collect())
+    assert seen == [("A dog ", "bitnet")]
+
+
+def test_unknown_backend_is_rejected(monkeypatch):
+    monkeypatch.setattr(llm_backends, "LLM_BACKEND", "gpt")
+    with pytest.raises(RuntimeError, match="Unknown LLM backend"):
+        llm_backends.llm_fingerprint()
+
+
+def test_generation_batcher_groups_prompts_and_skips_cancelled(monkeypatch):
+    calls = []
+
+    def fake_generate_batch(prompts, max_new_tokens=llm.MAX_TOKENS):
+        calls.append(list(prompts))
+        return [{"text": p.upper(), "tokens": 3} for p in prompts]
+
+    monkeypatch.setattr(llm, "generate_batch", fake_generate_batch)
+    batcher = llm.GenerationBatcher(max_batch_size=4, max_wait_ms=1000)
+
+    futures = [batcher.submit(p) for p in ("a", "b", "c")]
+    futures[1].cancel()  # caller gave up before its batch started
+    futures.append(batcher.submit("d"))  # fills the batch
+
+    assert [futures[i].result(5)["text"] for i in (0, 2, 3)] == ["A", "C", "D"]
+    assert calls == [["a", "c", "d"]]
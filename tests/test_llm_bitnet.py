@@ -21,3 +21,127 @@ def test_clean_llm_text_limits_sentences():
     cleaned = _clean_llm_text(raw, prompt)
     # Should keep at most 4 sentences
     assert cleaned.count(".") <= 4
+
+
+def test_stream_client_yields_deltas_in_order(monkeypatch):
+    import asyncio
+    import json
+
+    import httpx
+
+    from deepsymbol import llm_bitnet
+
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        chunks = [{"role": "assistant"}, {"content": "A dog "}, {"content": "means loyalty."}, {}]
+        body = "".join(
+            f"data: {json.dumps({'choices': [{'index': 0, 'delta': d}]})}\n\n" for d in chunks
+        ) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+    monkeypatch.setattr(llm_bitnet, "_async_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    async def collect():
+        return [d async for d in llm_bitnet.bitnet_chat_completion_stream("Detected objects: dog.")]
+
+    deltas = asyncio.run(collect())
+    assert deltas == ["A dog ", "means loyalty."]
+    assert llm_bitnet.finalize_text("".join(deltas), "x") == "A dog means loyalty."
+
+
+def test_stream_client_raises_on_non_sse_or_truncated_body(monkeypatch):
+    import asyncio
+
+    import httpx
+    import pytest
+
+    from deepsymbol import llm_bitnet
+
+    bodies = iter([
+        httpx.Response(200, json={"error": {"type": "bitnet_pool_busy"}}),
+        httpx.Response(200, text='data: {"choices": []}\n\n', headers={"Content-Type": "text/event-stream"}),
+    ])
+    monkeypatch.setattr(
+        llm_bitnet, "_async_client", httpx.AsyncClient(transport=httpx.MockTransport(lambda request: next(bodies)))
+    )
+
+    async def collect():
+        return [d async for d in llm_bitnet.bitnet_chat_completion_stream("Detected objects: dog.")]
+
+    with pytest.raises(RuntimeError, match="non-SSE"):
+        asyncio.run(collect())
+    with pytest.raises(RuntimeError, match="DONE"):
+        asyncio.run(collect())
+
+
+def test_completion_records_llm_stage_tokens_and_fallback(monkeypatch):
+    import asyncio
+
+    import httpx
+    from prometheus_client import REGISTRY
+
+    from deepsymbol import llm_bitnet
+
+    def sample(name, labels=None):
+        return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+    replies = iter(["A dog means loyalty.", "   "])
+
+    def handler(request):
+        content = next(replies)
+        return httpx.Response(
+            200,
+            json={
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 40, "completion_tokens": 7, "total_tokens": 47},
+            },
+        )
+
+    monkeypatch.setattr(llm_bitnet, "_async_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    calls = sample("deepsymbol_stage_calls_total", {"stage": "llm", "outcome": "ok"})
+    tokens = sample("deepsymbol_llm_output_tokens_sum")
+    fallbacks = sample("deepsymbol_llm_fallback_total")
+
+    assert asyncio.run(llm_bitnet.bitnet_chat_completion_async("x")) == "A dog means loyalty."
+    assert asyncio.run(llm_bitnet.bitnet_chat_completion_async("x")) == llm_bitnet.FALLBACK_TEXT
+
+    assert sample("deepsymbol_stage_calls_total", {"stage": "llm", "outcome": "ok"}) == calls + 2
+    assert sample("deepsymbol_llm_output_tokens_sum") == tokens + 14
+    assert sample("deepsymbol_llm_fallback_total") == fallbacks + 1
+
+
+def test_completion_records_prompt_cache_reuse(monkeypatch):
+    import asyncio
+
+    import httpx
+    from prometheus_client import REGISTRY
+
+    from deepsymbol import llm_bitnet
+
+    def sample(name):
+        return REGISTRY.get_sample_value(name) or 0.0
+
+    def handler(request):
+        return httpx.Response(
+            200,
+            json={
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "An owl means wisdom."}}],
+                "usage": {
+                    "prompt_tokens": 100,
+                    "completion_tokens": 6,
+                    "total_tokens": 106,
+                    "prompt_tokens_details": {"cached_tokens": 90},
+                    "prompt_ms": 40.0,
+                    "prompt_eval_saved_ms": 360.0,
+                },
+            },
+        )
+
+    monkeypatch.setattr(llm_bitnet, "_async_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    ratio = sample("deepsymbol_llm_prompt_cached_ratio_sum")
+    saved = sample("deepsymbol_llm_prompt_eval_saved_seconds_sum")
+
+    assert asyncio.run(llm_bitnet.bitnet_chat_completion_async("x")) == "An owl means wisdom."
+
+    assert abs(sample("deepsymbol_llm_prompt_cached_ratio_sum") - ratio - 0.9) < 1e-9
+    assert abs(sample("deepsymbol_llm_prompt_eval_saved_seconds_sum") - saved - 0.36) < 1e-9
@@ -0,0 +1,151 @@
+from concurrent.futures import Future
+
+from deepsymbol import db
+from deepsymbol.outbox import OutboxDispatcher
+
+
+def _done(value=None) -> Future:
+    fut: Future = Future()
+    fut.set_result(value)
+    return fut
+
+
+def _failed(error: Exception) -> Future:
+    fut: Future = Future()
+    fut.set_exception(error)
+    return fut
+
+
+def test_outbox_delivers_firestore_then_publish(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+
+    ids = [db.save_interpretation_with_outbox([f"obj{i}"], f"text {i}", "2024-01-01T00:00:00Z") for i in range(3)]
+    assert db.outbox_depth() == 3
+    assert [h["id"] for h in db.get_history(limit=3)] == ids[::-1]
+
+    calls = []
+    saved = {}
+
+    def save_batch(items):
+        calls.append("save")
+        saved.update(items)
+
+    def publish(payload, message_id=None):
+        calls.append("publish")
+        assert str(payload["id"]) in saved  # doc exists before the job goes out
+        return _done()
+
+    dispatcher = OutboxDispatcher(batch_size=10, save_batch=save_batch, publish=publish)
+    assert dispatcher.run_once() == 3
+    assert calls == ["save", "publish", "publish", "publish"]  # one Firestore batch
+    assert saved[str(ids[0])] == {"objects": ["obj0"], "interpretation": "text 0", "created_at": "2024-01-01T00:00:00Z"}
+    assert db.outbox_depth() == 0
+    db.close_db()
+
+
+def test_outbox_retries_only_the_failed_stage(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+    db.save_interpretation_with_outbox(["dog"], "Loyalty.", "2024-01-01T00:00:00Z")
+
+    saves = []
+    published = []
+    publish_results = [_failed(RuntimeError("broker down")), _done()]
+
+    def publish(payload, message_id=None):
+        published.append(message_id)
+        return publish_results.pop(0)
+
+    dispatcher = OutboxDispatcher(save_batch=saves.append, publish=publish)
+    assert dispatcher.run_once() == 0
+    assert db.outbox_depth() == 1
+    assert db.claim_outbox(10, 60) == []  # backed off, not due yet
+
+    # make the row due again: Firestore must not be written twice
+    db._connect().execute("UPDATE outbox SET next_attempt_at = 0")
+    db._connect().commit()
+    assert dispatcher.run_once() == 1
+    assert len(saves) == 1
+    assert published == ["outbox-1", "outbox-1"]
+    assert db.outbox_depth() == 0
+    db.close_db()
+
+
+def test_outbox_publish_waits_once_for_the_batch_and_withdraws_unsent(tmp_path, monkeypatch):
+    import time
+
+    from deepsymbol import outbox
+
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    monkeypatch.setattr(outbox, "PUBLISH_DEADLINE", 0.2)
+    db.init_db()
+    for i in range(5):
+        db.save_interpretation_with_outbox([f"obj{i}"], f"text {i}", "2024-01-01T00:00:00Z")
+
+    # the broker is down: the first message is stuck in the publisher, the rest are queued behind it
+    futures = []
+
+    def publish(payload, message_id=None):
+        fut: Future = Future()
+        if not futures:
+            fut.set_running_or_notify_cancel()
+        futures.append(fut)
+        return fut
+
+    dispatcher = OutboxDispatcher(batch_size=10, save_batch=lambda items: None, publish=publish)
+    started = time.perf_counter()
+    assert dispatcher.run_once() == 0
+    assert time.perf_counter() - started < 1.0  # one deadline, not one per message
+
+    assert [f.cancelled() for f in futures] == [False, True, True, True, True]
+    assert db.outbox_depth() == 5
+    assert db.claim_outbox(10, 60) == []  # all deferred
+    db.close_db()
+
+
+def test_outbox_publishes_with_confirms_and_keeps_nacked_rows(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    import pika.exceptions
+
+    from deepsymbol import queue
+
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "h.db"))
+    db.init_db()
+    db.save_interpretation_with_outbox(["dog"], "Loyalty.", "2024-01-01T00:00:00Z")
+
+    class NackingChannel:
+        is_open = True
+        confirming = False
+
+        def queue_declare(self, queue, durable=False, arguments=None):
+            pass
+
+        def confirm_delivery(self):
+            self.confirming = True
+
+        def basic_publish(self, exchange, routing_key, body, properties=None):
+            # without confirms the broker's refusal would never reach the publisher
+            if self.confirming:
+                raise pika.exceptions.NackError([body])
+
+    channel = NackingChannel()
+    connection = SimpleNamespace(is_open=True, channel=lambda: channel, close=lambda: None)
+    built = []
+    real_publisher = queue.PostprocessPublisher
+
+    def publisher(queue_name, confirms):
+        built.append(confirms)
+        return real_publisher(lambda: connection, queue_name=queue_name, confirms=confirms)
+
+    monkeypatch.setattr(queue, "PostprocessPublisher", publisher)
+    monkeypatch.setattr(queue, "_publishers", {})
+
+    dispatcher = OutboxDispatcher(save_batch=lambda items: None)
+    assert dispatcher.run_once() == 0
+
+    assert built == [True]
+    assert db.outbox_depth() == 1  # the nacked row stays for a retry
+    queue.close_publisher()
+    db.close_db()
@@ -0,0 +1,168 @@
+import json
+from types import SimpleNamespace
+
+from google.api_core import exceptions as gexc
+from prometheus_client import REGISTRY
+
+from deepsymbol import postprocess_worker
+from deepsymbol.postprocess_worker import BatchingConsumer, simple_postprocess
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acks = []
+        self.nacks = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.nacks.append((delivery_tag, requeue))
+
+
+class FakeConnection:
+    def add_callback_threadsafe(self, cb):
+        cb()
+
+
+class ManualExecutor:
+    """Collects submitted batches so the test decides the completion order."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+
+def _stage_calls(stage, outcome):
+    return REGISTRY.get_sample_value("deepsymbol_stage_calls_total", {"stage": stage, "outcome": outcome}) or 0.0
+
+
+def _deliver(consumer, tag, record_id):
+    body = json.dumps({"id": record_id, "objects": ["dog"], "interpretation": "Loyalty. Trust."}).encode()
+    consumer.on_message(SimpleNamespace(delivery_tag=tag), SimpleNamespace(timestamp=None), body)
+
+
+def test_simple_postprocess_summary():
+    out = simple_postprocess(["dog"], "A dog symbolises loyalty. It also means trust.")
+    assert out["post_summary"] == "A dog symbolises loyalty."
+    assert out["keywords"] == ["dog"]
+
+
+def test_batches_are_written_together_and_acked_in_order():
+    writes = []
+    channel = FakeChannel()
+    executor = ManualExecutor()
+    consumer = BatchingConsumer(
+        FakeConnection(), channel, executor, batch_size=2, write_batch=lambda p: writes.append(sorted(p))
+    )
+
+    for tag in range(1, 5):
+        _deliver(consumer, tag, tag * 10)
+    assert len(executor.jobs) == 2
+
+    # the second batch finishes first: nothing may be acked yet
+    fn, args = executor.jobs[1]
+    fn(*args)
+    assert channel.acks == []
+
+    fn, args = executor.jobs[0]
+    fn(*args)
+    assert channel.acks == [(2, True), (4, True)]
+    assert writes == [["30", "40"], ["10", "20"]]
+    assert consumer.pending() == 0
+
+
+def test_partial_batch_is_flushed_by_age_under_steady_traffic(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(postprocess_worker.time, "monotonic", lambda: now[0])
+    executor = ManualExecutor()
+    consumer = BatchingConsumer(FakeConnection(), FakeChannel(), executor, batch_size=100, flush_interval=1.0)
+
+    # one message every 0.4s: the consume loop never times out, so tick() never runs
+    for tag in range(1, 5):
+        now[0] = (tag - 1) * 0.4
+        _deliver(consumer, tag, tag)
+
+    assert len(executor.jobs) == 1
+    assert [tag for tag, _ in executor.jobs[0][1][0].items] == [1, 2, 3, 4]
+
+
+def test_failed_docs_are_dropped_individually():
+    channel = FakeChannel()
+    executor = ManualExecutor()
+
+    def failing_batch(patches):
+        raise gexc.NotFound("No document to update")
+
+    def write_one(record_id, patch):
+        if record_id == "2":
+            raise gexc.NotFound("No document to update")
+
+    consumer = BatchingConsumer(
+        FakeConnection(), channel, executor, batch_size=3, write_batch=failing_batch, write_one=write_one
+    )
+    _deliver(consumer, 1, 1)
+    _deliver(consumer, 2, 2)
+    consumer.on_message(SimpleNamespace(delivery_tag=3), None, b"not json")
+    ok, errors = _stage_calls("firestore", "ok"), _stage_calls("firestore", "error")
+
+    fn, args = executor.jobs[0]
+    fn(*args)
+
+    assert channel.acks == [(1, False)]
+    assert sorted(channel.nacks) == [(2, False), (3, False)]
+    # the failed batch write and doc 2 count as Firestore errors, doc 1 as ok
+    assert _stage_calls("firestore", "error") == errors + 2
+    assert _stage_calls("firestore", "ok") == ok + 1
+
+
+def test_transient_firestore_errors_are_requeued(monkeypatch):
+    monkeypatch.setattr(postprocess_worker, "RETRY_BACKOFF", 0)
+    channel = FakeChannel()
+    executor = ManualExecutor()
+    one_by_one = []
+
+    def unavailable(patches):
+        raise gexc.ServiceUnavailable("firestore is down")
+
+    consumer = BatchingConsumer(
+        FakeConnection(),
+        channel,
+        executor,
+        batch_size=2,
+        write_batch=unavailable,
+        write_one=lambda record_id, patch: one_by_one.append(record_id),
+    )
+    _deliver(consumer, 1, 1)
+    _deliver(consumer, 2, 2)
+
+    fn, args = executor.jobs[0]
+    fn(*args)
+
+    # no per-doc retry during an outage, and nothing is dropped
+    assert one_by_one == []
+    assert channel.acks == []
+    assert sorted(channel.nacks) == [(1, True), (2, True)]
+    assert consumer.pending() == 0
+
+
+def test_malformed_message_is_dropped_without_stalling_the_batch():
+    channel = FakeChannel()
+    executor = ManualExecutor()
+    writes = []
+    consumer = BatchingConsumer(
+        FakeConnection(), channel, executor, batch_size=2, write_batch=lambda p: writes.append(sorted(p))
+    )
+    body = json.dumps({"id": 1, "objects": ["dog"], "interpretation": None}).encode()
+    consumer.on_message(SimpleNamespace(delivery_tag=1), None, body)
+    _deliver(consumer, 2, 2)
+
+    fn, args = executor.jobs[0]
+    fn(*args)
+
+    assert writes == [["2"]]
+    assert channel.nacks == [(1, False)]
+    assert channel.acks == [(2, False)]
+    assert consumer.pending() == 0
@@ -0,0 +1,130 @@
+import json
+import threading
+
+import pika.exceptions
+
+from deepsymbol.queue import PostprocessPublisher
+
+
+class FakeBroker:
+    """
+    In-process stand-in for RabbitMQ: records published bodies per queue and
+    can refuse the first N connection attempts.
+    """
+
+    def __init__(self, fail_connects: int = 0):
+        self.fail_connects = fail_connects
+        self.connects = 0
+        self.queues: dict[str, list[bytes]] = {}
+        self.lock = threading.Lock()
+
+    def connect(self):
+        with self.lock:
+            self.connects += 1
+            if self.fail_connects > 0:
+                self.fail_connects -= 1
+                raise pika.exceptions.AMQPConnectionError("broker down")
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+
+    def channel(self):
+        return FakeChannel(self.broker)
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeChannel:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.confirming = False
+
+    def queue_declare(self, queue, durable=False, arguments=None):
+        self.broker.queues.setdefault(queue, [])
+
+    def confirm_delivery(self):
+        self.confirming = True
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        assert properties.delivery_mode == 2
+        with self.broker.lock:
+            self.broker.queues[routing_key].append(body)
+
+
+def test_reuses_one_connection_for_many_messages():
+    broker = FakeBroker()
+    publisher = PostprocessPublisher(connection_factory=broker.connect, queue_name="pp")
+
+    futures = [publisher.publish({"id": i}) for i in range(50)]
+    for f in futures:
+        f.result(timeout=5)
+    publisher.close()
+
+    assert broker.connects == 1
+    assert [json.loads(b)["id"] for b in broker.queues["pp"]] == list(range(50))
+
+
+def test_reconnects_with_backoff_without_losing_messages():
+    broker = FakeBroker(fail_connects=2)
+    publisher = PostprocessPublisher(connection_factory=broker.connect, queue_name="pp", confirms=True)
+
+    fut = publisher.publish({"id": 7, "objects": ["dog"]})
+    fut.result(timeout=10)
+    publisher.close()
+
+    assert broker.connects == 3
+    assert json.loads(broker.queues["pp"][0]) == {"id": 7, "objects": ["dog"]}
+
+
+def test_close_fails_pending_messages_when_broker_is_down():
+    broker = FakeBroker(fail_connects=1000)
+    publisher = PostprocessPublisher(connection_factory=broker.connect, queue_name="pp")
+
+    fut = publisher.publish({"id": 1})
+    publisher.close(timeout=5)
+
+    assert isinstance(fut.exception(timeout=5), RuntimeError)
+
+
+def _enqueue(publisher, payload):
+    # what publish() queues, without starting the publisher thread
+    from concurrent.futures import Future
+
+    fut = Future()
+    publisher._pending.put((json.dumps(payload).encode(), fut, 0.0, None, None))
+    return fut
+
+
+def test_messages_of_callers_that_gave_up_are_skipped():
+    broker = FakeBroker()
+    publisher = PostprocessPublisher(connection_factory=broker.connect, queue_name="pp")
+    gone = _enqueue(publisher, {"id": 1})
+    kept = _enqueue(publisher, {"id": 2})
+    gone.cancel()  # e.g. the HTTP client disconnected while awaiting it
+
+    publisher._publish_batch(publisher._next_batch())
+
+    assert kept.result(timeout=0) is None
+    assert [json.loads(b)["id"] for b in broker.queues["pp"]] == [2]
+    assert broker.connects == 1
+
+
+def test_fail_all_skips_cancelled_futures_and_fails_the_rest():
+    publisher = PostprocessPublisher(connection_factory=FakeBroker().connect, queue_name="pp")
+    gone = _enqueue(publisher, {"id": 1})
+    waiting = _enqueue(publisher, {"id": 2})
+    gone.cancel()
+
+    publisher._fail_all([], RuntimeError("broker down"))
+
+    assert gone.cancelled()
+    assert isinstance(waiting.exception(timeout=0), RuntimeError)
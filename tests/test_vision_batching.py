@@ -0,0 +1,148 @@
+import threading
+
+import pytest
+
+
+def test_concurrent_requests_share_one_forward_pass(monkeypatch):
+    from deepsymbol import vision
+
+    calls = []
+
+    def fake_detect_batch(sources):
+        calls.append(list(sources))
+        return [{"objects": [s], "confidences": [1.0], "num_objects": 1} for s in sources]
+
+    monkeypatch.setattr(vision, "_detect_batch", fake_detect_batch)
+
+    batcher = vision.DetectionBatcher(max_batch_size=4, max_wait_ms=200)
+    # block the worker until all requests are queued
+    gate = threading.Event()
+    original_collect = batcher._collect
+
+    def gated_collect():
+        gate.wait()
+        return original_collect()
+
+    batcher._collect = gated_collect
+
+    futures = [batcher.submit(f"img{i}.jpg") for i in range(4)]
+    gate.set()
+    results = [f.result(timeout=5) for f in futures]
+
+    assert len(calls) == 1
+    assert [r["objects"] for r in results] == [["img0.jpg"], ["img1.jpg"], ["img2.jpg"], ["img3.jpg"]]
+
+
+def test_batch_errors_propagate_to_every_caller(monkeypatch):
+    from deepsymbol import vision
+
+    def broken(sources):
+        raise RuntimeError("model exploded")
+
+    monkeypatch.setattr(vision, "_detect_batch", broken)
+
+    batcher = vision.DetectionBatcher(max_batch_size=2, max_wait_ms=50)
+    futures = [batcher.submit("a.jpg"), batcher.submit("b.jpg")]
+    for f in futures:
+        with pytest.raises(RuntimeError):
+            f.result(timeout=5)
+
+
+def test_cancelled_caller_is_dropped_without_killing_the_batcher(monkeypatch):
+    from deepsymbol import vision
+
+    calls = []
+
+    def fake_detect_batch(sources):
+        calls.append(list(sources))
+        return [{"objects": [s], "confidences": [1.0], "num_objects": 1} for s in sources]
+
+    monkeypatch.setattr(vision, "_detect_batch", fake_detect_batch)
+
+    batcher = vision.DetectionBatcher(max_batch_size=4, max_wait_ms=200)
+    gate = threading.Event()
+    original_collect = batcher._collect
+
+    def gated_collect():
+        gate.wait()
+        return original_collect()
+
+    batcher._collect = gated_collect
+
+    # e.g. asyncio.wrap_future cancelling the future when the client disconnects
+    gone = batcher.submit("gone.jpg")
+    kept = batcher.submit("kept.jpg")
+    assert gone.cancel()
+    gate.set()
+
+    assert kept.result(timeout=5)["objects"] == ["kept.jpg"]
+    assert calls == [["kept.jpg"]]
+    # the worker thread is still alive and serving
+    assert batcher.submit("next.jpg").result(timeout=5)["objects"] == ["next.jpg"]
+
+
+def test_detect_objects_decodes_bytes_buffer_and_array(monkeypatch):
+    import io
+
+    import numpy as np
+
+    from deepsymbol import vision
+
+    seen = []
+
+    def fake_detect_batch(sources):
+        seen.extend(sources)
+        return [{"objects": [], "confidences": [], "num_objects": 0} for _ in sources]
+
+    monkeypatch.setattr(vision, "_detect_batch", fake_detect_batch)
+    monkeypatch.setattr(vision, "_batcher", vision.DetectionBatcher(max_batch_size=1, max_wait_ms=0))
+
+    with open("data/test.jpg", "rb") as f:
+        data = f.read()
+
+    vision.detect_objects(data)
+    vision.detect_objects(io.BytesIO(data))
+    vision.detect_objects(np.zeros((32, 32, 3), dtype=np.uint8))
+
+    assert len(seen) == 3
+    assert all(isinstance(s, np.ndarray) and s.ndim == 3 for s in seen)
+
+    with pytest.raises(ValueError):
+        vision.detect_objects(b"not an image")
+
+
+def test_oversized_images_are_downscaled_and_classes_resolved(monkeypatch):
+    import numpy as np
+
+    from deepsymbol import vision
+
+    big = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    assert vision.downscale(big, max_side=1000).shape == (750, 1000, 3)
+    small = np.zeros((100, 200, 3), dtype=np.uint8)
+    assert vision.downscale(small, max_side=1000) is small
+
+    names = {0: "person", 16: "dog"}
+    assert vision.class_ids(names, []) is None
+    assert vision.class_ids(names, ["Dog", "person"]) == [0, 16]
+    with pytest.raises(RuntimeError):
+        vision.class_ids(names, ["unicorn"])
+
+
+def test_warm_up_rejects_unknown_detect_classes_before_inference(monkeypatch):
+    from types import SimpleNamespace
+
+    from deepsymbol import vision
+
+    ran = []
+    monkeypatch.setattr(vision, "DETECTOR_BACKEND", "torch")
+    monkeypatch.setattr(vision, "get_yolo_model", lambda: SimpleNamespace(names={0: "person", 16: "dog"}))
+    monkeypatch.setattr(vision, "_detect_batch", lambda sources: ran.append(sources) or [{}])
+
+    monkeypatch.setattr(vision, "CLASSES", ["dog", "unicorn"])
+    with pytest.raises(RuntimeError, match="unicorn"):
+        vision.warm_up()
+    assert ran == []
+
+    monkeypatch.setattr(vision, "CLASSES", ["dog"])
+    assert set(vision.warm_up()) == {"detector_load", "detector_warmup"}
+    assert len(ran) == 1
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from deepsymbol import vision_onnx
+
+
+def _anchor(cx, cy, w, h, scores):
+    return [cx, cy, w, h, *scores]
+
+
+def test_postprocess_applies_threshold_and_per_class_nms():
+    names = {0: "person", 1: "dog"}
+    anchors = [
+        _anchor(100, 100, 50, 50, [0.9, 0.0]),  # person
+        _anchor(102, 101, 50, 50, [0.8, 0.0]),  # same person, suppressed by NMS
+        _anchor(101, 100, 50, 50, [0.0, 0.6]),  # dog overlapping the person: kept (other class)
+        _anchor(400, 400, 30, 30, [0.1, 0.2]),  # below the confidence threshold
+        _anchor(300, 300, 40, 40, [0.95, 0.0]),  # second person elsewhere
+    ]
+    pred = np.array([anchors], dtype=np.float32).transpose(0, 2, 1)  # (1, 4 + classes, anchors)
+
+    [result] = vision_onnx.postprocess(pred, names)
+
+    assert result["objects"] == ["person", "person", "dog"]
+    assert result["confidences"] == pytest.approx([0.95, 0.9, 0.6])
+    assert result["num_objects"] == 3
+
+
+def test_preprocess_letterboxes_to_square_rgb():
+    img = np.zeros((100, 200, 3), dtype=np.uint8)
+    img[..., 0] = 255  # blue in BGR
+
+    batch = vision_onnx.preprocess([img, img], size=64)
+
+    assert batch.shape == (2, 3, 64, 64)
+    assert batch.dtype == np.float32
+    assert batch[0, 2, 32, 32] == 1.0  # blue ends up in the last (RGB) channel
+    assert batch[0, 0, 0, 0] == pytest.approx(114 / 255)  # padding
+
+
+def test_onnx_backend_matches_torch_backend(tmp_path):
+    pytest.importorskip("onnxruntime")
+    ultralytics = pytest.importorskip("ultralytics")
+
+    from deepsymbol import vision
+
+    image = vision.decode_image(open("data/test.jpg", "rb").read())
+    results = ultralytics.YOLO(vision._MODEL_PATH)([image], device="cpu", verbose=False)
+    expected = vision._result_to_dict(results[0])
+
+    path = vision_onnx.export_onnx(vision._MODEL_PATH, output=str(tmp_path / "yolo11n.onnx"))
+    actual = vision_onnx.OnnxDetector(path)([image])[0]
+
+    assert sorted(actual["objects"]) == sorted(expected["objects"])
+    assert sorted(actual["confidences"]) == pytest.approx(sorted(expected["confidences"]), abs=0.05)
+
+
+def test_postprocess_class_allow_list():
+    names = {0: "person", 1: "dog"}
+    anchors = [_anchor(100, 100, 50, 50, [0.9, 0.0]), _anchor(300, 300, 50, 50, [0.0, 0.8])]
+    pred = np.array([anchors], dtype=np.float32).transpose(0, 2, 1)
+
+    [result] = vision_onnx.postprocess(pred, names, classes=[1])
+
+    assert result["objects"] == ["dog"]
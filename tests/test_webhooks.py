@@ -0,0 +1,72 @@
+import hashlib
+import hmac
+import socket
+
+import pytest
+
+from deepsymbol import webhooks
+
+
+def _resolve_to(monkeypatch, *addresses):
+    def fake_getaddrinfo(host, port, proto=0):
+        return [(socket.AF_INET, socket.SOCK_STREAM, proto, "", (a, port)) for a in addresses]
+
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo", fake_getaddrinfo)
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_SECRET", "s3cret")
+    monkeypatch.setattr(webhooks, "ALLOWED_HOSTS", [])
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "http://127.0.0.1:8080/hook",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://10.0.0.5/hook",
+        "http://[::1]/hook",
+        "http://[::ffff:192.168.1.1]/hook",
+        "ftp://example.com/hook",
+    ],
+)
+def test_rejects_non_public_targets(url):
+    with pytest.raises(ValueError):
+        webhooks.check_callback_url(url)
+
+
+def test_rejects_names_resolving_to_internal_services(monkeypatch):
+    # e.g. "bitnet" inside the compose network, or a public name with one private record
+    _resolve_to(monkeypatch, "93.184.216.34", "172.18.0.4")
+    with pytest.raises(ValueError, match="non-public"):
+        webhooks.check_callback_url("http://bitnet:8080/v1/chat/completions")
+
+
+def test_accepts_public_targets_and_allow_listed_hosts(monkeypatch):
+    _resolve_to(monkeypatch, "93.184.216.34")
+    webhooks.check_callback_url("https://hooks.example.com/deepsymbol")
+
+    monkeypatch.setattr(webhooks, "ALLOWED_HOSTS", [".internal.test"])
+    _resolve_to(monkeypatch, "10.1.2.3")
+    webhooks.check_callback_url("http://receiver.internal.test/hook")
+    # the allow-list only adds hosts: unlisted ones still need public addresses
+    with pytest.raises(ValueError, match="non-public"):
+        webhooks.check_callback_url("http://other.example.net/hook")
+    _resolve_to(monkeypatch, "93.184.216.34")
+    webhooks.check_callback_url("https://hooks.example.com/deepsymbol")
+
+
+def test_callbacks_are_refused_without_a_secret(monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_SECRET", "")
+    _resolve_to(monkeypatch, "93.184.216.34")
+    with pytest.raises(ValueError, match="disabled"):
+        webhooks.check_callback_url("https://hooks.example.com/deepsymbol")
+
+
+def test_signature_covers_timestamp_and_body():
+    body = b'{"job_id": "j1", "status": "done"}'
+    headers = webhooks.sign(body, timestamp=1700000000)
+
+    expected = hmac.new(b"s3cret", b"1700000000." + body, hashlib.sha256).hexdigest()
+    assert headers == {"X-DeepSymbol-Timestamp": "1700000000", "X-DeepSymbol-Signature": f"sha256={expected}"}